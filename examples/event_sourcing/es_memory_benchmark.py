@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compare redis memory usage of the event store pk codecs.
+
+Events of random pks are added at the same timestamp, so they all land
+in one key with every namespace, and the memory of the key is reported
+by ``MEMORY USAGE`` (redis >= 4.0)::
+
+    $ python es_memory_benchmark.py -r redis://localhost:6379/15 -n 1000000
+
+Run it against an empty test db, it's flushed after every codec.
+"""
+
+import argparse
+import random
+import time
+
+from meepo.apps.eventsourcing.codec import IntCodec, StrCodec, TupleCodec
+from meepo.apps.eventsourcing.codec import short_namespace
+from meepo.apps.eventsourcing.event_store import RedisEventStore
+
+
+CODECS = [
+    ("str", StrCodec(), lambda pk: pk),
+    ("int4", IntCodec(width=4), lambda pk: pk),
+    ("int8", IntCodec(width=8), lambda pk: pk),
+    ("str tuple", StrCodec(), lambda pk: "%s:%s" % (pk, pk % 7)),
+    ("tuple IH", TupleCodec("IH"), lambda pk: (pk, pk % 7)),
+]
+
+
+def main(redis_dsn, num, max_pk):
+    now = int(time.time())
+    pks = [random.randrange(max_pk) for _ in range(num)]
+
+    for namespace in (None, short_namespace()):
+        for name, codec, make_pk in CODECS:
+            es = RedisEventStore(redis_dsn, namespace=namespace, codec=codec)
+            es.r.flushdb()
+
+            start = time.time()
+            for i in range(0, num, 1000):
+                es.add_many([("order_update", make_pk(pk), now)
+                             for pk in pks[i:i + 1000]])
+            elapsed = time.time() - start
+
+            key = es._keygen("order_update", now)
+            members = es.r.zcard(key)
+            usage = es.r.execute_command("MEMORY", "USAGE", key)
+            print("%-28s %-10s %9d members %12d bytes %6.1f B/member "
+                  "%8.0f adds/s" % (key, name, members, usage,
+                                    usage / float(members), num / elapsed))
+            es.r.flushdb()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("-r", "--redis_dsn",
+                        default="redis://localhost:6379/15")
+    parser.add_argument("-n", "--num", type=int, default=100000,
+                        help="events per codec.")
+    parser.add_argument("--max_pk", type=int, default=2 ** 31,
+                        help="pks are in [0, max_pk).")
+    args = parser.parse_args()
+    main(args.redis_dsn, args.num, args.max_pk)
@@ -3,23 +3,28 @@
 from __future__ import absolute_import
 
 
-__all__ = ["pickle", "urlparse", "Empty"]
+__all__ = ["PY3", "pickle", "urlparse", "urlopen", "Request", "Empty",
+           "integer_types"]
 
 import sys
 PY3 = sys.version_info[0] >= 3
 
 if PY3:
     from urllib.parse import urlparse
+    from urllib.request import urlopen, Request
     from queue import Empty
     import pickle
 
     bytes = bytes
     str = str
+    integer_types = (int, )
 
 else:
     from urlparse import urlparse
+    from urllib2 import urlopen, Request
     from Queue import Empty
     import cPickle as pickle
 
     bytes = str
     str = unicode  # noqa
+    integer_types = (int, long)  # noqa
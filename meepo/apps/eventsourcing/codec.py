@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pk codecs of :class:`RedisEventStore`.
+
+With hundreds of millions of events a day, the sorted set members, i.e.
+the pks, dominate redis memory. A codec encodes pks into compact members
+on write and decodes them back on replay and query::
+
+    event_store = RedisEventStore(redis_dsn, codec=IntCodec(),
+                                  namespace=short_namespace())
+
+Small sorted sets are listpack encoded by redis, which already stores
+integer-like string members as integers, so the saving mostly comes from
+large, skiplist encoded sets. Run ``examples/event_sourcing/
+es_memory_benchmark.py`` to compare codecs for your pks.
+
+The codec of a store must not change while its keys alive, members of
+different codecs can't be decoded by each other.
+"""
+
+from __future__ import absolute_import
+
+import struct
+
+from ..._compat import bytes, str
+from ...utils import s
+
+
+class StrCodec(object):
+    """Default codec, pks are stored as strings and replayed as str.
+    """
+    def encode(self, pk):
+        if isinstance(pk, (bytes, str)):
+            return pk
+        return "%s" % (pk,)
+
+    def decode(self, member):
+        return s(member)
+
+
+class TupleCodec(StrCodec):
+    """Fixed width binary codec of composite pks, pks are packed with
+    ``struct`` format fmt, e.g. ``TupleCodec(">IH")`` for
+    ``(user_id, seq)`` pks costs 6 bytes per member.
+
+    Pks are replayed as tuples.
+
+    :param fmt: struct format, big endian by default so members of the
+     same score are ordered the same as pks.
+    """
+    def __init__(self, fmt):
+        if fmt[0] not in "@=<>!":
+            fmt = ">%s" % fmt
+        self.struct = struct.Struct(fmt)
+
+    def encode(self, pk):
+        return self.struct.pack(*[int(p) for p in pk])
+
+    def decode(self, member):
+        return self.struct.unpack(member)
+
+
+class IntCodec(TupleCodec):
+    """Fixed width binary codec of unsigned int pks, pks are replayed as
+    int.
+
+    :param width: bytes per pk, 4 for pks less than 2 ** 32, or 8.
+    """
+    def __init__(self, width=8):
+        if width not in (4, 8):
+            raise ValueError("width should be 4 or 8")
+        super(IntCodec, self).__init__(">I" if width == 4 else ">Q")
+
+    def encode(self, pk):
+        return self.struct.pack(int(pk))
+
+    def decode(self, member):
+        return self.struct.unpack(member)[0]
+
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _base36(n):
+    digits = []
+    while True:
+        n, r = divmod(n, 36)
+        digits.append(_DIGITS[r])
+        if not n:
+            return "".join(reversed(digits))
+
+
+def short_namespace(prefix="es", span=3600*24):
+    """Short-key namespace func, namespaces are the prefix and the base36
+    index of the span since epoch, e.g. ``es:4mo`` for a day, instead of
+    ``meepo:redis_es:20260101``.
+
+    :param prefix: key prefix.
+    :param span: seconds a namespace spans, namespaces are aligned to UTC.
+    """
+    return lambda ts: "%s:%s" % (prefix, _base36(int(ts) // span))
@@ -2,21 +2,61 @@
 
 from __future__ import absolute_import
 
+import array
+import bisect
+import collections
+import heapq
+import itertools
 import logging
+import sqlite3
+import threading
 import time
 
 import redis
 
-from ...utils import s, d
+from ...utils import d
+from .codec import StrCodec
+from .shard import RedisShards
 
 
 class EventStore(object):
     def __init__(self):
         pass
 
+    def _keygen(self, event, ts=None):
+        """Generate key for event at timestamp.
+
+        :param event: event name
+        :param ts: timestamp, default to current timestamp if left as None
+        """
+        return "%s:%s" % (self.namespace(ts or time.time()), event)
+
+    def _namespace_keys(self, event, ts, end_ts, step):
+        """Distinct keys of the namespaces covering ts to end_ts, in time
+        order.
+
+        Namespaces older than ``end_ts - ttl`` are expired, so they are not
+        probed if the store has a ttl.
+        """
+        ttl = getattr(self, "ttl", None)
+        if ttl:
+            ts = max(ts, end_ts - ttl)
+
+        keys = []
+        for t in itertools.chain(range(int(ts), int(end_ts), step),
+                                 [end_ts]):
+            key = "%s:%s" % (self.namespace(t), event)
+            # namespaces are monotonic in ts
+            if not keys or keys[-1] != key:
+                keys.append(key)
+        return keys
+
     def add(self, event, pk, ts=None):
         raise NotImplementedError
 
+    def add_many(self, events):
+        return all([self.add(event, pk, ts) for event, pk, ts in events])
+
     def replay(self, event, ts=0, end_ts=None, with_ts=False):
         raise NotImplementedError
 
@@ -96,39 +136,81 @@ class RedisEventStore(EventStore):
 
         event_store.query("test_write", 1, ts=some_value)
 
+    **Sharding**
+
+    Pass a list of redis uris to shard keys across redis nodes by
+    consistent hashing of the namespaced key, every key stays intact on
+    one node. Batch apis like :meth:`add_many` and :meth:`replay_many`
+    send one pipeline per node, in parallel::
+
+        event_store = RedisEventStore(["redis://10.0.0.1/",
+                                       "redis://10.0.0.2/"])
+
+    **Compact Encoding**
+
+    Pass a codec from :mod:`meepo.apps.eventsourcing.codec` to store pks
+    as packed binary members, and a short namespace to shorten keys,
+    pks are decoded on replay and query::
+
+        event_store = RedisEventStore(redis_dsn, codec=IntCodec(width=4),
+                                      namespace=short_namespace())
+
     .. note::
 
         The redis event store class is compat with twemproxy.
 
-    :param redis_dsn: the redis instance uri
+    :param redis_dsn: the redis instance uri, or list of uris to shard
+     keys across.
     :param namespace: namespace func for event key, the func should accept
      event timestamp and return namespace of the func. namespace also
      accepts str type arg, which will always return the same namespace
      for all timestamps.
     :param ttl: expiration time for events stored, default to 3 days.
     :param socket_timeout: redis socket timeout
+    :param codec: pk codec, default to :class:`StrCodec` which stores pks
+     as strings.
     :param kwargs: kwargs to be passed to redis instance init func.
     """
 
     LUA_TIME = "return tonumber(redis.call('TIME')[1])"
-    LUA_ZADD = ' '.join("""
-    local score = redis.call('ZSCORE', KEYS[1], ARGV[2])
-    if score and tonumber(ARGV[1]) <= tonumber(score) then
-        return 0
-    else
-        redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
-        return 1
+    LUA_ADD = ' '.join("""
+    if redis.replicate_commands then
+        redis.replicate_commands()
     end
+    local now
+    local added = 0
+    for i = 2, #ARGV, 2 do
+        local ts = tonumber(ARGV[i])
+        if not ts then
+            now = now or tonumber(redis.call('TIME')[1])
+            ts = now
+        end
+        local score = redis.call('ZSCORE', KEYS[1], ARGV[i + 1])
+        if not score or ts > tonumber(score) then
+            redis.call('ZADD', KEYS[1], ts, ARGV[i + 1])
+            added = added + 1
+        end
+    end
+    local ttl = tonumber(ARGV[1])
+    if added > 0 and ttl and ttl > 0 then
+        redis.call('EXPIRE', KEYS[1], ttl)
+    end
+    return added
     """.split())
 
     def __init__(self, redis_dsn, namespace=None, ttl=3600*24*3,
-                 socket_timeout=1, **kwargs):
+                 socket_timeout=1, codec=None, **kwargs):
         super(RedisEventStore, self).__init__()
 
-        self.r = redis.StrictRedis.from_url(
+        self.shards = RedisShards(
             redis_dsn, socket_timeout=socket_timeout, **kwargs)
+        self.r = self.shards.nodes[0]
         self.ttl = ttl
+        self.codec = codec or StrCodec()
         self.logger = logging.getLogger("meepo.redis_es")
+        self._add_script = self.r.register_script(self.LUA_ADD)
+        # whether redis server supports ZMSCORE, None for not known yet
+        self._zmscore = None
 
         if namespace is None:
             self.namespace = lambda ts: "meepo:redis_es:%s" % d(ts, "%Y%m%d")
@@ -137,30 +219,30 @@ class RedisEventStore(EventStore):
         elif callable(namespace):
             self.namespace = namespace
 
-    def _keygen(self, event, ts=None):
-        """Generate redis key for event at timestamp.
-
-        :param event: event name
-        :param ts: timestamp, default to current timestamp if left as None
-        """
-        return "%s:%s" % (self.namespace(ts or time.time()), event)
-
     def _time(self):
         """Redis lua func to get timestamp from redis server, use this func to
         prevent time inconsistent across servers.
         """
         return self.r.eval(self.LUA_TIME, 1, 1)
 
-    def _zadd(self, key, pk, ts=None, ttl=None):
+    def _zadd(self, key, pk, ts=None, ttl=None, client=None):
         """Redis lua func to add an event to the corresponding sorted set.
 
+        The script is sent with ``EVALSHA``, reads the timestamp from redis
+        server if ts not given, and refreshes key expiration in the same
+        round trip.
+
         :param key: the key to be stored in redis server
         :param pk: the primary key of event
         :param ts: timestamp of the event, default to redis_server's
          current timestamp
         :param ttl: the expiration time of event since the last update
+        :param client: redis client or pipeline to run the script with.
         """
-        return self.r.eval(self.LUA_ZADD, 1, key, ts or self._time(), pk)
+        return self._add_script(keys=[key],
+                                args=[ttl or "", ts or "",
+                                      self.codec.encode(pk)],
+                                client=client)
 
     def add(self, event, pk, ts=None, ttl=None):
         """Add an event to event store.
@@ -172,12 +254,14 @@ class RedisEventStore(EventStore):
         :param pk: the primary key of event
         :param ts: timestamp of the event, default to redis_server's
          current timestamp
-        :param ttl: the expiration time of event since the last update
+        :param ttl: the expiration time of event since the last update,
+         default to the ttl of event store.
         :return: bool
         """
         key = self._keygen(event, ts)
         try:
-            self._zadd(key, pk, ts, ttl)
+            self._zadd(key, pk, ts, self.ttl if ttl is None else ttl,
+                       client=self.shards.node(key))
             return True
         except redis.ConnectionError as e:
             # connection error typically happens when redis server can't be
@@ -187,6 +271,63 @@ class RedisEventStore(EventStore):
                 "redis event store failed with connection error %r" % e)
             return False
 
+    def add_many(self, events, ttl=None, chunk_size=1000):
+        """Add events to event store in batch.
+
+        Events are grouped by their namespaced keys, and every key is
+        written with one script call for many pks, all calls to a redis
+        node are sent in one pipeline, i.e. one round trip unless the
+        script has to be loaded first::
+
+            event_store.add_many([("test_write", 1, None),
+                                  ("test_update", 2, 1024)])
+
+        :param events: iterable of (event, pk, ts) tuples, ts can be None
+         to use redis_server's current timestamp.
+        :param ttl: the expiration time of events since the last update,
+         default to the ttl of event store.
+        :param chunk_size: max pks in one script call.
+        :return: bool
+        """
+        keys = collections.defaultdict(list)
+        for event, pk, ts in events:
+            keys[self._keygen(event, ts)].extend(
+                (ts or "", self.codec.encode(pk)))
+        if not keys:
+            return True
+
+        ttl = self.ttl if ttl is None else ttl
+
+        def _execute(node, node_keys):
+            # EVALSHA is queued directly, a Script object in pipeline costs
+            # an extra SCRIPT EXISTS round trip on every execute
+            with node.pipeline(transaction=False) as p:
+                for key in node_keys:
+                    args = keys[key]
+                    for j in range(0, len(args), chunk_size * 2):
+                        p.evalsha(self._add_script.sha, 1, key, ttl or "",
+                                  *args[j:j + chunk_size * 2])
+                p.execute()
+
+        def _add(node_keys):
+            i, node_keys = node_keys
+            node = self.shards.nodes[i]
+            try:
+                _execute(node, node_keys)
+            except redis.exceptions.NoScriptError:
+                # script cache flushed or a new node, adding again is safe
+                # as events are only updated by newer ts
+                node.script_load(self.LUA_ADD)
+                _execute(node, node_keys)
+
+        try:
+            self.shards.map(_add, self.shards.group(keys).items())
+            return True
+        except redis.ConnectionError as e:
+            self.logger.error(
+                "redis event store failed with connection error %r" % e)
+            return False
+
     def replay(self, event, ts=0, end_ts=None, with_ts=False):
         """Replay events based on timestamp.
 
@@ -202,12 +343,65 @@ class RedisEventStore(EventStore):
         """
         key = self._keygen(event, ts)
         end_ts = end_ts if end_ts else "+inf"
-        elements = self.r.zrangebyscore(key, ts, end_ts, withscores=with_ts)
+        elements = self.shards.node(key).zrangebyscore(
+            key, ts, end_ts, withscores=with_ts)
 
+        decode = self.codec.decode
         if not with_ts:
-            return [s(e) for e in elements]
+            return [decode(e) for e in elements]
         else:
-            return [(s(e[0]), int(e[1])) for e in elements]
+            return [(decode(e[0]), int(e[1])) for e in elements]
+
+    def _iter_key(self, key, ts, end_ts, page_size):
+        """Page through events of key in score order, yield (ts, pk).
+
+        Pages are located by the last score seen and the number of events
+        seen with that score, instead of a growing offset.
+        """
+        r = self.shards.node(key)
+        min_score, offset = ts, 0
+        while True:
+            page = r.zrangebyscore(key, min_score, end_ts, start=offset,
+                                   num=page_size, withscores=True)
+            for pk, score in page:
+                yield int(score), self.codec.decode(pk)
+            if len(page) < page_size:
+                return
+
+            last = page[-1][1]
+            same = sum(1 for _, score in page if score == last)
+            offset = offset + same if last == min_score else same
+            min_score = last
+
+    def replay_iter(self, event, ts, end_ts=None, with_ts=False,
+                    page_size=1000, step=3600):
+        """Replay events across namespaces lazily.
+
+        Unlike :meth:`replay`, which only reads the namespace ts falls
+        into, this walks every namespace the time range covers, pages
+        through each with ``ZRANGEBYSCORE ... LIMIT`` and merges them in
+        timestamp order, so memory usage doesn't grow with the number of
+        events::
+
+            for pk in event_store.replay_iter("test_write", ts=yesterday):
+                ...
+
+        A pk updated in several namespaces is yielded once per namespace.
+
+        :param event: event name
+        :param ts: replay events after ts.
+        :param end_ts: replay events to ts, default to now.
+        :param with_ts: yield (pk, ts) tuples instead of pks.
+        :param page_size: max events read in one request.
+        :param step: seconds between timestamps used to probe namespaces,
+         should be no larger than the span of a namespace.
+        :return: generator of pks, or (pk, ts) tuples if with_ts is True.
+        """
+        end_ts = end_ts if end_ts else int(time.time())
+        iters = [self._iter_key(key, ts, end_ts, page_size)
+                 for key in self._namespace_keys(event, ts, end_ts, step)]
+        for pk_ts, pk in heapq.merge(*iters):
+            yield (pk, pk_ts) if with_ts else pk
 
     def query(self, event, pk, ts=None):
         """Query the last update timestamp of an event pk.
@@ -221,13 +415,672 @@ class RedisEventStore(EventStore):
          all span of current namespace.
         """
         key = self._keygen(event, ts)
-        pk_ts = self.r.zscore(key, pk)
+        pk_ts = self.shards.node(key).zscore(key, self.codec.encode(pk))
         return int(pk_ts) if pk_ts else None
 
+    def query_many(self, event, pks, ts=None, chunk_size=1000):
+        """Query the last update timestamps of many pks of an event.
+
+        Uses ``ZMSCORE`` if redis server supports it (redis >= 6.2),
+        otherwise falls back to pipelined ``ZSCORE``, either way in one
+        round trip per ``chunk_size`` pks.
+
+        :param event: the event name.
+        :param pks: list of pks for query.
+        :param ts: timestamp used to locate the namespace.
+        :param chunk_size: max pks in one ``ZMSCORE``.
+        :return: list of int timestamps or None, in the order of pks.
+        """
+        key = self._keygen(event, ts)
+        r = self.shards.node(key)
+        pks = [self.codec.encode(pk) for pk in pks]
+        scores = []
+        for i in range(0, len(pks), chunk_size):
+            chunk = pks[i:i + chunk_size]
+            if self._zmscore is not False:
+                try:
+                    scores.extend(
+                        r.execute_command("ZMSCORE", key, *chunk))
+                    self._zmscore = True
+                    continue
+                except redis.ResponseError:
+                    if self._zmscore:
+                        raise
+                    self._zmscore = False
+            with r.pipeline(transaction=False) as p:
+                for pk in chunk:
+                    p.zscore(key, pk)
+                scores.extend(p.execute())
+        return [int(float(score)) if score else None for score in scores]
+
+    def replay_many(self, events, ts=0, end_ts=None, with_ts=False):
+        """Replay many events in one pipeline per redis node, refer to
+        :meth:`replay`.
+
+        :param events: list of event names.
+        :return: dict of event -> list of pks, or list of (pk, ts) tuples
+         when with_ts is True.
+        """
+        end_ts = end_ts if end_ts else "+inf"
+        keys = dict((self._keygen(event, ts), event) for event in events)
+
+        def _replay(node_keys):
+            i, node_keys = node_keys
+            with self.shards.nodes[i].pipeline(transaction=False) as p:
+                for key in node_keys:
+                    p.zrangebyscore(key, ts, end_ts, withscores=with_ts)
+                return zip(node_keys, p.execute())
+
+        results = {}
+        for node_results in self.shards.map(
+                _replay, self.shards.group(keys).items()):
+            for key, elements in node_results:
+                results[keys[key]] = elements
+        results = [results[event] for event in events]
+
+        decode = self.codec.decode
+        if not with_ts:
+            return dict((event, [decode(e) for e in elements])
+                        for event, elements in zip(events, results))
+        return dict((event, [(decode(e[0]), int(e[1])) for e in elements])
+                    for event, elements in zip(events, results))
+
+    def clear(self, event, ts=None):
+        """Clear all stored record of event.
+
+        :param event: event name to be cleared.
+        :param ts: timestamp used locate the namespace
+        """
+        key = self._keygen(event, ts)
+        return self.shards.node(key).delete(key)
+
+    def close(self):
+        """Release the threads used to talk to redis nodes in parallel."""
+        self.shards.close()
+
+
+class RollingRedisEventStore(RedisEventStore):
+    """RedisEventStore with one key per event and rolling retention.
+
+    Instead of a key per namespace expiring as a whole, every event is
+    stored in a single key, and events older than ``ttl`` are trimmed
+    continuously from a background thread, so :meth:`replay` and
+    :meth:`query` always hit one key no matter the time range, and memory
+    stays flat::
+
+        event_store = RollingRedisEventStore(redis_dsn, ttl=3600*24)
+        event_store.replay("test_write", ts=time.time() - 3600)
+
+    The trimmer removes at most ``chunk_size`` events with one script call
+    and at most ``max_rate`` events per second, so it never blocks redis
+    for long. Only keys added since the process started are trimmed,
+    keys no longer written are still removed by expiry ``ttl`` seconds
+    after the last update.
+
+    :param redis_dsn: the redis instance uri, or list of uris.
+    :param namespace: namespace str, default to
+     ``meepo:redis_es:rolling``.
+    :param ttl: retention of events, default to 3 days.
+    :param trim_interval: seconds between trims.
+    :param chunk_size: max events removed in one script call.
+    :param max_rate: max events removed per second.
+    :param kwargs: kwargs to be passed to :class:`RedisEventStore`.
+    """
+
+    LUA_TRIM = ' '.join("""
+    local pks = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1],
+                           'LIMIT', 0, ARGV[2])
+    if #pks > 0 then
+        redis.call('ZREM', KEYS[1], unpack(pks))
+    end
+    return #pks
+    """.split())
+
+    def __init__(self, redis_dsn, namespace="meepo:redis_es:rolling",
+                 ttl=3600*24*3, trim_interval=60, chunk_size=500,
+                 max_rate=10000, **kwargs):
+        if not isinstance(namespace, str):
+            raise ValueError("namespace should be str")
+        super(RollingRedisEventStore, self).__init__(
+            redis_dsn, namespace=namespace, ttl=ttl, **kwargs)
+
+        self.trim_interval = trim_interval
+        self.chunk_size = chunk_size
+        self.max_rate = max_rate
+        self._trim_script = self.r.register_script(self.LUA_TRIM)
+        self._keys = set()
+
+        if trim_interval:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def add(self, event, pk, ts=None, ttl=None):
+        self._keys.add(self._keygen(event))
+        return super(RollingRedisEventStore, self).add(event, pk, ts, ttl)
+
+    def add_many(self, events, ttl=None, chunk_size=1000):
+        events = list(events)
+        self._keys.update(self._keygen(event) for event, _, _ in events)
+        return super(RollingRedisEventStore, self).add_many(
+            events, ttl, chunk_size)
+
+    def _trim_key(self, key, cutoff):
+        """Remove events of key not newer than cutoff chunk by chunk.
+
+        :return: number of events removed.
+        """
+        node = self.shards.node(key)
+        removed = 0
+        while True:
+            n = self._trim_script(keys=[key], args=[cutoff, self.chunk_size],
+                                  client=node)
+            removed += n
+            if n < self.chunk_size:
+                return removed
+            if self.max_rate:
+                time.sleep(float(n) / self.max_rate)
+
+    def trim(self, event=None):
+        """Remove events older than ttl.
+
+        :param event: the event to trim, default to all events added.
+        :return: number of events removed.
+        """
+        keys = [self._keygen(event)] if event else list(self._keys)
+        cutoff = self._time() - self.ttl - 1
+        return sum(self._trim_key(key, cutoff) for key in keys)
+
+    def _run(self):
+        while True:
+            time.sleep(self.trim_interval)
+            try:
+                n = self.trim()
+                if n:
+                    self.logger.info("%s expired events trimmed" % n)
+            except Exception as e:
+                self.logger.exception(e)
+
+
+class _MemoryKey(object):
+    """Events of a key, pk -> ts dict for query, and a ts sorted array
+    with a parallel pk list for range replay.
+    """
+    __slots__ = ("scores", "tss", "pks", "expire_at")
+
+    def __init__(self):
+        self.scores = {}
+        self.tss = array.array("d")
+        self.pks = []
+        self.expire_at = None
+
+
+class InMemoryEventStore(EventStore):
+    """EventStore in process memory, with the same semantics as
+    :class:`RedisEventStore`: an event is only updated by a newer ts, keys
+    are separated by namespace and expire ``ttl`` seconds after the last
+    update.
+
+    Every key keeps a pk -> ts dict for query, and a ts sorted array with
+    a parallel pk list for range replay by bisect. It can be used in tests
+    and benchmarks without redis, or as a local cache in front of redis.
+
+    :param namespace: namespace str or func, refer to
+     :class:`RedisEventStore`.
+    :param ttl: expiration time for events stored, default to 3 days.
+    """
+    def __init__(self, namespace=None, ttl=3600*24*3):
+        super(InMemoryEventStore, self).__init__()
+        self.ttl = ttl
+
+        if namespace is None:
+            self.namespace = lambda ts: "meepo:memory_es:%s" % d(
+                ts, "%Y%m%d")
+        elif isinstance(namespace, str):
+            self.namespace = lambda ts: namespace
+        elif callable(namespace):
+            self.namespace = namespace
+
+        # key -> _MemoryKey
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, create=False):
+        entry = self._keys.get(key)
+        if entry is not None and entry.expire_at and \
+                entry.expire_at <= time.time():
+            del self._keys[key]
+            entry = None
+        if entry is None and create:
+            entry = self._keys[key] = _MemoryKey()
+        return entry
+
+    def _pos(self, entry, ts, pk):
+        """Position of (ts, pk) in the sorted index of entry."""
+        tss, pks = entry.tss, entry.pks
+        lo = bisect.bisect_left(tss, ts)
+        hi = bisect.bisect_right(tss, ts, lo)
+        return bisect.bisect_left(pks, pk, lo, hi)
+
+    def add(self, event, pk, ts=None, ttl=None):
+        """Add an event, refer to :meth:`RedisEventStore.add`.
+
+        :return: bool
+        """
+        key = self._keygen(event, ts)
+        pk, ts = "%s" % (pk,), int(ts or time.time())
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            entry = self._get(key, create=True)
+            scores, tss, pks = entry.scores, entry.tss, entry.pks
+            old = scores.get(pk)
+            if old is not None:
+                if ts <= old:
+                    return True
+                i = self._pos(entry, old, pk)
+                del tss[i]
+                del pks[i]
+
+            scores[pk] = ts
+            i = self._pos(entry, ts, pk)
+            tss.insert(i, ts)
+            pks.insert(i, pk)
+            if ttl:
+                entry.expire_at = time.time() + ttl
+        return True
+
+    def replay(self, event, ts=0, end_ts=None, with_ts=False):
+        """Replay events, refer to :meth:`RedisEventStore.replay`."""
+        key = self._keygen(event, ts)
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                return []
+            tss, pks = entry.tss, entry.pks
+            lo = bisect.bisect_left(tss, ts)
+            hi = bisect.bisect_right(tss, end_ts) if end_ts else len(tss)
+            if not with_ts:
+                return pks[lo:hi]
+            return [(pk, int(t)) for pk, t in zip(pks[lo:hi], tss[lo:hi])]
+
+    def query(self, event, pk, ts=None):
+        """Query the last update ts of pk, refer to
+        :meth:`RedisEventStore.query`.
+        """
+        with self._lock:
+            entry = self._get(self._keygen(event, ts))
+            return entry.scores.get("%s" % (pk,)) if entry else None
+
+    def clear(self, event, ts=None):
+        """Clear all stored record of event.
+
+        :param event: event name to be cleared.
+        :param ts: timestamp used locate the namespace
+        """
+        with self._lock:
+            return int(self._keys.pop(self._keygen(event, ts), None)
+                       is not None)
+
+    def sweep(self):
+        """Remove all expired keys, keys are otherwise only removed when
+        accessed.
+        """
+        with self._lock:
+            for key in list(self._keys):
+                self._get(key)
+
+
+class SQLiteEventStore(EventStore):
+    """EventStore on a local sqlite database, for single node deployments
+    without redis.
+
+    Events are kept in an ``events`` table with ``(event, pk)`` as primary
+    key and an index on ``(event, ts, pk)``, so replays are read in index
+    order without sorting, the event column holds the
+    namespaced key as in :class:`RedisEventStore`. Same as the redis
+    store, an event is only updated by a newer ts::
+
+        event_store = SQLiteEventStore("/data/events.db")
+        event_store.add("test_write", 1)
+        event_store.replay("test_write")
+
+    The database is opened in WAL mode, so replays don't block writes,
+    each thread uses its own connection. Every :meth:`add` is a
+    transaction, use :meth:`add_many`, or wrap the store with
+    :class:`BufferedEventStore`, to write many events in one transaction.
+
+    Unlike redis keys, events expire ``ttl`` seconds after their own ts,
+    they're deleted by sweeps run every ``sweep_interval`` seconds in a
+    background thread. A sweep deletes in small transactions, so writers
+    never wait long for the lock.
+
+    :param path: sqlite database file path.
+    :param namespace: namespace str or func, refer to
+     :class:`RedisEventStore`.
+    :param ttl: expiration time for events stored, default to 3 days, set
+     to None to keep events forever.
+    :param sweep_interval: seconds between expiry sweeps.
+    :param timeout: seconds to wait for the database lock.
+    """
+    def __init__(self, path, namespace=None, ttl=3600*24*3,
+                 sweep_interval=60, timeout=5):
+        super(SQLiteEventStore, self).__init__()
+        self.path = path
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.timeout = timeout
+        self.logger = logging.getLogger("meepo.sqlite_es")
+
+        if namespace is None:
+            self.namespace = lambda ts: "meepo:sqlite_es:%s" % d(
+                ts, "%Y%m%d")
+        elif isinstance(namespace, str):
+            self.namespace = lambda ts: namespace
+        elif callable(namespace):
+            self.namespace = namespace
+
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS events (event TEXT NOT NULL, "
+                "pk TEXT NOT NULL, ts INTEGER NOT NULL, "
+                "PRIMARY KEY (event, pk))")
+            # replaced by events_replay which covers the replay order
+            conn.execute("DROP INDEX IF EXISTS events_ts")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS events_replay "
+                "ON events (event, ts, pk)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS events_expire ON events (ts)")
+
+        if ttl:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _conn(self):
+        """Connection of the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(
+                self.path, timeout=self.timeout)
+            # fsync on checkpoints only, a crash may lose the last commits
+            # but never corrupts the database in WAL mode
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def add(self, event, pk, ts=None):
+        """Add an event, refer to :meth:`RedisEventStore.add`.
+
+        :return: bool
+        """
+        return self.add_many([(event, pk, ts)])
+
+    def add_many(self, events):
+        """Add events in one transaction.
+
+        :param events: iterable of (event, pk, ts) tuples, ts can be None
+         to use current timestamp.
+        :return: bool
+        """
+        now = int(time.time())
+        rows = [(self._keygen(event, ts), "%s" % (pk,), int(ts or now))
+                for event, pk, ts in events]
+        try:
+            with self._conn() as conn:
+                # upsert if newer, without relying on ON CONFLICT which
+                # old sqlite versions lack
+                conn.executemany(
+                    "INSERT OR IGNORE INTO events (event, pk, ts) "
+                    "VALUES (?, ?, ?)", rows)
+                conn.executemany(
+                    "UPDATE events SET ts = ? "
+                    "WHERE event = ? AND pk = ? AND ts < ?",
+                    [(ts, key, pk, ts) for key, pk, ts in rows])
+            return True
+        except sqlite3.OperationalError as e:
+            # typically database locked by other writers for too long
+            self.logger.error(
+                "sqlite event store failed with error %r" % e)
+            return False
+
+    def _select(self, key, ts, end_ts):
+        sql = "SELECT pk, ts FROM events WHERE event = ? AND ts >= ?"
+        args = [key, ts]
+        if end_ts:
+            sql += " AND ts <= ?"
+            args.append(end_ts)
+        return self._conn().execute(sql + " ORDER BY ts, pk", args)
+
+    def replay(self, event, ts=0, end_ts=None, with_ts=False):
+        """Replay events, refer to :meth:`RedisEventStore.replay`."""
+        rows = self._select(self._keygen(event, ts), ts, end_ts)
+        if not with_ts:
+            return [pk for pk, _ in rows]
+        return rows.fetchall()
+
+    def replay_iter(self, event, ts, end_ts=None, with_ts=False,
+                    step=3600):
+        """Replay events across namespaces lazily from a cursor, refer to
+        :meth:`RedisEventStore.replay_iter`.
+        """
+        end_ts = end_ts if end_ts else int(time.time())
+        # namespaces are ordered by ts, so one key after another keeps the
+        # (ts, pk) order while each is read in index order
+        for key in self._namespace_keys(event, ts, end_ts, step):
+            for pk, pk_ts in self._select(key, ts, end_ts):
+                yield (pk, pk_ts) if with_ts else pk
+
+    def query(self, event, pk, ts=None):
+        """Query the last update ts of pk, refer to
+        :meth:`RedisEventStore.query`.
+        """
+        row = self._conn().execute(
+            "SELECT ts FROM events WHERE event = ? AND pk = ?",
+            (self._keygen(event, ts), "%s" % (pk,))).fetchone()
+        return row[0] if row else None
+
     def clear(self, event, ts=None):
         """Clear all stored record of event.
 
         :param event: event name to be cleared.
         :param ts: timestamp used locate the namespace
         """
-        return self.r.delete(self._keygen(event, ts))
+        with self._conn() as conn:
+            cursor = conn.execute("DELETE FROM events WHERE event = ?",
+                                  (self._keygen(event, ts),))
+        return int(cursor.rowcount > 0)
+
+    def sweep(self, chunk_size=1000, pause=0.005):
+        """Delete events older than ttl.
+
+        :param chunk_size: max events deleted in one transaction.
+        :param pause: seconds to sleep between transactions, writers
+         waiting for the lock only poll it every few milliseconds and
+         would keep missing it without a pause.
+        :return: number of events deleted.
+        """
+        cutoff = int(time.time() - self.ttl)
+        conn = self._conn()
+        deleted = 0
+        while True:
+            with conn:
+                cursor = conn.execute(
+                    "DELETE FROM events WHERE rowid IN (SELECT rowid "
+                    "FROM events WHERE ts < ? LIMIT ?)", (cutoff, chunk_size))
+            deleted += cursor.rowcount
+            if cursor.rowcount < chunk_size:
+                return deleted
+            time.sleep(pause)
+
+    def _run(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                n = self.sweep()
+                if n:
+                    self.logger.info("%s expired events deleted" % n)
+            except Exception as e:
+                self.logger.exception(e)
+
+
+class BufferedEventStore(EventStore):
+    """Write-behind wrapper of an event store.
+
+    Events added are collected in memory, deduplicated by (event, pk)
+    keeping the latest ts, and written to the wrapped store with
+    ``add_many`` from a background thread, every ``interval`` seconds or
+    when ``max_size`` events pending::
+
+        event_store = BufferedEventStore(RedisEventStore(redis_dsn))
+        event_store.add("test_write", 1)
+
+        # write all pending events before shutdown
+        event_store.flush()
+
+    At most ``max_pending`` events are kept in memory. :meth:`add` and
+    :meth:`add_many` never write to the wrapped store, new events are
+    dropped when full, e.g. the wrapped store is down. Events of a failed
+    write are put back to be retried in the next flush if there's room, or
+    dropped otherwise, and the background flush backs off from
+    ``interval`` up to ``max_backoff`` seconds until a write succeeds.
+    Counters of ``added``, ``flushed``, ``failures``, ``dropped`` and
+    ``overflow`` (calls with events dropped) are kept in ``stats``.
+
+    Reads are passed through to the wrapped store, so pending events are
+    not visible to them until flushed.
+
+    :param store: the wrapped :class:`EventStore`.
+    :param max_size: max pending events before an immediate flush.
+    :param interval: max seconds an event waits before written.
+    :param max_pending: max events kept in memory.
+    :param max_backoff: max seconds to wait after a failed flush.
+    """
+    def __init__(self, store, max_size=1000, interval=0.1,
+                 max_pending=100000, max_backoff=5):
+        super(BufferedEventStore, self).__init__()
+        self.store = store
+        self.max_size = max_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.stats = collections.Counter()
+        self.logger = logging.getLogger("meepo.buffered_es")
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._full = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _merge(self, key, ts):
+        """Merge ts of key into pending, keep the latest ts, None means the
+        store's current time so it's always the latest.
+
+        :return: False if the key is new and there's no room for it.
+        """
+        if key in self._pending:
+            old = self._pending[key]
+            if old is not None and (ts is None or ts > old):
+                self._pending[key] = ts
+            return True
+        if len(self._pending) >= self.max_pending:
+            return False
+        self._pending[key] = ts
+        if len(self._pending) == 1:
+            self._ready.set()
+        if len(self._pending) >= self.max_size:
+            self._full.set()
+        return True
+
+    def add(self, event, pk, ts=None):
+        """Add an event to buffer.
+
+        :return: bool, False if the buffer is full and the event dropped.
+        """
+        return self.add_many([(event, pk, ts)])
+
+    def add_many(self, events):
+        """Add events to buffer, refer to :meth:`add`.
+
+        :return: bool, False if the buffer is full and any event dropped.
+        """
+        dropped = []
+        with self._lock:
+            for event, pk, ts in events:
+                if self._merge((event, pk), ts):
+                    self.stats["added"] += 1
+                else:
+                    dropped.append((event, pk))
+        if not dropped:
+            return True
+
+        # never flush in the caller, the store may be down
+        self.stats["overflow"] += 1
+        self.stats["dropped"] += len(dropped)
+        self.logger.error("buffer full, %s events dropped: %s" % (
+            len(dropped), dropped))
+        return False
+
+    def flush(self):
+        """Write all pending events to the wrapped store synchronously.
+
+        :return: bool, whether the write succeeded.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._ready.clear()
+                self._full.clear()
+            if not pending:
+                return True
+
+            events = [(event, pk, ts) for (event, pk), ts in pending.items()]
+            try:
+                ok = self.store.add_many(events)
+            except Exception as e:
+                self.logger.exception(e)
+                ok = False
+            if ok:
+                self.stats["flushed"] += len(events)
+                return True
+
+            self.stats["failures"] += 1
+            with self._lock:
+                for key, ts in pending.items():
+                    if not self._merge(key, ts):
+                        self.stats["dropped"] += 1
+            self.logger.error("flush %s events failed" % len(events))
+            return False
+
+    def _run(self):
+        backoff = self.interval
+        while True:
+            self._ready.wait()
+            self._full.wait(self.interval)
+            if self.flush():
+                backoff = self.interval
+            else:
+                # failed events are put back and may fill the buffer again,
+                # don't retry at once
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def replay(self, *args, **kwargs):
+        return self.store.replay(*args, **kwargs)
+
+    def query(self, *args, **kwargs):
+        return self.store.query(*args, **kwargs)
+
+    def clear(self, *args, **kwargs):
+        return self.store.clear(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
@@ -24,6 +24,7 @@ import time
 import redis
 
 from ...utils import d, s
+from .shard import RedisShards
 
 
 class PrepareCommit(object):
@@ -74,7 +75,8 @@ class RedisPrepareCommit(PrepareCommit):
     This prepare commit records sqlalchemy session, and should be used with
     :func:`sqlalchemy_es_pub`.
 
-    :param redis_dsn: the redis instance uri
+    :param redis_dsn: the redis instance uri, or list of uris to shard keys
+     across, refer to :class:`RedisEventStore`.
     :param strict: by default the exceptions happened in middle of
      prepare-commit will only be caught and logged as error, but the
      process continue to execute. If strict set to True, the exception
@@ -89,8 +91,9 @@ class RedisPrepareCommit(PrepareCommit):
                  socket_timeout=1, **kwargs):
         super(RedisPrepareCommit, self).__init__()
 
-        self.r = redis.StrictRedis.from_url(
+        self.shards = RedisShards(
             redis_dsn, socket_timeout=socket_timeout, **kwargs)
+        self.r = self.shards.nodes[0]
         self.strict = strict
         self.ttl = ttl
         self.logger = logging.getLogger("meepo.prepare_commit.redis_pc")
@@ -117,7 +120,8 @@ class RedisPrepareCommit(PrepareCommit):
         :return: phase "prepare" or "commit"
         """
         sp_key, _ = self._keygen(session)
-        if self.r.sismember(sp_key, session.meepo_unique_id):
+        if self.shards.node(sp_key).sismember(
+                sp_key, session.meepo_unique_id):
             return "prepare"
         else:
             return "commit"
@@ -148,10 +152,10 @@ class RedisPrepareCommit(PrepareCommit):
         pickled_event = {
             k: pickle.dumps({_get_dump_value(obj) for obj in objs})
             for k, objs in event.items()}
-        with self.r.pipeline(transaction=False) as p:
-            p.sadd(sp_key, session.meepo_unique_id)
-            p.hmset(sp_hkey, pickled_event)
-            p.execute()
+        p, hp = self.shards.pipelines([sp_key, sp_hkey])
+        p.sadd(sp_key, session.meepo_unique_id)
+        hp.hmset(sp_hkey, pickled_event)
+        self.shards.execute([p, hp])
 
     @_redis_strict_pc
     def commit(self, session):
@@ -160,10 +164,10 @@ class RedisPrepareCommit(PrepareCommit):
         :param session: sqlalchemy session
         """
         sp_key, sp_hkey = self._keygen(session)
-        with self.r.pipeline(transaction=False) as p:
-            p.srem(sp_key, session.meepo_unique_id)
-            p.expire(sp_hkey, 60 * 60)
-            p.execute()
+        p, hp = self.shards.pipelines([sp_key, sp_hkey])
+        p.srem(sp_key, session.meepo_unique_id)
+        hp.expire(sp_hkey, 60 * 60)
+        self.shards.execute([p, hp])
     # we don't need to specially deal with rollback in this phase
     rollback = commit
 
@@ -174,7 +178,7 @@ class RedisPrepareCommit(PrepareCommit):
         :return: set of session unique ids
         """
         _, sp_hkey = self._keygen(session)
-        picked_event = self.r.hgetall(sp_hkey)
+        picked_event = self.shards.node(sp_hkey).hgetall(sp_hkey)
         event = {s(k): pickle.loads(v) for k, v in picked_event.items()}
         return event
 
@@ -185,7 +189,7 @@ class RedisPrepareCommit(PrepareCommit):
         :return: set of session unique ids
         """
         sp_key = "%s:session_prepare" % self.namespace(ts or int(time.time()))
-        return set(s(m) for m in self.r.smembers(sp_key))
+        return set(s(m) for m in self.shards.node(sp_key).smembers(sp_key))
 
     def clear(self, ts=None):
         """Clear all session in prepare phase.
@@ -193,4 +197,8 @@ class RedisPrepareCommit(PrepareCommit):
         :param ts: timestamp used locate the namespace
         """
         sp_key = "%s:session_prepare" % self.namespace(ts or int(time.time()))
-        return self.r.delete(sp_key)
+        return self.shards.node(sp_key).delete(sp_key)
+
+    def close(self):
+        """Release the threads used to talk to redis nodes in parallel."""
+        self.shards.close()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shard redis keys of eventsourcing across redis nodes.
+
+Keys are routed by ketama consistent hashing of the whole key, so a key
+always stays intact on one node and commands on a single key work as
+usual, while adding a node only moves about ``1 / len(nodes)`` of keys.
+"""
+
+from __future__ import absolute_import
+
+import collections
+
+import ketama
+import redis
+
+
+class RedisShards(object):
+    """A set of redis nodes with keys routed by consistent hashing.
+
+    :param redis_dsn: the redis instance uri, or list of uris.
+    :param socket_timeout: redis socket timeout
+    :param kwargs: kwargs to be passed to redis instance init func.
+    """
+    def __init__(self, redis_dsn, socket_timeout=1, **kwargs):
+        if isinstance(redis_dsn, (list, tuple)):
+            self.dsns = list(redis_dsn)
+        else:
+            self.dsns = [redis_dsn]
+        if not self.dsns:
+            raise ValueError("redis_dsn should not be empty")
+
+        self.nodes = [redis.StrictRedis.from_url(
+            dsn, socket_timeout=socket_timeout, **kwargs)
+            for dsn in self.dsns]
+
+        self._ring = None
+        if len(self.nodes) > 1:
+            self._ring = ketama.Continuum()
+            for i, dsn in enumerate(self.dsns):
+                self._ring[dsn] = i
+        self._pool = None
+
+    def index(self, key):
+        """Index of the node key routed to."""
+        if self._ring is None:
+            return 0
+        return self._ring[key]
+
+    def node(self, key):
+        """Redis client of the node key routed to."""
+        return self.nodes[self.index(key)]
+
+    def group(self, keys):
+        """Group keys by node.
+
+        :return: dict of node index -> list of keys.
+        """
+        groups = collections.defaultdict(list)
+        for key in keys:
+            groups[self.index(key)].append(key)
+        return groups
+
+    def pipelines(self, keys):
+        """Non-transactional pipelines for keys, keys on the same node share
+        one pipeline.
+
+        :return: list of pipelines in the order of keys.
+        """
+        pipes = {}
+        for i in set(self.index(key) for key in keys):
+            pipes[i] = self.nodes[i].pipeline(transaction=False)
+        return [pipes[self.index(key)] for key in keys]
+
+    def map(self, func, items):
+        """Call func with every item, in parallel threads if more than one
+        item and node, exceptions are raised to the caller.
+
+        The thread pool is created on first use, call :meth:`close` to
+        release its threads.
+
+        :return: list of results in the order of items.
+        """
+        items = list(items)
+        if len(items) <= 1 or len(self.nodes) <= 1:
+            return [func(item) for item in items]
+
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(len(self.nodes))
+        return self._pool.map(func, items)
+
+    def close(self):
+        """Terminate the thread pool, :meth:`map` creates a new one if
+        called again.
+        """
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    def execute(self, pipes):
+        """Execute distinct pipelines in parallel."""
+        distinct = []
+        for p in pipes:
+            if not any(p is q for q in distinct):
+                distinct.append(p)
+        try:
+            return self.map(lambda p: p.execute(), distinct)
+        finally:
+            for p in distinct:
+                p.reset()
@@ -2,19 +2,23 @@
 
 from __future__ import absolute_import
 
+import atexit
 import datetime
-import functools
-import itertools
 import logging
 
 from ...signals import signal
 
-from .event_store import RedisEventStore
+from .event_store import (
+    BufferedEventStore,
+    RedisEventStore,
+    RollingRedisEventStore,
+)
 from .prepare_commit import RedisPrepareCommit
 
 
 def redis_es_sub(session, tables, redis_dsn, strict=False,
-                 namespace=None, ttl=3600*24*3, socket_timeout=1):
+                 namespace=None, ttl=3600*24*3, socket_timeout=1,
+                 buffered=False, codec=None, rolling=False):
     """Redis EventSourcing sub.
 
     This sub should be used together with sqlalchemy_es_pub, it will
@@ -22,6 +26,9 @@ def redis_es_sub(session, tables, redis_dsn, strict=False,
     pattern in :func:`sqlalchemy_es_pub` to ensure 100% security on
     events recording.
 
+    Events of a commit are received with the ``session_batch`` signal and
+    added with one pipelined :meth:`RedisEventStore.add_many` call.
+
     :param session: the sqlalchemy to bind the signal
     :param tables: tables to be event sourced.
     :param redis_dsn: the redis server to store event sourcing events.
@@ -33,6 +40,15 @@ def redis_es_sub(session, tables, redis_dsn, strict=False,
      accept timestamp as arg and return a string namespace.
     :param ttl: expiration time for events stored, default to 3 days.
     :param socket_timeout: redis socket timeout.
+    :param buffered: write events behind with :class:`BufferedEventStore`,
+     so commit only costs a dict insert per event. Pending events are
+     flushed at exit, events are dropped with an error log if the buffer
+     is full while redis is down.
+    :param codec: pk codec of the event store, refer to
+     :mod:`meepo.apps.eventsourcing.codec`.
+    :param rolling: keep events of the last ``ttl`` seconds in one key per
+     event with :class:`RollingRedisEventStore`, namespace should be a str
+     or None in this case.
     """
     logger = logging.getLogger("meepo.sub.redis_es_sub")
 
@@ -40,21 +56,31 @@ def redis_es_sub(session, tables, redis_dsn, strict=False,
         raise ValueError("tables should be list or set")
 
     # install event store hook for tables
-    event_store = RedisEventStore(
-        redis_dsn, namespace=namespace, ttl=ttl, socket_timeout=socket_timeout)
+    if rolling:
+        event_store = RollingRedisEventStore(
+            redis_dsn, namespace=namespace or "meepo:redis_es:rolling",
+            ttl=ttl, socket_timeout=socket_timeout, codec=codec)
+    else:
+        event_store = RedisEventStore(
+            redis_dsn, namespace=namespace, ttl=ttl,
+            socket_timeout=socket_timeout, codec=codec)
+    if buffered:
+        event_store = BufferedEventStore(event_store)
+        atexit.register(event_store.flush)
+
+    def _es_batch_sub(session, event):
+        events = [(evt, pk, None) for evt, pks in event.items()
+                  if evt.rsplit("_", 1)[0] in tables for pk in pks]
+        if not events:
+            return
 
-    def _es_event_sub(pk, event):
-        if event_store.add(event, str(pk)):
-            logger.info("%s: %s -> %s" % (
-                event, pk, datetime.datetime.now()))
+        if event_store.add_many(events):
+            logger.info("%s events -> %s" % (
+                len(events), datetime.datetime.now()))
         else:
-            logger.error("event sourcing failed: %s" % pk)
+            logger.error("event sourcing failed: %s" % events)
 
-    events = ("%s_%s" % (tb, action) for tb, action in
-              itertools.product(*[tables, ["write", "update",  "delete"]]))
-    for event in events:
-        sub_func = functools.partial(_es_event_sub, event=event)
-        signal(event).connect(sub_func, weak=False)
+    signal("session_batch").connect(_es_batch_sub, sender=session, weak=False)
 
     # install prepare-commit hook
     prepare_commit = RedisPrepareCommit(
@@ -5,34 +5,10 @@
 
 from __future__ import absolute_import
 
-__all__ = ["QueueReplicator", "RqReplicator"]
-
-import logging
-import zmq
-
-zmq_ctx = zmq.Context()
-
-
-class Replicator(object):
-    """Replicator base class.
-    """
-    def __init__(self, listen=None, name="meepo.replicator.zmq"):
-        """
-        :param listen: zeromq dsn to connect, can be a list
-        """
-        # replicator logger naming
-        self.name = name
-        self.logger = logging.getLogger(name)
-
-        self.listen = listen
-        self.socket = zmq_ctx.socket(zmq.SUB)
-
-    def run(self):
-        raise NotImplementedError()
-
-    def event(self):
-        raise NotImplementedError()
-
+__all__ = ["Replicator", "QueueReplicator", "RqReplicator",
+           "RedisStreamReplicator"]
 
+from .base import Replicator
 from .queue import QueueReplicator
 from .rq import RqReplicator
+from .redis_stream import RedisStreamReplicator
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import logging
+import zmq
+
+from zmq.utils.strtypes import asbytes
+
+from ... import protocol
+
+zmq_ctx = zmq.Context()
+
+
+class Replicator(object):
+    """Replicator base class.
+
+    By default the replicator subscribes to a zmq pub socket and receives
+    all messages of its registered topics.
+
+    To consume a partitioned :func:`meepo.sub.zmq.zmq_sub`, pass the full
+    list of partition endpoints as ``listen`` and the partitions claimed
+    by this replicator as ``partitions``, the replicator will connect a
+    PULL socket to the claimed endpoints only::
+
+        endpoints = ["tcp://host:5001", "tcp://host:5002", "tcp://host:5003"]
+
+        # on machine a
+        QueueReplicator(endpoints, partitions=[0, 1])
+        # on machine b
+        QueueReplicator(endpoints, partitions=[2])
+
+    Every partition should be claimed by exactly one replicator to keep the
+    per-pk ordering.
+    """
+    def __init__(self, listen=None, name="meepo.replicator.zmq",
+                 partitions=None):
+        """
+        :param listen: zeromq dsn to connect, can be a list
+        :param partitions: indexes of claimed partitions in listen, leave
+         None to subscribe a zmq pub socket.
+        """
+        # replicator logger naming
+        self.name = name
+        self.logger = logging.getLogger(name)
+
+        self.listen = listen
+        self.partitions = partitions
+        self.socket = self._socket()
+
+    def _socket(self):
+        if self.partitions is None:
+            return zmq_ctx.socket(zmq.SUB)
+        if not isinstance(self.listen, list):
+            raise ValueError("listen should be list of partitions")
+        return zmq_ctx.socket(zmq.PULL)
+
+    def subscribe(self, topic):
+        """Subscribe topic, no-op for partitioned replicator since PULL
+        socket receives all topics of the claimed partitions.
+        """
+        if self.partitions is None:
+            self.socket.setsockopt(zmq.SUBSCRIBE, asbytes(topic))
+
+    def connect(self):
+        """Connect to upstream endpoints.
+        """
+        if self.partitions is not None:
+            endpoints = [self.listen[i] for i in self.partitions]
+        elif isinstance(self.listen, list):
+            endpoints = self.listen
+        else:
+            endpoints = [self.listen]
+
+        for endpoint in endpoints:
+            self.socket.connect(endpoint)
+
+    def recv(self):
+        """Receive a message from upstream.
+
+        Both string protocol and binary protocol are supported, a single
+        frame message is decoded as string protocol and a multipart message
+        as binary protocol, refer to :mod:`meepo.protocol` for details.
+        Compressed binary messages are decompressed transparently.
+
+        :return: (topic, pks) tuple, or (None, []) if msg corrupt.
+        """
+        # receive without copy, binary msg will be decoded in place
+        frames = self.socket.recv_multipart(copy=False)
+        if len(frames) == 1:
+            msg = frames[0].bytes
+            topic, pks = protocol.decode_string(msg)
+            if not pks:
+                self.logger.error("msg corrupt -> %s" % msg)
+            return topic, pks
+
+        try:
+            msg = protocol.decode([f.buffer for f in frames])
+        except protocol.ProtocolError as e:
+            self.logger.error("msg corrupt -> %s" % e)
+            return None, []
+        return msg.topic, msg.pks
+
+    def run(self):
+        raise NotImplementedError()
+
+    def event(self):
+        raise NotImplementedError()
@@ -3,12 +3,10 @@
 from __future__ import absolute_import
 
 import ketama
-import zmq
 
 from multiprocessing import Queue
-from zmq.utils.strtypes import asbytes
 
-from . import Replicator
+from .base import Replicator
 from .worker import WorkerPool
 
 
@@ -27,6 +25,8 @@ class QueueReplicator(Replicator):
         # init workers
         self.workers = {}
         self.worker_queues = {}
+        # queue of tokens acked by workers, refer to :class:`Worker`
+        self.ack_queue = None
 
     def event(self, *topics, **kwargs):
         """Topic callback registry.
@@ -57,11 +57,18 @@ class QueueReplicator(Replicator):
                 self.worker_queues[topic] = hash_ring
                 self.workers[topic] = WorkerPool(
                     queues, topic, func, multi=multi, queue_limit=queue_limit,
-                    logger_name="%s.%s" % (self.name, topic))
-                self.socket.setsockopt(zmq.SUBSCRIBE, asbytes(topic))
+                    logger_name="%s.%s" % (self.name, topic),
+                    ack_queue=self.ack_queue)
+                self.subscribe(topic)
             return func
         return wrapper
 
+    def dispatch(self, topic, pks):
+        """Put pks into the worker queues of topic.
+        """
+        for pk in pks:
+            self.worker_queues[topic][str(hash(pk))].put(pk)
+
     def run(self):
         """Run the replicator.
 
@@ -70,27 +77,16 @@ class QueueReplicator(Replicator):
         for worker_pool in self.workers.values():
             worker_pool.start()
 
-        if isinstance(self.listen, list):
-            for i in self.listen:
-                self.socket.connect(i)
-        else:
-            self.socket.connect(self.listen)
+        self.connect()
 
         try:
             while True:
-                msg = self.socket.recv_string()
-                lst = msg.split()
-                if len(lst) == 2:
-                    topic, pks = lst[0], [lst[1], ]
-                elif len(lst) > 2:
-                    topic, pks = lst[0], lst[1:]
-                else:
-                    self.logger.error("msg corrupt -> %s" % msg)
+                topic, pks = self.recv()
+                if not pks or topic not in self.worker_queues:
                     continue
 
                 self.logger.debug("replicator: {0} -> {1}".format(topic, pks))
-                for pk in pks:
-                    self.worker_queues[topic][str(hash(pk))].put(pk)
+                self.dispatch(topic, pks)
         except Exception as e:
             self.logger.exception(e)
         finally:
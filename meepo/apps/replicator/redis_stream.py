@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import collections
+import socket
+
+from multiprocessing import Queue
+
+import redis
+
+from ... import protocol
+from ..._compat import Empty
+from ...sub.redis_stream import stream_key
+from ...utils import s
+from .queue import QueueReplicator
+
+
+def _fields(raw):
+    """Stream entry fields may be parsed as dict or returned as flat list
+    depending on redis client version.
+    """
+    if isinstance(raw, dict):
+        return dict((s(k), v) for k, v in raw.items())
+    return dict((s(raw[i]), raw[i + 1]) for i in range(0, len(raw), 2))
+
+
+class RedisStreamReplicator(QueueReplicator):
+    """Replicator consuming redis streams written by
+    :func:`meepo.sub.redis_stream.redis_stream_sub`.
+
+    The replicator reads streams with ``XREADGROUP`` in a consumer group,
+    so multiple replicators with different consumer names share the load.
+    The callbacks are registered the same as :class:`QueueReplicator`::
+
+        repl = RedisStreamReplicator("redis://localhost/", "cache",
+                                     consumer="worker-1")
+
+        @repl.event("test_update", workers=3, multi=True)
+        def task(pks):
+            return [True for _ in pks]
+
+        repl.run()
+
+    An entry is acked after the callbacks on all its pks returned True, or
+    failed more than ``max_retry_count`` times. The workers report done
+    pks back through :attr:`ack_queue`, so an entry is never acked while
+    its pks only sit in the worker queues. Unacked entries of the consumer
+    are re-delivered when the replicator restarts, which gives
+    at-least-once delivery.
+
+    In partitioned mode, pass the claimed partition indexes as
+    ``partitions``, the replicator reads these partition streams and
+    dispatch all registered topics in them.
+
+    :param redis_dsn: the redis instance uri
+    :param group: consumer group name.
+    :param consumer: consumer name in group, default to hostname.
+    :param prefix: stream key prefix.
+    :param partitions: claimed partitions, leave None to read the streams
+     of tables of the registered topics.
+    :param count: max entries read in one ``XREADGROUP``.
+    :param block: max milliseconds to block in ``XREADGROUP``.
+    :param start: the stream id the group starts from if the group not
+     exists, default to "$" which only reads new entries.
+    :param socket_timeout: redis socket timeout, should be larger than
+     block.
+    """
+    def __init__(self, redis_dsn, group, consumer=None, prefix="meepo:stream",
+                 partitions=None, count=500, block=1000, start="$",
+                 socket_timeout=5, name="meepo.replicator.redis_stream",
+                 **kwargs):
+        super(RedisStreamReplicator, self).__init__(
+            name=name, partitions=partitions)
+
+        self.r = redis.StrictRedis.from_url(
+            redis_dsn, socket_timeout=socket_timeout, **kwargs)
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.prefix = prefix
+        self.count = count
+        self.block = block
+        self.start = start
+
+        if partitions is None:
+            self.streams = []
+        else:
+            self.streams = ["%s:p%s" % (prefix, i) for i in partitions]
+
+        self._buffer = collections.deque()
+        self._acks = []
+        self.ack_queue = Queue()
+        # entry returned by the last recv and not dispatched yet
+        self._entry = None
+        # dispatched entry -> count of pks not done
+        self._pending = {}
+        # re-deliver pending entries of this consumer first, paging
+        # forward from the last id read of every stream
+        self._recovering = True
+        self._recover_ids = {}
+
+    def _socket(self):
+        return None
+
+    def subscribe(self, topic):
+        if self.partitions is None:
+            key = stream_key(self.prefix, topic)
+            if key not in self.streams:
+                self.streams.append(key)
+
+    def connect(self):
+        """Create consumer group of streams if not exists.
+        """
+        for key in self.streams:
+            try:
+                self.r.execute_command(
+                    "XGROUP", "CREATE", key, self.group, self.start,
+                    "MKSTREAM")
+            except redis.ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    def _done(self, entry, n=1):
+        left = self._pending.pop(entry, n) - n
+        if left > 0:
+            self._pending[entry] = left
+        else:
+            self._acks.append(entry)
+
+    def dispatch(self, topic, pks):
+        """Put pks of the entry returned by last :meth:`recv` into the
+        worker queues, tagged with the entry so the workers can ack it.
+
+        An entry already waiting for its workers is not dispatched again.
+        """
+        entry, self._entry = self._entry, None
+        if entry in self._pending:
+            return
+        self._pending[entry] = len(pks)
+        for pk in pks:
+            self.worker_queues[topic][str(hash(pk))].put((pk, entry))
+
+    def ack(self):
+        """Ack the entries done by workers, and the entries returned by
+        :meth:`recv` but not dispatched, i.e. skipped.
+        """
+        while True:
+            try:
+                entries = self.ack_queue.get_nowait()
+            except Empty:
+                break
+            for entry in entries:
+                self._done(entry)
+
+        if not self._acks:
+            return
+        keys = collections.defaultdict(list)
+        for key, entry_id in self._acks:
+            keys[key].append(entry_id)
+        with self.r.pipeline(transaction=False) as p:
+            for key, ids in keys.items():
+                p.execute_command("XACK", key, self.group, *ids)
+            p.execute()
+        self._acks = []
+
+    def _read(self):
+        args = ["XREADGROUP", "GROUP", self.group, self.consumer,
+                "COUNT", self.count]
+        if not self._recovering:
+            args.extend(["BLOCK", self.block])
+        args.append("STREAMS")
+        args.extend(self.streams)
+        if self._recovering:
+            args.extend([self._recover_ids.get(key, "0")
+                         for key in self.streams])
+        else:
+            args.extend([">"] * len(self.streams))
+
+        resp = self.r.execute_command(*args) or []
+        if isinstance(resp, dict):
+            resp = resp.items()
+
+        for key, entries in resp:
+            if self._recovering and entries:
+                self._recover_ids[s(key)] = entries[-1][0]
+            for raw_id, raw in entries:
+                if raw is None:
+                    # entry trimmed before being acked
+                    self._acks.append((s(key), raw_id))
+                    continue
+                self._buffer.append((s(key), raw_id, _fields(raw)))
+
+        if self._recovering and not any(entries for _, entries in resp):
+            self._recovering = False
+            self._recover_ids = {}
+            self._read()
+
+    def recv(self):
+        """Receive an entry from streams.
+
+        The entry returned in last call is acked before reading if it's not
+        dispatched to workers, and the entries done by workers are acked.
+
+        :return: (topic, pks) tuple, or (None, []) if no entry available or
+         entry corrupt.
+        """
+        if self._entry is not None:
+            self._acks.append(self._entry)
+            self._entry = None
+        self.ack()
+        if not self._buffer:
+            self._read()
+        if not self._buffer:
+            return None, []
+
+        key, entry_id, fields = self._buffer.popleft()
+        self._entry = (key, entry_id)
+        try:
+            msg = protocol.decode([fields["topic"], fields["body"]])
+        except (KeyError, protocol.ProtocolError) as e:
+            self.logger.error("entry corrupt -> %s %s: %r" % (
+                key, entry_id, e))
+            return None, []
+        return msg.topic, msg.pks
@@ -3,10 +3,8 @@
 from __future__ import absolute_import
 
 import collections
-import zmq
 
-from zmq.utils.strtypes import asbytes
-from . import Replicator
+from .base import Replicator
 
 
 class RqReplicator(Replicator):
@@ -36,16 +34,12 @@ class RqReplicator(Replicator):
         def wrapper(func):
             for topic in topics:
                 self.topic_funcs[topic] = func
-                self.socket.setsockopt(zmq.SUBSCRIBE, asbytes(topic))
+                self.subscribe(topic)
             return func
         return wrapper
 
     def run(self):
-        if isinstance(self.listen, list):
-            for i in self.listen:
-                self.socket.connect(i)
-        else:
-            self.socket.connect(self.listen)
+        self.connect()
 
         error_pks = collections.defaultdict(set)
 
@@ -69,13 +63,8 @@ class RqReplicator(Replicator):
                         "process error pks: {} -> {}".format(t, p))
                     do_job(t, p)
 
-                msg = self.socket.recv_string()
-
-                lst = msg.split()
-                if len(lst) >= 2:
-                    topic, pks = lst[0], lst[1:]
-                else:
-                    self.logger.error("msg corrupt -> %s" % msg)
+                topic, pks = self.recv()
+                if not pks or topic not in self.topic_funcs:
                     continue
 
                 self.logger.info("replicator: {} -> {}".format(topic, pks))
@@ -35,13 +35,16 @@ class Worker(Process):
 
     def __init__(self, queue, name, cb, multi=False, logger_name=None,
                  retry=True, queue_limit=10000, max_retry_count=10,
-                 max_retry_interval=60):
+                 max_retry_interval=60, ack_queue=None):
         """
         :param multi: allow multiple pks to be sent in one callback
         :param retry: retry on pk if callback failed
         :param queue_limit: queue size limit for deduplication
         :param max_retry_count: max retry count for a single pk
         :param max_retry_interval: max sleep time when callback failed
+        :param ack_queue: if set, tasks are (pk, token) tuples, and the
+         tokens of a pk are put into ack_queue as a list once the callback
+         on pk succeeded, or failed for more than max_retry_count times.
         """
         super(Worker, self).__init__()
         self.name = name
@@ -50,6 +53,7 @@ class Worker(Process):
         self.cb = cb
         self.multi = multi
         self.retry = retry
+        self.ack_queue = ack_queue
 
         # config logger
         logger_name = logger_name or "name-%s" % id(self)
@@ -66,6 +70,7 @@ class Worker(Process):
         while True:
             try:
                 pks = set()
+                tokens = collections.defaultdict(list)
 
                 try:
                     max_size = self.queue.qsize()
@@ -77,7 +82,11 @@ class Worker(Process):
 
                 # try get all pks from queue at once
                 while not self.queue.empty():
-                    pks.add(self.queue.get())
+                    pk = self.queue.get()
+                    if self.ack_queue is not None:
+                        pk, token = pk
+                        tokens[pk].append(token)
+                    pks.add(pk)
                     if len(pks) > self.MAX_PK_COUNT:
                         break
 
@@ -102,14 +111,16 @@ class Worker(Process):
                     results = [self.cb(pk) for pk in pks]
 
                 if not self.retry:
+                    for pk in pks:
+                        self._ack(tokens.get(pk))
                     continue
 
                 # check failed task and retry
                 for pk, r in zip(pks, results):
                     if r:
-                        self.on_success(pk)
+                        self.on_success(pk, tokens.get(pk))
                     else:
-                        self.on_fail(pk)
+                        self.on_fail(pk, tokens.get(pk))
 
                 # take a nap on fail
                 if not all(results):
@@ -124,21 +135,31 @@ class Worker(Process):
                 self.logger.exception(e)
                 time.sleep(10)
 
-    def on_fail(self, pk):
+    def _ack(self, tokens):
+        if tokens:
+            self.ack_queue.put(tokens)
+
+    def on_fail(self, pk, tokens=None):
         self._retry_stats[pk] += 1
         if self._retry_stats[pk] > self._max_retry_count:
             del self._retry_stats[pk]
             self.logger.error("callback on pk failed -> %s" % pk)
+            self._ack(tokens)
         else:
             # put failed pk back to queue
-            self.queue.put(pk)
+            if tokens is None:
+                self.queue.put(pk)
+            else:
+                for token in tokens:
+                    self.queue.put((pk, token))
             self.logger.warn(
                 "callback on pk failed for %s times -> %s" % (
                     self._retry_stats[pk], pk))
 
-    def on_success(self, pk):
+    def on_success(self, pk, tokens=None):
         if pk in self._retry_stats:
             del self._retry_stats[pk]
+        self._ack(tokens)
 
 
 class WorkerPool(object):
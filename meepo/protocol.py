@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+"""
+Meepo fanout wire protocols shared by :func:`meepo.sub.zmq.zmq_sub` and the
+replicators.
+
+**String Protocol**
+
+The default protocol, every message is a single frame of space separated
+topic and pks::
+
+    table_action pk1 pk2 ...
+
+Pks are stringified, so the consumer receives str pks and composite pks
+can't be represented.
+
+**Binary Protocol**
+
+A versioned multipart message, the topic is always the first frame so zmq
+prefix filtering keeps working::
+
+    [topic, body]
+
+The body starts with a fixed header::
+
+    !BBBdH -> version, flags, action, timestamp, binlog pos length
+
+followed by the utf8 binlog pos, then the pk count (``!I``) and the pks,
+in the first layout that fits:
+
+* all 64-bit ints, ``FLAG_INT_ARRAY``: a plain ``!q`` array.
+* all str (``FLAG_STR``) or all bytes, none containing ``\\x00``,
+  ``FLAG_SEP_ARRAY``: the ``!I`` length of the pks joined by ``\\x00``,
+  followed by the joined pks.
+* all str or all bytes, ``FLAG_LEN_ARRAY``: a ``!I`` array of pk lengths
+  followed by the joined pks, decoded with a single unpack.
+* otherwise every pk is prefixed with a type tag.
+
+The pk count and pks section may be compressed with zlib or lz4 (requires
+the ``lz4`` package), ``FLAG_ZLIB`` or ``FLAG_LZ4`` is set in this case.
+
+Consumers don't need to be told which protocol is used, a single frame
+message is decoded as string protocol and a multipart message is checked
+against the version byte in body.
+"""
+
+from __future__ import absolute_import
+
+__all__ = ["VERSION", "Message", "ProtocolError", "encode", "decode",
+           "decode_string", "partition"]
+
+import collections
+import struct
+import time
+import zlib
+
+from ._compat import PY3, bytes, str, integer_types
+from .utils import b, s
+
+VERSION = 1
+
+FLAG_INT_ARRAY = 0x01
+FLAG_ZLIB = 0x02
+FLAG_LZ4 = 0x04
+FLAG_SEP_ARRAY = 0x08
+FLAG_LEN_ARRAY = 0x10
+FLAG_STR = 0x20
+
+COMPRESSIONS = {"zlib": FLAG_ZLIB, "lz4": FLAG_LZ4}
+
+ACTIONS = ("", "write", "update", "delete")
+
+_HEADER = struct.Struct("!BBBdH")
+_COUNT = struct.Struct("!I")
+_INT = struct.Struct("!q")
+_LEN = struct.Struct("!I")
+_TUPLE_LEN = struct.Struct("!B")
+
+_INT_MIN, _INT_MAX = -2 ** 63, 2 ** 63 - 1
+
+Message = collections.namedtuple(
+    "Message", ["topic", "action", "ts", "pos", "pks"])
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def _action(topic):
+    action = topic.rsplit("_", 1)[-1]
+    return ACTIONS.index(action) if action in ACTIONS else 0
+
+
+def _is_int(pk):
+    return isinstance(pk, integer_types) and _INT_MIN <= pk <= _INT_MAX
+
+
+def _encode_pk(pk, buf):
+    if _is_int(pk):
+        buf.append(b"i")
+        buf.append(_INT.pack(pk))
+    elif isinstance(pk, integer_types):
+        # out of int64 range, keep it as decimal
+        data = b(repr(pk).rstrip("L"))
+        buf.extend((b"L", _LEN.pack(len(data)), data))
+    elif isinstance(pk, str):
+        data = pk.encode("utf-8")
+        buf.extend((b"s", _LEN.pack(len(data)), data))
+    elif isinstance(pk, bytes):
+        buf.extend((b"b", _LEN.pack(len(pk)), pk))
+    elif isinstance(pk, tuple):
+        buf.extend((b"t", _TUPLE_LEN.pack(len(pk))))
+        for p in pk:
+            _encode_pk(p, buf)
+    else:
+        raise ProtocolError("unsupported pk type: %r" % (pk, ))
+
+
+def _decode_pk(body, offset):
+    tag = body[offset:offset + 1].tobytes()
+    offset += 1
+    if tag == b"i":
+        return _INT.unpack_from(body, offset)[0], offset + _INT.size
+    elif tag == b"t":
+        n = _TUPLE_LEN.unpack_from(body, offset)[0]
+        offset += _TUPLE_LEN.size
+        pk = []
+        for _ in range(n):
+            p, offset = _decode_pk(body, offset)
+            pk.append(p)
+        return tuple(pk), offset
+
+    length = _LEN.unpack_from(body, offset)[0]
+    offset += _LEN.size
+    data = body[offset:offset + length].tobytes()
+    if len(data) != length:
+        raise ProtocolError("pk truncated")
+    offset += length
+    if tag == b"s":
+        return data.decode("utf-8"), offset
+    elif tag == b"b":
+        return data, offset
+    elif tag == b"L":
+        return int(data), offset
+    raise ProtocolError("unknown pk tag: %r" % tag)
+
+
+def _encode_array(pks):
+    """Encode pks of a single type in an array layout.
+
+    :return: (flags, data) tuple, or None if pks don't fit any array layout.
+    """
+    kinds = set(map(type, pks))
+    if kinds <= set(integer_types):
+        try:
+            return FLAG_INT_ARRAY, struct.pack("!%dq" % len(pks), *pks)
+        except struct.error:
+            # out of int64 range
+            return None
+
+    if kinds == set([str]):
+        joined = u"\x00".join(pks)
+        if joined.count(u"\x00") == len(pks) - 1:
+            data = joined.encode("utf-8")
+            return FLAG_STR | FLAG_SEP_ARRAY, _LEN.pack(len(data)) + data
+        flags, parts = FLAG_STR, [pk.encode("utf-8") for pk in pks]
+    elif kinds == set([bytes]):
+        joined = b"\x00".join(pks)
+        if joined.count(b"\x00") == len(pks) - 1:
+            return FLAG_SEP_ARRAY, _LEN.pack(len(joined)) + joined
+        flags, parts = 0, pks
+    else:
+        return None
+
+    lengths = struct.pack("!%dI" % len(parts), *map(len, parts))
+    return flags | FLAG_LEN_ARRAY, lengths + b"".join(parts)
+
+
+def _decode_array(flags, body, offset, count):
+    if flags & FLAG_INT_ARRAY:
+        return list(struct.unpack_from("!%dq" % count, body, offset))
+
+    if flags & FLAG_SEP_ARRAY:
+        length = _LEN.unpack_from(body, offset)[0]
+        data = body[offset + _LEN.size:].tobytes()
+        if len(data) != length:
+            raise ProtocolError("expect %s bytes, got %s" % (
+                length, len(data)))
+        if flags & FLAG_STR:
+            pks = data.decode("utf-8").split(u"\x00")
+        else:
+            pks = data.split(b"\x00")
+        if len(pks) != count:
+            raise ProtocolError("expect %s pks, got %s" % (count, len(pks)))
+        return pks
+
+    lengths = struct.unpack_from("!%dI" % count, body, offset)
+    offset += _LEN.size * count
+    pks = struct.unpack_from(("%ds" * count) % lengths, body, offset)
+    if flags & FLAG_STR:
+        return [pk.decode("utf-8") for pk in pks]
+    return list(pks)
+
+
+def _compress(compression, data):
+    if compression == "zlib":
+        return zlib.compress(data, 1)
+    import lz4.block
+    return lz4.block.compress(data)
+
+
+def _decompress(flags, data):
+    if flags & FLAG_ZLIB:
+        return zlib.decompress(data if PY3 else data.tobytes())
+    import lz4.block
+    try:
+        return lz4.block.decompress(data if PY3 else data.tobytes())
+    except lz4.block.LZ4BlockError as e:
+        raise ProtocolError("msg corrupt: %r" % e)
+
+
+def encode(topic, pks, ts=None, pos=None, compression=None,
+           compress_threshold=4096):
+    """Encode topic and pks into binary protocol frames.
+
+    :param topic: the event name, in ``table_action`` format.
+    :param pks: list of int, str, bytes or tuple pks.
+    :param ts: event timestamp, default to current timestamp.
+    :param pos: binlog pos string, if known.
+    :param compression: "zlib" or "lz4", leave None to disable.
+    :param compress_threshold: only compress pks section larger than
+     this size in bytes.
+    :return: list of frames.
+    """
+    pos = b(pos or "")
+    flags = 0
+    array = _encode_array(pks) if pks else None
+    if array is not None:
+        flags, data = array
+        data = _COUNT.pack(len(pks)) + data
+    else:
+        buf = [_COUNT.pack(len(pks))]
+        for pk in pks:
+            _encode_pk(pk, buf)
+        data = b"".join(buf)
+
+    if compression and len(data) > compress_threshold:
+        flags |= COMPRESSIONS[compression]
+        data = _compress(compression, data)
+
+    header = _HEADER.pack(VERSION, flags, _action(topic),
+                          ts or time.time(), len(pos))
+    return [b(topic), b"".join((header, pos, data))]
+
+
+def decode(frames):
+    """Decode binary protocol frames into :class:`Message`.
+
+    :param frames: list of frames, the frame may be bytes or any object
+     supports the buffer protocol, e.g. ``zmq.Frame.buffer`` received with
+     ``copy=False``, the body will be parsed in place without copying.
+    """
+    if len(frames) != 2:
+        raise ProtocolError("expect 2 frames, got %s" % len(frames))
+
+    topic, body = frames
+    body = memoryview(body)
+    try:
+        version, flags, action, ts, pos_len = _HEADER.unpack_from(body)
+        if version != VERSION:
+            raise ProtocolError("unsupported protocol version %s" % version)
+
+        offset = _HEADER.size
+        pos = s(body[offset:offset + pos_len].tobytes()) or None
+        offset += pos_len
+
+        if flags & (FLAG_ZLIB | FLAG_LZ4):
+            body = memoryview(_decompress(flags, body[offset:]))
+            offset = 0
+
+        count = _COUNT.unpack_from(body, offset)[0]
+        offset += _COUNT.size
+
+        if flags & (FLAG_INT_ARRAY | FLAG_SEP_ARRAY | FLAG_LEN_ARRAY):
+            pks = _decode_array(flags, body, offset, count)
+        else:
+            pks = []
+            for _ in range(count):
+                pk, offset = _decode_pk(body, offset)
+                pks.append(pk)
+        action = ACTIONS[action]
+    except (struct.error, IndexError, UnicodeDecodeError, zlib.error) as e:
+        raise ProtocolError("msg corrupt: %r" % e)
+
+    topic = s(memoryview(topic).tobytes())
+    return Message(topic, action, ts, pos, pks)
+
+
+def partition(pk, partitions):
+    """Stable partition of pk, the result is consistent across processes
+    and python versions.
+
+    :param pk: int, str or tuple pk.
+    :param partitions: the number of partitions.
+    """
+    if isinstance(pk, tuple):
+        key = "\x00".join(str(p) for p in pk)
+    else:
+        key = str(pk)
+    return (zlib.crc32(key.encode("utf-8")) & 0xffffffff) % partitions
+
+
+def decode_string(msg):
+    """Decode string protocol message into topic and pks.
+
+    :return: (topic, pks) tuple, pks will be empty if msg corrupt.
+    """
+    lst = s(msg).split()
+    if not lst:
+        return None, []
+    return lst[0], lst[1:]
@@ -38,6 +38,7 @@ The events pub flow::
 
 from __future__ import absolute_import
 
+import collections
 import logging
 
 import uuid
@@ -101,6 +102,12 @@ class sqlalchemy_pub(object):
         signal("test_write").send(1)
         signal("test_write_raw").send(t_1)
 
+    After all events of a commit sent, a ``session_batch`` signal is sent
+    with pks of all events in the commit, so subs can handle them in
+    batch::
+
+        signal("session_batch").send(session, event={"test_write": {1}})
+
     :param session: sqlalchemy session to install the hook
     :param tables: tables to install the hook, leave None to pub all.
 
@@ -184,9 +191,12 @@ class sqlalchemy_pub(object):
             if pk:
                 sg.send(pk)
                 sg_raw.send(obj)
+                batch[sg_name].add(pk)
                 self.logger.debug("%s - session_pub: %s -> %s" % (
                     session.meepo_unique_id, sg_name, pk))
 
+        batch = collections.defaultdict(set)
+
         for obj in session.pending_write:
             _pub(obj, action="write")
         for obj in session.pending_update:
@@ -198,6 +208,9 @@ class sqlalchemy_pub(object):
         session.pending_update.clear()
         session.pending_delete.clear()
 
+        if batch:
+            signal("session_batch").send(session, event=dict(batch))
+
     def session_update(self, session, *_):
         """Record the sqlalchemy object states in the middle of session,
         prepare the events for the final pub in session_commit.
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+The aggregate sub maintains ``COUNT`` / ``SUM`` ... ``GROUP BY`` results
+incrementally from the before / after row images of the
+``table_action_raw`` signals sent by :func:`meepo.pub.mysql_pub`.
+
+A write adds the row to its group, a delete subtracts it, and an update
+subtracts the before image and adds the after image, so every event costs
+O(1) instead of re-running the query against the whole table.
+
+The aggregates must be initialized from a consistent snapshot of the
+table, e.g. by :meth:`Aggregator.load_rows` with the rows of a dump
+taken at the binlog position the pub starts from. State is kept in memory
+and periodically snapshotted to disk along with the last
+``mysql_binlog_pos``, restart the pub from :attr:`Aggregator.pos` after
+loading a snapshot.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import os
+import threading
+import time
+
+from .._compat import pickle
+from ..signals import signal
+
+
+class Aggregate(object):
+    """Declare an aggregate equals to::
+
+        SELECT <group_by>, COUNT(*), SUM(<sums>) FROM <table>
+        WHERE <where> GROUP BY <group_by>
+
+    :param name: the aggregate name.
+    :param table: the table name.
+    :param group_by: column name, or tuple of column names, leave None to
+     aggregate the whole table.
+    :param sums: column names to sum, NULL values are skipped.
+    :param where: func accepting the row values dict and returning whether
+     the row is counted.
+    """
+    def __init__(self, name, table, group_by=None, sums=(), where=None):
+        self.name = name
+        self.table = table
+        self.group_by = group_by
+        self.sums = tuple(sums)
+        self.where = where
+        # group -> [count, sum, sum, ...]
+        self.groups = {}
+
+    def _group(self, values):
+        if self.group_by is None:
+            return None
+        if isinstance(self.group_by, tuple):
+            return tuple(values.get(c) for c in self.group_by)
+        return values.get(self.group_by)
+
+    def apply(self, values, sign):
+        """Add (sign=1) or subtract (sign=-1) a row image."""
+        if self.where is not None and not self.where(values):
+            return
+
+        group = self._group(values)
+        state = self.groups.get(group)
+        if state is None:
+            state = self.groups[group] = [0] * (1 + len(self.sums))
+
+        state[0] += sign
+        for i, col in enumerate(self.sums, 1):
+            value = values.get(col)
+            if value is not None:
+                state[i] += sign * value
+
+        if state[0] == 0:
+            del self.groups[group]
+
+    def result(self, state):
+        result = {"count": state[0]}
+        result.update(zip(self.sums, state[1:]))
+        return result
+
+
+class Aggregator(object):
+    """Maintain aggregates from raw row events.
+
+    :param aggregates: list of :class:`Aggregate`.
+    :param snapshot_path: snapshot file path, the snapshot is loaded on
+     init if exists, leave None to disable snapshots.
+    :param snapshot_interval: min seconds between snapshots.
+    """
+    def __init__(self, aggregates, snapshot_path=None, snapshot_interval=60):
+        self.aggregates = dict((a.name, a) for a in aggregates)
+        self.tables = {}
+        for a in aggregates:
+            self.tables.setdefault(a.table, []).append(a)
+
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.logger = logging.getLogger("meepo.sub.aggregate_sub")
+
+        self.pos = None
+        self._lock = threading.Lock()
+        self._last_snapshot = time.time()
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            self.load()
+
+    def apply(self, table, row):
+        """Apply a raw binlog row of table.
+
+        :param row: the row sent by ``table_action_raw`` signal.
+        """
+        with self._lock:
+            for a in self.tables.get(table, ()):
+                if "before_values" in row:
+                    a.apply(row["before_values"], -1)
+                    a.apply(row["after_values"], 1)
+                else:
+                    a.apply(row["values"], 1)
+
+    def delete(self, table, row):
+        """Apply a raw binlog row of a deleted row."""
+        with self._lock:
+            for a in self.tables.get(table, ()):
+                a.apply(row["values"], -1)
+
+    def load_rows(self, table, rows):
+        """Initialize aggregates of table with existing rows.
+
+        :param rows: iterable of row values dicts.
+        """
+        for values in rows:
+            self.apply(table, {"values": values})
+
+    def get(self, name, group=None):
+        """Return the aggregate result of group, e.g.
+        ``{"count": 3, "amount": 42}``.
+        """
+        a = self.aggregates[name]
+        with self._lock:
+            state = a.groups.get(group)
+            if state is None:
+                return a.result([0] * (1 + len(a.sums)))
+            return a.result(state)
+
+    def groups(self, name):
+        """Return dict of group -> aggregate result of all groups."""
+        a = self.aggregates[name]
+        with self._lock:
+            return dict((group, a.result(state))
+                        for group, state in a.groups.items())
+
+    def set_pos(self, pos):
+        """Record binlog pos, and snapshot if due.
+
+        The pos signal is sent after all rows of a binlog event, so the
+        snapshot taken here never contains a partially applied event.
+        """
+        self.pos = pos
+        if self.snapshot_path and \
+                time.time() - self._last_snapshot >= self.snapshot_interval:
+            try:
+                self.snapshot()
+            except Exception as e:
+                self.logger.exception(e)
+
+    def snapshot(self):
+        """Write state and binlog pos to the snapshot file atomically."""
+        with self._lock:
+            data = pickle.dumps({
+                "pos": self.pos,
+                "groups": dict((name, a.groups)
+                               for name, a in self.aggregates.items()),
+            }, pickle.HIGHEST_PROTOCOL)
+
+        tmp = "%s.tmp" % self.snapshot_path
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.snapshot_path)
+        self._last_snapshot = time.time()
+        self.logger.info("snapshot at %s -> %s" % (
+            self.pos, self.snapshot_path))
+
+    def load(self):
+        """Load state and binlog pos from the snapshot file."""
+        with open(self.snapshot_path, "rb") as f:
+            data = pickle.load(f)
+        with self._lock:
+            self.pos = data["pos"]
+            for name, groups in data["groups"].items():
+                if name in self.aggregates:
+                    self.aggregates[name].groups = groups
+
+
+def aggregate_sub(aggregates, snapshot_path=None, snapshot_interval=60):
+    """Incremental aggregates sub.
+
+    Maintain orders count and amount per city::
+
+        aggregator = aggregate_sub([
+            Aggregate("order_city", "order", group_by="city",
+                      sums=["amount"]),
+        ], snapshot_path="/data/aggregates.pickle")
+
+        aggregator.get("order_city", "shanghai")
+        aggregator.groups("order_city")
+
+    :param aggregates: list of :class:`Aggregate`.
+    :param snapshot_path: snapshot file path.
+    :param snapshot_interval: min seconds between snapshots.
+    :return: the :class:`Aggregator` instance.
+    """
+    aggregator = Aggregator(aggregates, snapshot_path=snapshot_path,
+                            snapshot_interval=snapshot_interval)
+
+    for table in aggregator.tables:
+        def _sub(row, table=table):
+            aggregator.apply(table, row)
+
+        def _sub_delete(row, table=table):
+            aggregator.delete(table, row)
+
+        signal("%s_write_raw" % table).connect(_sub, weak=False)
+        signal("%s_update_raw" % table).connect(_sub, weak=False)
+        signal("%s_delete_raw" % table).connect(_sub_delete, weak=False)
+
+    signal("mysql_binlog_pos").connect(aggregator.set_pos, weak=False)
+    return aggregator
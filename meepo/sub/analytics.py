@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+The analytics sub counts events in process for realtime analytics.
+
+Every (table, action) has a ring of per-second buckets covering the last
+hour, adding an event is a constant time bucket increment, and a query of
+the 1m / 5m / 1h window sums at most one bucket per second of the window,
+no matter how many events happened.
+
+Events can also be counted by groups of raw row columns, e.g. orders per
+city, the number of groups per (table, action) is bounded, groups beyond
+the bound are counted into :data:`OTHER`.
+"""
+
+from __future__ import absolute_import
+
+import array
+import heapq
+import time
+
+from ..signals import signal
+
+WINDOWS = (("1m", 60), ("5m", 300), ("1h", 3600))
+
+OTHER = "__other__"
+
+
+class RingCounter(object):
+    """Per-second counters of the last ``size`` seconds.
+
+    :param size: number of per-second buckets.
+    """
+    __slots__ = ("size", "secs", "counts")
+
+    def __init__(self, size=3600):
+        self.size = size
+        self.secs = array.array("l", [-1] * size)
+        self.counts = array.array("l", [0] * size)
+
+    def add(self, sec, n=1):
+        """Add n to the bucket of second ``sec``."""
+        i = sec % self.size
+        if self.secs[i] == sec:
+            self.counts[i] += n
+        else:
+            self.secs[i] = sec
+            self.counts[i] = n
+
+    def sum(self, window, now):
+        """Sum of the last ``window`` seconds up to second ``now``."""
+        secs, counts, size = self.secs, self.counts, self.size
+        total = 0
+        for sec in range(now - min(window, size) + 1, now + 1):
+            i = sec % size
+            if secs[i] == sec:
+                total += counts[i]
+        return total
+
+
+class Analytics(object):
+    """Sliding window event counters.
+
+    :param size: seconds kept in the rings, the max queryable window.
+    :param max_groups: max groups kept per (table, action).
+    """
+    def __init__(self, size=3600, max_groups=1000):
+        self.size = size
+        self.max_groups = max_groups
+        self.counters = {}
+        self.groups = {}
+
+    def counter(self, table, action):
+        """Return the :class:`RingCounter` of (table, action)."""
+        key = (table, action)
+        counter = self.counters.get(key)
+        if counter is None:
+            counter = self.counters[key] = RingCounter(self.size)
+        return counter
+
+    def add(self, table, action, n=1, ts=None):
+        """Count n events of (table, action) at ts, default to now."""
+        self.counter(table, action).add(
+            int(time.time() if ts is None else ts), n)
+
+    def add_group(self, table, action, group, n=1, ts=None):
+        """Count n events of (table, action) in group at ts."""
+        groups = self.groups.setdefault((table, action), {})
+        counter = groups.get(group)
+        if counter is None:
+            if len(groups) >= self.max_groups:
+                group = OTHER
+            counter = groups.get(group)
+            if counter is None:
+                counter = groups[group] = RingCounter(self.size)
+        counter.add(int(time.time() if ts is None else ts), n)
+
+    def sum(self, table, action, window=60, group=None, now=None):
+        """Events of (table, action) in the last ``window`` seconds.
+
+        :param group: only count events in the group.
+        :param now: the end of window, default to now.
+        """
+        if group is None:
+            counter = self.counters.get((table, action))
+        else:
+            counter = self.groups.get((table, action), {}).get(group)
+        if counter is None:
+            return 0
+        return counter.sum(window, int(time.time() if now is None else now))
+
+    def rate(self, table, action, window=60, group=None, now=None):
+        """Events per second of (table, action) in the last ``window``
+        seconds.
+        """
+        return self.sum(table, action, window, group, now) / float(
+            min(window, self.size))
+
+    def top(self, table, action, window=60, n=10, now=None):
+        """Top n groups of (table, action) in the last ``window`` seconds.
+
+        :return: list of (group, count) tuples, largest first.
+        """
+        now = int(time.time() if now is None else now)
+        groups = self.groups.get((table, action), {})
+        return heapq.nlargest(
+            n, ((group, counter.sum(window, now))
+                for group, counter in groups.items()),
+            key=lambda x: x[1])
+
+    def stats(self, now=None):
+        """Rates of all (table, action) in the 1m / 5m / 1h windows.
+
+        :return: dict of "table_action" -> {"1m": rate, "5m": rate, ...}
+        """
+        return dict(
+            ("%s_%s" % key, dict(
+                (name, self.rate(key[0], key[1], window, now=now))
+                for name, window in WINDOWS if window <= self.size))
+            for key in self.counters)
+
+
+def analytics_sub(tables, group_by=None, **kwargs):
+    """Realtime analytics sub.
+
+    Count events of tables, and optionally group events by raw row
+    columns sent by :func:`meepo.pub.mysql_pub`::
+
+        analytics = analytics_sub(["order"], group_by={"order": "city"})
+
+        analytics.rate("order", "write", 60)
+        analytics.top("order", "write", 300)
+        analytics.stats()
+
+    :param tables: the events of tables to count.
+    :param group_by: dict of table -> column name, or tuple of column names
+     to group by.
+    :param kwargs: kwargs to be passed to :class:`Analytics`.
+    :return: the :class:`Analytics` instance.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    analytics = Analytics(**kwargs)
+    group_by = group_by or {}
+
+    for table in tables:
+        for action in ("write", "update", "delete"):
+            def _sub(pk, counter=analytics.counter(table, action),
+                     _time=time.time):
+                counter.add(int(_time()))
+            signal("%s_%s" % (table, action)).connect(_sub, weak=False)
+
+            columns = group_by.get(table)
+            if columns is None:
+                continue
+
+            def _sub_raw(row, table=table, action=action, columns=columns):
+                values = row.get("after_values", row.get("values"))
+                if isinstance(columns, tuple):
+                    group = tuple(values.get(c) for c in columns)
+                else:
+                    group = values.get(columns)
+                analytics.add_group(table, action, group)
+            signal("%s_%s_raw" % (table, action)).connect(
+                _sub_raw, weak=False)
+
+    return analytics
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""
+The audit sub appends structured audit records of events to local files.
+
+Every record has::
+
+    event -> the event name, e.g. "test_update"
+    pk    -> the pk of the row
+    ts    -> unix timestamp when the event received
+    pos   -> the last seen ``mysql_binlog_pos`` before the event, or None
+    diff  -> column -> [before, after] of changed columns, only in diff mode
+
+Records are encoded as json lines or msgpack, buffered in memory and
+written in blocks. With compression, every block is an independent gzip
+member or zstd frame, so the files can still be read with ``zcat`` or
+``zstdcat``.
+
+Files are rotated by size or age, the time range of every rotated file is
+appended to ``index.jsonl``, so :func:`read_audit` only opens the files
+overlapping the queried time range.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import io
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from .._compat import str
+from ..signals import signal
+from ..utils import row_pk
+
+FORMATS = {"json": "jsonl", "msgpack": "msgpack"}
+COMPRESSIONS = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+INDEX_FILE = "index.jsonl"
+
+
+def _serializer(format):
+    if format == "json":
+        def _dumps(record):
+            return (json.dumps(record, default=str) + "\n").encode("utf-8")
+        return _dumps
+
+    import msgpack
+
+    def _packb(record):
+        return msgpack.packb(record, default=str, use_bin_type=True)
+    return _packb
+
+
+def _compressor(compression):
+    if compression is None:
+        return lambda data: data
+
+    if compression == "gzip":
+        def _gzip(data):
+            c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            return c.compress(data) + c.flush()
+        return _gzip
+
+    import zstandard
+    return zstandard.ZstdCompressor().compress
+
+
+def _decompress(data, compression):
+    if compression is None:
+        return data
+
+    if compression == "gzip":
+        chunks = []
+        while data:
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            chunks.append(d.decompress(data))
+            data = d.unused_data
+        return b"".join(chunks)
+
+    import zstandard
+    reader = zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(data), read_across_frames=True)
+    return reader.read()
+
+
+def _parse(data, format):
+    if format == "json":
+        return [json.loads(line.decode("utf-8"))
+                for line in data.splitlines() if line]
+
+    import msgpack
+    return list(msgpack.Unpacker(io.BytesIO(data), raw=False))
+
+
+def _parse_name(name):
+    """Parse audit file name ``audit-<ms>[-<n>].<ext>``.
+
+    :return: (ms, n, format, compression), or None if not an audit file.
+    """
+    if not name.startswith("audit-") or "." not in name:
+        return None
+    stem, ext = name[6:].split(".", 1)
+    for compression, c_ext in COMPRESSIONS.items():
+        for format, f_ext in FORMATS.items():
+            if ext == f_ext + c_ext:
+                ms, _, n = stem.partition("-")
+                return int(ms), int(n or 0), format, compression
+    return None
+
+
+class AuditLog(object):
+    """Buffered, rotated audit log writer.
+
+    Records are buffered and written as one block every ``flush_interval``
+    seconds, or when ``block_bytes`` encoded bytes pending.
+
+    :param path: the audit log directory, will be created if not exists.
+    :param format: "json" or "msgpack".
+    :param compression: None, "gzip" or "zstd".
+    :param max_bytes: rotate when the file exceeds the size.
+    :param max_age: rotate when the file is older than the seconds.
+    :param block_bytes: max pending encoded bytes before a block written.
+    :param flush_interval: max seconds a record waits in buffer.
+    """
+    def __init__(self, path, format="json", compression=None,
+                 max_bytes=64 * 1024 * 1024, max_age=3600,
+                 block_bytes=256 * 1024, flush_interval=1):
+        if format not in FORMATS:
+            raise ValueError("unknown format: %s" % format)
+        if compression not in COMPRESSIONS:
+            raise ValueError("unknown compression: %s" % compression)
+
+        self.path = path
+        self.format = format
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.block_bytes = block_bytes
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger("meepo.sub.audit_sub")
+
+        self._dumps = _serializer(format)
+        self._compress = _compressor(compression)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_range = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._full = threading.Event()
+
+        self._file = None
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, event, pk, ts=None, pos=None, diff=None):
+        """Append an audit record."""
+        ts = time.time() if ts is None else ts
+        record = {"event": event, "pk": pk, "ts": ts, "pos": pos}
+        if diff is not None:
+            record["diff"] = diff
+        data = self._dumps(record)
+
+        with self._lock:
+            self._buffer.append(data)
+            self._buffer_bytes += len(data)
+            if self._buffer_range is None:
+                self._buffer_range = [ts, ts]
+            else:
+                self._buffer_range[0] = min(self._buffer_range[0], ts)
+                self._buffer_range[1] = max(self._buffer_range[1], ts)
+            if self._buffer_bytes >= self.block_bytes:
+                self._full.set()
+
+    def _open(self):
+        now = time.time()
+        ext = "%s%s" % (FORMATS[self.format],
+                        COMPRESSIONS[self.compression])
+        name = "audit-%d.%s" % (now * 1000, ext)
+        i = 0
+        while os.path.exists(os.path.join(self.path, name)):
+            i += 1
+            name = "audit-%d-%d.%s" % (now * 1000, i, ext)
+
+        self._file = open(os.path.join(self.path, name), "ab")
+        self._name = name
+        self._opened = now
+        self._size = 0
+        self._records = 0
+        self._range = None
+
+    def _rotate(self):
+        """Close current file and append its time range to index."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        with open(os.path.join(self.path, INDEX_FILE), "a") as f:
+            f.write(json.dumps({
+                "file": self._name, "start_ts": self._range[0],
+                "end_ts": self._range[1], "records": self._records}) + "\n")
+
+    def flush(self):
+        """Write all buffered records as a block, rotate if needed."""
+        with self._flush_lock:
+            with self._lock:
+                buffer, ts_range = self._buffer, self._buffer_range
+                self._buffer, self._buffer_bytes = [], 0
+                self._buffer_range = None
+                self._full.clear()
+
+            if self._file is not None and (
+                    self._size >= self.max_bytes or
+                    time.time() - self._opened >= self.max_age):
+                self._rotate()
+            if not buffer:
+                return
+
+            if self._file is None:
+                self._open()
+            block = self._compress(b"".join(buffer))
+            self._file.write(block)
+            self._file.flush()
+            self._size += len(block)
+            self._records += len(buffer)
+            if self._range is None:
+                self._range = ts_range
+            else:
+                self._range = [min(self._range[0], ts_range[0]),
+                               max(self._range[1], ts_range[1])]
+
+    def close(self):
+        """Flush buffered records and close the current file."""
+        self.flush()
+        with self._flush_lock:
+            self._rotate()
+
+    def _run(self):
+        while True:
+            self._full.wait(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.exception(e)
+
+
+def read_audit(path, start_ts=None, end_ts=None, events=None):
+    """Read audit records in time range.
+
+    Files indexed in ``index.jsonl`` are skipped if their time ranges not
+    overlapping the queried range, files not indexed yet (the current
+    file) are always scanned.
+
+    :param path: the audit log directory.
+    :param start_ts: min ts of records, inclusive.
+    :param end_ts: max ts of records, inclusive.
+    :param events: only return records of these events.
+    :return: generator of record dicts, in file order.
+    """
+    index = {}
+    index_path = os.path.join(path, INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    index[entry["file"]] = entry
+
+    files = sorted((_parse_name(n), n) for n in os.listdir(path)
+                   if _parse_name(n))
+    for (_, _, format, compression), name in files:
+        entry = index.get(name)
+        if entry and ((start_ts is not None and entry["end_ts"] < start_ts)
+                      or (end_ts is not None and entry["start_ts"] > end_ts)):
+            continue
+
+        with open(os.path.join(path, name), "rb") as f:
+            data = _decompress(f.read(), compression)
+        for record in _parse(data, format):
+            if start_ts is not None and record["ts"] < start_ts:
+                continue
+            if end_ts is not None and record["ts"] > end_ts:
+                continue
+            if events is not None and record["event"] not in events:
+                continue
+            yield record
+
+
+def _diff(action, row):
+    """Changed columns of raw binlog row as column -> [before, after]."""
+    if action == "update":
+        before, after = row["before_values"], row["after_values"]
+        return dict((k, [before.get(k), v]) for k, v in after.items()
+                    if before.get(k) != v)
+    if action == "write":
+        return dict((k, [None, v]) for k, v in row["values"].items())
+    return dict((k, [v, None]) for k, v in row["values"].items())
+
+
+def audit_sub(path, tables, diff=False, pk_columns=None, **kwargs):
+    """Audit log sub.
+
+    Append audit records of events of tables to local files::
+
+        audit_sub("/data/audit", ["test"], compression="gzip")
+
+    then query the records in time range with :func:`read_audit`.
+
+    In diff mode, the sub follows the ``table_action_raw`` signals of
+    :func:`meepo.pub.mysql_pub` instead, and records the changed columns of
+    every row as ``diff``.
+
+    :param path: the audit log directory.
+    :param tables: the events of tables to follow.
+    :param diff: record row diff from the raw binlog rows.
+    :param pk_columns: dict of table -> pk column name, or tuple of column
+     names for composite pk, only used in diff mode, default to "id".
+     Rows without the pk column are still recorded, with None pk.
+    :param kwargs: kwargs to be passed to :class:`AuditLog`.
+    :return: the :class:`AuditLog` instance.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    log = AuditLog(path, **kwargs)
+    pk_columns = pk_columns or {}
+
+    binlog_pos = [None]
+
+    def _record_pos(pos):
+        binlog_pos[0] = pos
+    signal("mysql_binlog_pos").connect(_record_pos, weak=False)
+
+    def _pk(table, values):
+        col = pk_columns.get(table, "id")
+        pk = row_pk(values, col)
+        if pk is None:
+            log.logger.error("pk column %r not in row of %s, set "
+                             "pk_columns for the table" % (col, table))
+        return pk
+
+    for table in tables:
+        for action in ("write", "update", "delete"):
+            event = "%s_%s" % (table, action)
+            if not diff:
+                def _sub(pk, event=event):
+                    log.append(event, pk, pos=binlog_pos[0])
+                signal(event).connect(_sub, weak=False)
+                continue
+
+            def _sub_raw(row, event=event, table=table, action=action):
+                values = row.get("after_values", row.get("values"))
+                log.append(event, _pk(table, values), pos=binlog_pos[0],
+                           diff=_diff(action, row))
+            signal("%s_raw" % event).connect(_sub_raw, weak=False)
+
+    atexit.register(log.close)
+    return log
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""
+Batching stages shared by subs, they sit between the signals and the
+actual sending of a sub.
+"""
+
+from __future__ import absolute_import
+
+import atexit
+import collections
+import logging
+import threading
+import time
+
+from ..signals import signal
+
+
+class Batcher(object):
+    """Coalesce pks per topic and flush them from a background thread.
+
+    Pks are deduplicated within a batch, a batch is flushed when either
+    ``max_size`` pks are pending or ``interval`` seconds passed since the
+    first pending pk arrived.
+
+    With ``values`` set, a value is added along with the pk and only the
+    last value of a pk is kept, the batch is flushed as lists of
+    (pk, value) tuples instead of pks.
+
+    :param flush_func: func accepting a list of (topic, pks) tuples.
+    :param max_size: max pending pks before an immediate flush.
+    :param interval: max seconds a pk may stay pending.
+    :param logger_name: logger name for flush errors.
+    :param values: keep the last value of pks.
+    """
+    def __init__(self, flush_func, max_size=500, interval=0.005,
+                 logger_name="meepo.sub.batcher", values=False):
+        self.flush_func = flush_func
+        self.values = values
+        self.max_size = max_size
+        self.interval = interval
+        self.logger = logging.getLogger(logger_name)
+
+        self._pending = collections.OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._full = threading.Event()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, topic, pk, value=None):
+        with self._lock:
+            pks = self._pending.get(topic)
+            if pks is None:
+                pks = self._pending[topic] = collections.OrderedDict()
+            exists = pk in pks
+            pks[pk] = value
+            if exists:
+                return
+            self._count += 1
+            if self._count == 1:
+                self._ready.set()
+            if self._count >= self.max_size:
+                self._full.set()
+
+    def flush(self):
+        """Flush all pending pks synchronously."""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = collections.OrderedDict()
+                self._count = 0
+                self._ready.clear()
+                self._full.clear()
+
+            if pending:
+                self.flush_func([
+                    (topic, list(pks.items() if self.values else pks))
+                    for topic, pks in pending.items()])
+
+    def _run(self):
+        while True:
+            self._ready.wait()
+            self._full.wait(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.exception(e)
+
+
+class Debouncer(object):
+    """Debounce calls per key with last-write-wins.
+
+    A call is emitted to ``receiver`` after no newer call of the same key
+    for ``quiet`` seconds, or ``max_delay`` seconds since the first
+    pending call of the key, whichever comes first. Only the last call's
+    args are kept for a key.
+
+    When ``max_pending`` keys are pending, the oldest one is emitted
+    immediately to bound the memory.
+
+    :param receiver: func to be called with the debounced args.
+    :param quiet: seconds without newer call before emitting.
+    :param max_delay: max seconds a call can be delayed.
+    :param max_pending: max pending keys.
+    :param logger_name: logger name for receiver errors.
+    """
+    def __init__(self, receiver, quiet=1, max_delay=10, max_pending=100000,
+                 logger_name="meepo.sub.debouncer"):
+        self.receiver = receiver
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.logger = logging.getLogger(logger_name)
+
+        # key -> (first_ts, args, kwargs), in first seen order
+        self._pending = collections.OrderedDict()
+        # key -> last_ts, in last update order
+        self._updated = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, key, *args, **kwargs):
+        now = time.time()
+        overflow = None
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = (self._pending[key][0], args, kwargs)
+                del self._updated[key]
+            else:
+                if len(self._pending) >= self.max_pending:
+                    overflow = self._pop(next(iter(self._pending)))
+                self._pending[key] = (now, args, kwargs)
+            self._updated[key] = now
+
+        if overflow is not None:
+            self._emit([overflow])
+
+    def _pop(self, key):
+        del self._updated[key]
+        _, args, kwargs = self._pending.pop(key)
+        return args, kwargs
+
+    def _emit(self, calls):
+        for args, kwargs in calls:
+            try:
+                self.receiver(*args, **kwargs)
+            except Exception as e:
+                self.logger.exception(e)
+
+    def _expired(self, now):
+        expired = []
+        with self._lock:
+            for key, last_ts in self._updated.items():
+                if now - last_ts < self.quiet:
+                    break
+                expired.append(key)
+            for key, (first_ts, _, _) in self._pending.items():
+                if now - first_ts < self.max_delay:
+                    break
+                expired.append(key)
+            return [self._pop(key) for key in set(expired)]
+
+    def flush(self):
+        """Emit all pending calls, should be called on shutdown."""
+        with self._lock:
+            calls = [self._pop(key) for key in list(self._pending)]
+        self._emit(calls)
+
+    def _run(self):
+        tick = min(self.quiet, self.max_delay) / 4.0
+        while True:
+            time.sleep(tick)
+            self._emit(self._expired(time.time()))
+
+
+def debounce(events, receiver, key=None, **kwargs):
+    """Connect receiver to events through a :class:`Debouncer`.
+
+    The receiver will be called the same as a normal signal receiver, but
+    only with the last signal of a (event, pk) after a quiet period, e.g.
+    re-index a row in search engine at most once per 5 seconds::
+
+        debounce(["test_write", "test_update"], reindex, quiet=1,
+                 max_delay=5)
+
+    Pending calls are flushed at exit.
+
+    :param events: list of event names.
+    :param receiver: the signal receiver.
+    :param key: func to get the debounce key from signal sender, default
+     to the sender itself, e.g. use ``lambda row: row["values"]["id"]``
+     with raw signals.
+    :param kwargs: kwargs to be passed to :class:`Debouncer`.
+    :return: the :class:`Debouncer`.
+    """
+    kwargs.setdefault("logger_name", "meepo.sub.debounce")
+    debouncer = Debouncer(receiver, **kwargs)
+    atexit.register(debouncer.flush)
+
+    def _make_sub(event):
+        def _sub(sender, **kw):
+            k = key(sender) if key else sender
+            debouncer.add((event, k), sender, **kw)
+        return _sub
+
+    for event in events:
+        signal(event).connect(_make_sub(event), weak=False)
+
+    return debouncer
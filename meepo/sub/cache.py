@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+"""
+The cache sub invalidates cache keys of changed rows in batch.
+
+Pks of the same table are deduplicated within a short window, then the
+cache keys of them are deleted with one pipelined ``DEL`` / ``UNLINK``
+(redis) or one ``delete_multi`` (memcached) call, so a hot row updated
+hundreds of times a second costs only one delete per window.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import itertools
+import logging
+
+import redis
+
+from .._compat import bytes, str
+from ..signals import signal
+from .batch import Batcher
+
+
+class CacheInvalidator(object):
+    """Delete cache keys of pks in batch.
+
+    Pks added are deduplicated per table within ``window`` seconds, or
+    until ``batch_size`` pks pending.
+
+    :param cache: redis dsn, redis client or memcached client which
+     supports ``delete_multi``.
+    :param templates: dict of table -> list of key templates.
+    :param window: dedup window in seconds.
+    :param batch_size: max pending pks before an immediate flush.
+    :param unlink: use redis ``UNLINK`` instead of ``DEL``.
+    :param chunk_size: max keys in one delete command.
+    """
+    def __init__(self, cache, templates, window=0.1, batch_size=1000,
+                 unlink=False, chunk_size=500):
+        if isinstance(cache, (bytes, str)):
+            cache = redis.StrictRedis.from_url(cache, socket_timeout=1)
+        self.cache = cache
+        self.templates = templates
+        self.command = "UNLINK" if unlink else "DEL"
+        self.chunk_size = chunk_size
+        self.stats = collections.Counter()
+        self.logger = logging.getLogger("meepo.sub.invalidate_sub")
+        self.batcher = Batcher(
+            self.invalidate, max_size=batch_size, interval=window,
+            logger_name="meepo.sub.invalidate_sub.batcher")
+
+    def add(self, table, pk):
+        """Add pk of table to be invalidated in batch."""
+        self.batcher.add(table, pk)
+
+    def flush(self):
+        """Invalidate all pending pks synchronously."""
+        self.batcher.flush()
+
+    def keys(self, table, pks):
+        """Render cache keys of pks by table templates."""
+        return [tpl.format(pk=pk)
+                for pk in pks for tpl in self.templates[table]]
+
+    def _delete(self, keys):
+        if hasattr(self.cache, "delete_multi"):
+            for i in range(0, len(keys), self.chunk_size):
+                self.cache.delete_multi(keys[i:i + self.chunk_size])
+        else:
+            with self.cache.pipeline(transaction=False) as p:
+                for i in range(0, len(keys), self.chunk_size):
+                    p.execute_command(
+                        self.command, *keys[i:i + self.chunk_size])
+                p.execute()
+
+    def invalidate(self, items):
+        """Invalidate cache keys of a list of (table, pks) tuples."""
+        keys = list(itertools.chain.from_iterable(
+            self.keys(table, pks) for table, pks in items))
+        if not keys:
+            return
+
+        try:
+            self._delete(keys)
+        except Exception as e:
+            self.stats["failures"] += 1
+            self.logger.error("invalidate failed %r: %s" % (e, keys))
+            return
+        self.stats["keys"] += len(keys)
+        self.stats["batches"] += 1
+        self.logger.debug("invalidated: %s" % keys)
+
+
+def invalidate_sub(cache, templates, window=0.1, batch_size=1000,
+                   actions=("write", "update", "delete"), unlink=False):
+    """Batched cache invalidation sub.
+
+    Map tables to cache key templates, the templates are formatted with
+    ``pk``::
+
+        invalidator = invalidate_sub("redis://localhost/", {
+            "user": ["user:{pk}", "user_profile:{pk}"],
+            "order_item": ["order_item:{pk[0]}:{pk[1]}"],
+        })
+
+    Pks are deduplicated within ``window`` seconds, or until
+    ``batch_size`` pks pending. The returned :class:`CacheInvalidator`
+    keeps counters of ``keys`` invalidated, ``batches`` sent and
+    ``failures`` in its ``stats``::
+
+        invalidator.stats["keys"]
+
+    :param cache: redis dsn, redis client or memcached client which
+     supports ``delete_multi``.
+    :param templates: dict of table -> list of key templates.
+    :param window: dedup window in seconds.
+    :param batch_size: max pending pks before an immediate flush.
+    :param actions: actions to trigger invalidation.
+    :param unlink: use redis ``UNLINK`` instead of ``DEL``.
+    :return: the :class:`CacheInvalidator`.
+    """
+    invalidator = CacheInvalidator(cache, templates, window=window,
+                                   batch_size=batch_size, unlink=unlink)
+
+    for table, action in itertools.product(templates, actions):
+        def _sub(pk, table=table):
+            invalidator.add(table, pk)
+        signal("%s_%s" % (table, action)).connect(_sub, weak=False)
+
+    return invalidator
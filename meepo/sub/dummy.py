@@ -22,5 +22,6 @@ def print_sub(tables):
     events = ("%s_%s" % (tb, action) for tb, action in
               itertools.product(*[tables, ["write", "update", "delete"]]))
     for event in events:
-        signal(event).connect(
-            lambda pk: logger.info("%s -> %s" % event, pk), weak=False)
+        def _sub(pk, event=event):
+            logger.info("%s -> %s" % (event, pk))
+        signal(event).connect(_sub, weak=False)
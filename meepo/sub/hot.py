@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+"""
+The hot sub detects hot rows, rows updated too often in a short time.
+
+Every (table, pk) of events is counted in a count-min sketch, with the
+top-K keys by estimated count kept in a bounded heap, so memory is
+constant no matter how many distinct rows changed. At the end of every
+window, keys counted at least ``threshold`` times are logged and sent with
+the ``hot_rows`` signal::
+
+    signal("hot_rows").send([("test", 1, 12034), ("test", 7, 5021)])
+
+then the sketch is reset for the next window.
+"""
+
+from __future__ import absolute_import
+
+import array
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from ..signals import signal
+
+
+class CountMinSketch(object):
+    """Count-min sketch with ``depth`` rows of ``width`` counters.
+
+    Counts are over estimated by at most ``e / width * total`` with
+    probability ``1 - exp(-depth)``.
+
+    :param width: counters per row.
+    :param depth: number of rows.
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array.array("l", [0] * (width * depth))
+
+    def _indexes(self, key):
+        # double hashing, derive depth indexes from one hash
+        h = hash(key) & 0xffffffffffffffff
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width
+                for row in range(self.depth)]
+
+    def add(self, key, n=1):
+        """Add n to key, return the estimated count of key."""
+        table = self.table
+        estimate = None
+        for i in self._indexes(key):
+            table[i] += n
+            if estimate is None or table[i] < estimate:
+                estimate = table[i]
+        return estimate
+
+    def count(self, key):
+        """Return the estimated count of key."""
+        return min(self.table[i] for i in self._indexes(key))
+
+
+class TopK(object):
+    """Bounded top-k keys by count.
+
+    The heap is updated lazily, an entry is re-validated against the
+    latest count only when it is about to be evicted.
+
+    :param k: max keys kept.
+    """
+    def __init__(self, k=10):
+        self.k = k
+        self.counts = {}
+        self._heap = []
+        self._seq = itertools.count()
+
+    def update(self, key, count):
+        if key in self.counts:
+            self.counts[key] = count
+            return
+        if len(self.counts) < self.k:
+            self.counts[key] = count
+            heapq.heappush(self._heap, (count, next(self._seq), key))
+            return
+
+        while self._heap[0][0] < count:
+            _, _, min_key = self._heap[0]
+            min_count = self.counts[min_key]
+            if self._heap[0][0] != min_count:
+                # stale entry, re-validate with the latest count
+                heapq.heapreplace(
+                    self._heap, (min_count, next(self._seq), min_key))
+                continue
+            heapq.heapreplace(self._heap, (count, next(self._seq), key))
+            del self.counts[min_key]
+            self.counts[key] = count
+            return
+
+    def items(self):
+        """Return (key, count) tuples, largest first."""
+        return sorted(self.counts.items(), key=lambda x: -x[1])
+
+
+class HotRows(object):
+    """Windowed hot row detector.
+
+    :param threshold: min count in a window for a row to be hot.
+    :param window: window size in seconds.
+    :param k: max hot rows reported per window.
+    :param width: count-min sketch width.
+    :param depth: count-min sketch depth.
+    """
+    def __init__(self, threshold=1000, window=10, k=10, width=2048,
+                 depth=4):
+        self.threshold = threshold
+        self.window = window
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.logger = logging.getLogger("meepo.sub.hot_sub")
+
+        self.hot = set()
+        self._reset()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reset(self):
+        # replaced as a whole, so adds racing with rotate never see a
+        # sketch and top-k from different windows
+        self._state = (CountMinSketch(self.width, self.depth), TopK(self.k))
+
+    def add(self, table, pk, n=1):
+        sketch, top = self._state
+        key = (table, pk)
+        top.update(key, sketch.add(key, n))
+
+    def is_hot(self, table, pk):
+        """Whether the row was hot in the last window."""
+        return (table, pk) in self.hot
+
+    def rotate(self):
+        """End the current window, emit and return the hot rows."""
+        _, top = self._state
+        self._reset()
+
+        rows = [(table, pk, count) for (table, pk), count in top.items()
+                if count >= self.threshold]
+        self.hot = set((table, pk) for table, pk, _ in rows)
+        if rows:
+            self.logger.warning("hot rows in last %ss: %s" % (
+                self.window, ", ".join("%s:%s(%s)" % row for row in rows)))
+            signal("hot_rows").send(rows)
+        return rows
+
+    def _run(self):
+        while True:
+            time.sleep(self.window)
+            try:
+                self.rotate()
+            except Exception as e:
+                self.logger.exception(e)
+
+
+def hot_sub(tables, threshold=1000, window=10, **kwargs):
+    """Hot row detection sub.
+
+    Report rows of tables changed at least ``threshold`` times in a
+    ``window`` seconds window::
+
+        hot = hot_sub(["counter"], threshold=1000, window=10)
+
+        @signal("hot_rows").connect
+        def alert(rows):
+            for table, pk, count in rows:
+                ...
+
+        hot.is_hot("counter", 1)
+
+    :param tables: the events of tables to follow.
+    :param threshold: min count in a window for a row to be hot.
+    :param window: window size in seconds.
+    :param kwargs: kwargs to be passed to :class:`HotRows`.
+    :return: the :class:`HotRows` instance.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    hot = HotRows(threshold=threshold, window=window, **kwargs)
+    for table in tables:
+        def _sub(pk, table=table):
+            hot.add(table, pk)
+        for action in ("write", "update", "delete"):
+            signal("%s_%s" % (table, action)).connect(_sub, weak=False)
+
+    return hot
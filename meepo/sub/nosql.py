@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+"""
+The nosql sub replicates row images into key-value stores.
+
+Unlike ``examples/repl_db`` which re-queries the master for every pk, this
+sub consumes the complete row images on the ``table_action_raw`` signals
+sent by :func:`meepo.pub.mysql_pub`, so replication costs no master reads.
+
+Row images are batched per table with last-write-wins per pk, a deleted
+row is kept as ``None`` in batch, so a pk is always applied with its
+latest state and batches are applied one by one in order.
+
+Targets shipped:
+
+* :class:`RedisHashTarget`, one redis hash per row.
+* :class:`SQLiteTarget`, json encoded rows in a local sqlite database.
+* :class:`DictTarget`, rows in a python dict, for testing.
+
+Implement :class:`RowTarget` for other stores.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import decimal
+import itertools
+import json
+import logging
+import sqlite3
+
+import redis
+
+from .._compat import bytes, str
+from ..signals import signal
+from ..utils import row_pk
+from .batch import Batcher
+
+
+def _pk_str(pk):
+    if isinstance(pk, tuple):
+        return ":".join("%s" % p for p in pk)
+    return "%s" % pk
+
+
+def _encode(value):
+    """Encode column value to a type accepted by redis."""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return value
+
+
+class RowTarget(object):
+    """Row image target base class.
+    """
+    def apply(self, table, rows):
+        """Apply row images of table.
+
+        :param table: the table name.
+        :param rows: list of (pk, values) tuples, values is the column dict
+         of the row, or None if the row is deleted.
+        """
+        raise NotImplementedError
+
+
+class DictTarget(RowTarget):
+    """Keep rows in ``data`` dict of table -> {pk: values}.
+    """
+    def __init__(self):
+        self.data = {}
+
+    def apply(self, table, rows):
+        data = self.data.setdefault(table, {})
+        for pk, values in rows:
+            if values is None:
+                data.pop(pk, None)
+            else:
+                data[pk] = values
+
+    def get(self, table, pk):
+        return self.data.get(table, {}).get(pk)
+
+
+class RedisHashTarget(RowTarget):
+    """Write rows as redis hashes.
+
+    Every row is replaced with pipelined ``DEL`` and ``HSET`` in one
+    ``MULTI`` transaction per batch, so readers never see a half applied
+    row. ``None`` columns are not stored.
+
+    :param r: redis dsn or redis client.
+    :param key: key template formatted with ``table`` and ``pk``, tuple
+     pks are joined with ":".
+    :param encoder: func to encode column values for redis.
+    """
+    def __init__(self, r, key="{table}:{pk}", encoder=_encode):
+        if isinstance(r, (bytes, str)):
+            r = redis.StrictRedis.from_url(r, socket_timeout=1)
+        self.r = r
+        self.key = key
+        self.encoder = encoder
+
+    def _key(self, table, pk):
+        return self.key.format(table=table, pk=_pk_str(pk))
+
+    def apply(self, table, rows):
+        with self.r.pipeline() as p:
+            for pk, values in rows:
+                key = self._key(table, pk)
+                p.delete(key)
+                if values is None:
+                    continue
+                fields = [(k, self.encoder(v)) for k, v in values.items()
+                          if v is not None]
+                if fields:
+                    p.execute_command(
+                        "HSET", key, *itertools.chain.from_iterable(fields))
+            p.execute()
+
+    def get(self, table, pk):
+        return self.r.hgetall(self._key(table, pk))
+
+
+class SQLiteTarget(RowTarget):
+    """Keep json encoded rows in a sqlite ``rows`` table.
+
+    :param path: sqlite database path.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (tb TEXT, pk TEXT, data TEXT, "
+            "PRIMARY KEY (tb, pk))")
+        self.conn.commit()
+
+    def apply(self, table, rows):
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM rows WHERE tb = ? AND pk = ?",
+                [(table, _pk_str(pk)) for pk, values in rows
+                 if values is None])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows VALUES (?, ?, ?)",
+                [(table, _pk_str(pk), json.dumps(values, default=_encode))
+                 for pk, values in rows if values is not None])
+
+    def get(self, table, pk):
+        row = self.conn.execute(
+            "SELECT data FROM rows WHERE tb = ? AND pk = ?",
+            (table, _pk_str(pk))).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+class RowReplicator(object):
+    """Batch row images and apply them to target.
+
+    :param target: a :class:`RowTarget`.
+    :param pk_columns: dict of table -> pk column name, or tuple of column
+     names for composite pk, default to "id".
+    :param batch_size: max pending rows before an immediate apply.
+    :param interval: max seconds a row waits before applied.
+    """
+    def __init__(self, target, pk_columns=None, batch_size=500,
+                 interval=0.005):
+        self.target = target
+        self.pk_columns = pk_columns or {}
+        self.logger = logging.getLogger("meepo.sub.nosql_sub")
+        self.batcher = Batcher(
+            self.apply, max_size=batch_size, interval=interval,
+            logger_name="meepo.sub.nosql_sub.batcher", values=True)
+
+    def _pk(self, table, values):
+        col = self.pk_columns.get(table, "id")
+        pk = row_pk(values, col)
+        if pk is None:
+            self.logger.error("pk column %r not in row of %s, set pk_columns "
+                              "for the table: %s" % (col, table, values))
+        return pk
+
+    def add(self, table, row):
+        """Add a raw binlog row of table, rows without pk column are
+        logged and skipped.
+
+        :param row: the row sent by ``table_action_raw`` signal.
+        """
+        if "after_values" in row:
+            before = self._pk(table, row["before_values"])
+            after = self._pk(table, row["after_values"])
+            if before is None or after is None:
+                return
+            if before != after:
+                self.batcher.add(table, before, None)
+            self.batcher.add(table, after, row["after_values"])
+        elif "values" in row:
+            pk = self._pk(table, row["values"])
+            if pk is not None:
+                self.batcher.add(table, pk, row["values"])
+
+    def delete(self, table, row):
+        """Add a raw binlog row of a deleted row."""
+        pk = self._pk(table, row["values"])
+        if pk is not None:
+            self.batcher.add(table, pk, None)
+
+    def flush(self):
+        """Apply all pending rows synchronously."""
+        self.batcher.flush()
+
+    def apply(self, items):
+        for table, rows in items:
+            try:
+                self.target.apply(table, rows)
+            except Exception as e:
+                self.logger.error("apply %s failed %r: %s" % (
+                    table, e, [pk for pk, _ in rows]))
+                continue
+            self.logger.debug("%s: %s rows applied" % (table, len(rows)))
+
+
+def nosql_sub(target, tables, pk_columns=None, **kwargs):
+    """Row image replication sub.
+
+    Replicate rows of tables into redis hashes::
+
+        nosql_sub(RedisHashTarget("redis://localhost/"), ["test"])
+        mysql_pub(mysql_dsn, tables=["test"])
+
+    :param target: a :class:`RowTarget`.
+    :param tables: tables to be replicated.
+    :param pk_columns: dict of table -> pk column name, or tuple of column
+     names for composite pk, default to "id".
+    :param kwargs: kwargs to be passed to :class:`RowReplicator`.
+    :return: the :class:`RowReplicator`.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    replicator = RowReplicator(target, pk_columns=pk_columns, **kwargs)
+    for table in tables:
+        def _sub(row, table=table):
+            replicator.add(table, row)
+
+        def _sub_delete(row, table=table):
+            replicator.delete(table, row)
+
+        signal("%s_write_raw" % table).connect(_sub, weak=False)
+        signal("%s_update_raw" % table).connect(_sub, weak=False)
+        signal("%s_delete_raw" % table).connect(_sub_delete, weak=False)
+
+    return replicator
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+The redis stream sub fanouts events into redis streams, which is durable
+and supports consumer groups, so multiple workers can share the load with
+at-least-once delivery.
+
+Every stream entry has 2 fields::
+
+    topic -> the event name, e.g. "test_update"
+    body  -> the pks encoded with :mod:`meepo.protocol` binary protocol
+
+Events are written to one stream per table by default, or one stream per
+partition if ``partitions`` set, refer to :func:`stream_key`.
+
+Use :class:`meepo.apps.replicator.RedisStreamReplicator` to consume the
+streams.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import itertools
+import logging
+
+import redis
+
+from .. import protocol
+from ..signals import signal
+from .batch import Batcher
+
+
+def stream_key(prefix, topic, pk=None, partitions=None):
+    """Return the stream key of an event.
+
+    :param prefix: stream key prefix.
+    :param topic: the event name, in ``table_action`` format.
+    :param pk: the pk of event, only needed in partitioned mode.
+    :param partitions: the number of partitions, leave None to use one
+     stream per table.
+    """
+    if partitions:
+        return "%s:p%s" % (prefix, protocol.partition(pk, partitions))
+    return "%s:%s" % (prefix, topic.rsplit("_", 1)[0])
+
+
+def redis_stream_sub(redis_dsn, tables, prefix="meepo:stream",
+                     partitions=None, maxlen=1000000, batch_size=500,
+                     batch_interval=0.005, socket_timeout=1, **kwargs):
+    """Redis stream fanout sub.
+
+    Pks are coalesced per topic and written with pipelined ``XADD``, one
+    stream entry per batch, every ``batch_size`` pks or ``batch_interval``
+    seconds. Streams are trimmed approximately to ``maxlen`` entries::
+
+        redis_stream_sub("redis://localhost/", ["test"])
+
+    :param redis_dsn: the redis instance uri
+    :param tables: the events of tables to follow.
+    :param prefix: stream key prefix.
+    :param partitions: route pks into this number of partition streams,
+     leave None to use one stream per table.
+    :param maxlen: approximate max entries kept in each stream.
+    :param batch_size: max pks in one batch.
+    :param batch_interval: max seconds a pk waits in batch before sent.
+    :param socket_timeout: redis socket timeout
+    :param kwargs: kwargs to be passed to redis instance init func.
+    :return: the :class:`meepo.sub.batch.Batcher`, call its ``flush`` to
+     write pending events synchronously.
+    """
+    logger = logging.getLogger("meepo.sub.redis_stream_sub")
+
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    r = redis.StrictRedis.from_url(
+        redis_dsn, socket_timeout=socket_timeout, **kwargs)
+
+    def _flush(items):
+        with r.pipeline(transaction=False) as p:
+            for topic, pks in items:
+                streams = collections.defaultdict(list)
+                for pk in pks:
+                    streams[stream_key(prefix, topic, pk, partitions)] \
+                        .append(pk)
+
+                for key, key_pks in streams.items():
+                    _, body = protocol.encode(topic, key_pks)
+                    p.execute_command(
+                        "XADD", key, "MAXLEN", "~", maxlen, "*",
+                        "topic", topic, "body", body)
+            try:
+                p.execute()
+            except redis.ConnectionError as e:
+                logger.error("redis stream sub failed with connection "
+                             "error %r, events lost: %s" % (e, items))
+                return
+        logger.debug("xadd: %s" % items)
+
+    batcher = Batcher(_flush, max_size=batch_size, interval=batch_interval,
+                      logger_name="meepo.sub.redis_stream_sub.batcher")
+
+    events = ("%s_%s" % (tb, action) for tb, action in
+              itertools.product(*[tables, ["write", "update", "delete"]]))
+    for event in events:
+        def _sub(pk, event=event):
+            batcher.add(event, pk)
+        signal(event).connect(_sub, weak=False)
+
+    return batcher
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+The search sub syncs changed rows into search engines in bulk.
+
+Changed pks are collected per table, the rows are fetched in bulk with
+``SELECT ... WHERE pk IN (...)``, mapped to documents and written to a
+bulk sink. Pks not found in database are deleted from the sink, so the
+sync is based on the latest row state instead of the event action, and a
+row deleted then re-inserted within one batch is still synced correctly.
+
+Two sinks shipped:
+
+* :class:`HttpBulkSink`, for elasticsearch compatible ``_bulk`` api.
+* :class:`SQLiteFTSSink`, sqlite fts5 tables for local testing.
+
+Implement :class:`BulkSink` for other search engines.
+"""
+
+from __future__ import absolute_import
+
+import json
+import logging
+import sqlite3
+
+import sqlalchemy as sa
+
+from .._compat import Request, urlopen
+from ..signals import signal
+from .batch import Batcher
+
+
+class BulkSink(object):
+    """Bulk sink base class.
+    """
+    def index(self, table, docs):
+        """Index documents.
+
+        :param table: the table name.
+        :param docs: list of (pk, doc) tuples.
+        """
+        raise NotImplementedError
+
+    def delete(self, table, pks):
+        """Delete documents by pks.
+
+        :param table: the table name.
+        :param pks: list of pks.
+        """
+        raise NotImplementedError
+
+
+def _doc_id(pk):
+    if isinstance(pk, tuple):
+        return ":".join("%s" % p for p in pk)
+    return "%s" % pk
+
+
+class HttpBulkSink(BulkSink):
+    """Sink for elasticsearch compatible ``_bulk`` http api.
+
+    Documents of a batch are sent in one ``_bulk`` request.
+
+    :param url: the search engine url, e.g. ``http://localhost:9200``.
+    :param index: func accepting table and returning index name, default
+     to use table name as index name.
+    :param timeout: http request timeout.
+    """
+    def __init__(self, url, index=None, timeout=30):
+        self.url = "%s/_bulk" % url.rstrip("/")
+        self.index_name = index or (lambda table: table)
+        self.timeout = timeout
+
+    def _bulk(self, lines):
+        data = ("\n".join(json.dumps(line) for line in lines) + "\n") \
+            .encode("utf-8")
+        req = Request(self.url, data=data, headers={
+            "Content-Type": "application/x-ndjson"})
+        resp = json.loads(urlopen(req, timeout=self.timeout).read()
+                          .decode("utf-8"))
+        if resp.get("errors"):
+            raise ValueError("bulk request has errors: %s" % resp)
+        return resp
+
+    def index(self, table, docs):
+        lines = []
+        for pk, doc in docs:
+            lines.append({"index": {"_index": self.index_name(table),
+                                    "_id": _doc_id(pk)}})
+            lines.append(doc)
+        return self._bulk(lines)
+
+    def delete(self, table, pks):
+        return self._bulk([{"delete": {"_index": self.index_name(table),
+                                       "_id": _doc_id(pk)}} for pk in pks])
+
+
+class SQLiteFTSSink(BulkSink):
+    """Sink writing documents into sqlite fts5 tables, one fts table per
+    table with a ``pk`` column and the columns in ``fields``.
+
+    :param path: sqlite database path.
+    :param fields: dict of table -> list of document fields to be indexed.
+    """
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        for table, columns in fields.items():
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5"
+                "(pk UNINDEXED, %s)" % (table, ", ".join(columns)))
+        self.conn.commit()
+
+    def _delete(self, table, pks):
+        self.conn.executemany("DELETE FROM %s WHERE pk = ?" % table,
+                              [(_doc_id(pk), ) for pk in pks])
+
+    def index(self, table, docs):
+        columns = self.fields[table]
+        with self.conn:
+            self._delete(table, [pk for pk, _ in docs])
+            self.conn.executemany(
+                "INSERT INTO %s (pk, %s) VALUES (?, %s)" % (
+                    table, ", ".join(columns),
+                    ", ".join("?" for _ in columns)),
+                [[_doc_id(pk)] + [doc.get(c) for c in columns]
+                 for pk, doc in docs])
+
+    def delete(self, table, pks):
+        with self.conn:
+            self._delete(table, pks)
+
+    def search(self, table, query):
+        """Return pks of documents matching fts query."""
+        return [r[0] for r in self.conn.execute(
+            "SELECT pk FROM %s WHERE %s MATCH ? ORDER BY rank" % (
+                table, table), (query, ))]
+
+
+class SearchIndexer(object):
+    """Fetch rows of changed pks in bulk and write them to sink.
+
+    :param engine: sqlalchemy engine or database dsn of the source
+     database, the engine's connection pool is used for fetching.
+    :param sink: a :class:`BulkSink`.
+    :param mapper: func accepting table and row dict and returning the
+     document, default to use the row dict as document.
+    :param batch_size: max pending pks before an immediate sync.
+    :param interval: max seconds a pk waits before synced.
+    :param chunk_size: max pks in one ``SELECT ... IN`` query.
+    """
+    def __init__(self, engine, sink, mapper=None, batch_size=1000,
+                 interval=1, chunk_size=1000):
+        if not isinstance(engine, sa.engine.Engine):
+            engine = sa.create_engine(engine)
+        self.engine = engine
+        self.sink = sink
+        self.mapper = mapper or (lambda table, row: row)
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger("meepo.sub.search_sub")
+
+        self._tables = {}
+        self.batcher = Batcher(
+            self.sync, max_size=batch_size, interval=interval,
+            logger_name="meepo.sub.search_sub.batcher")
+
+    def add(self, table, pk):
+        """Add changed pk of table to be synced in batch."""
+        self.batcher.add(table, pk)
+
+    def flush(self):
+        """Sync all pending pks synchronously."""
+        self.batcher.flush()
+
+    def _table(self, name):
+        if name not in self._tables:
+            metadata = sa.MetaData()
+            metadata.reflect(bind=self.engine, only=[name])
+            self._tables[name] = metadata.tables[name]
+        return self._tables[name]
+
+    def fetch(self, table, pks):
+        """Fetch rows of pks in bulk.
+
+        :return: dict of pk -> row dict.
+        """
+        tb = self._table(table)
+        pk_cols = list(tb.primary_key.columns)
+        if len(pk_cols) == 1:
+            def _pk(row):
+                return row[pk_cols[0].name]
+            where = pk_cols[0].in_(pks)
+        else:
+            def _pk(row):
+                return tuple(row[c.name] for c in pk_cols)
+            where = sa.tuple_(*pk_cols).in_(pks)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(tb.select().where(where))
+            rows = [dict(getattr(row, "_mapping", row)) for row in rows]
+        return dict((_pk(row), row) for row in rows)
+
+    def sync(self, items):
+        """Sync a list of (table, pks) tuples to sink."""
+        for table, pks in items:
+            for i in range(0, len(pks), self.chunk_size):
+                chunk = pks[i:i + self.chunk_size]
+                try:
+                    self._sync(table, chunk)
+                except Exception as e:
+                    self.logger.error("sync %s failed %r: %s" % (
+                        table, e, chunk))
+
+    def _sync(self, table, pks):
+        rows = self.fetch(table, pks)
+        docs = [(pk, self.mapper(table, row)) for pk, row in rows.items()]
+        deleted = [pk for pk in pks if pk not in rows]
+        if docs:
+            self.sink.index(table, docs)
+        if deleted:
+            self.sink.delete(table, deleted)
+        self.logger.info("%s: %s indexed, %s deleted" % (
+            table, len(docs), len(deleted)))
+
+
+def search_sub(engine, tables, sink, mapper=None, **kwargs):
+    """Bulk search index sync sub.
+
+    Replicate tables from database to search engine, e.g. with
+    elasticsearch::
+
+        search_sub(mysql_dsn, ["test"], HttpBulkSink("http://es:9200"),
+                   mapper=lambda table, row: {"data": row["data"]})
+
+    :param engine: sqlalchemy engine or database dsn of the source
+     database.
+    :param tables: tables to be synced.
+    :param sink: a :class:`BulkSink`.
+    :param mapper: func accepting table and row dict and returning the
+     document.
+    :param kwargs: kwargs to be passed to :class:`SearchIndexer`.
+    :return: the :class:`SearchIndexer`.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    indexer = SearchIndexer(engine, sink, mapper=mapper, **kwargs)
+    for table in tables:
+        for action in ("write", "update", "delete"):
+            def _sub(pk, table=table):
+                indexer.add(table, pk)
+            signal("%s_%s" % (table, action)).connect(_sub, weak=False)
+
+    return indexer
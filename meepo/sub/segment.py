@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+
+"""
+The segment sub appends events to local append-only segment files, so the
+events can be replayed from any offset even if the consumer was down when
+the events happened, without any external broker.
+
+The log directory layout::
+
+    00000000000000000000.log    segment file, named by its base offset
+    00000000000000000000.idx    sparse offset index of the segment
+    00000000000000052344.log
+    00000000000000052344.idx
+    consumers/<name>.offset     committed offsets of consumers
+
+Every record in segment is::
+
+    !QHII -> offset, topic length, body length, crc32 of topic and body
+
+followed by the topic and the body encoded with :mod:`meepo.protocol`
+binary protocol, so typed pks are kept. The index file keeps an
+``(offset, position)`` entry every ``index_interval`` bytes of segment.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import itertools
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+from .. import protocol
+from ..signals import signal
+
+_RECORD = struct.Struct("!QHII")
+_INDEX = struct.Struct("!QQ")
+
+
+def _crc(topic, body):
+    return zlib.crc32(body, zlib.crc32(topic)) & 0xffffffff
+
+
+def _segments(path):
+    """Sorted base offsets of segments in path."""
+    return sorted(int(f[:-4]) for f in os.listdir(path) if f.endswith(".log"))
+
+
+def _segment_path(path, base, ext="log"):
+    return os.path.join(path, "%020d.%s" % (base, ext))
+
+
+def _read_index(path, base):
+    """Load sparse index of segment into (offsets, positions) lists."""
+    offsets, positions = [], []
+    try:
+        with open(_segment_path(path, base, "idx"), "rb") as f:
+            data = f.read()
+    except IOError:
+        return offsets, positions
+
+    for i in range(len(data) // _INDEX.size):
+        offset, pos = _INDEX.unpack_from(data, i * _INDEX.size)
+        offsets.append(offset)
+        positions.append(pos)
+    return offsets, positions
+
+
+def _read_record(buf, pos, size):
+    """Read record at pos from buf.
+
+    :return: (offset, topic, body, next_pos), or None if the record is
+     incomplete or corrupt.
+    """
+    if pos + _RECORD.size > size:
+        return None
+    offset, topic_len, body_len, crc = _RECORD.unpack_from(buf, pos)
+    start = pos + _RECORD.size
+    end = start + topic_len + body_len
+    if end > size:
+        return None
+
+    topic, body = buf[start:start + topic_len], buf[start + topic_len:end]
+    if _crc(topic, body) != crc:
+        return None
+    return offset, topic, body, end
+
+
+class SegmentLog(object):
+    """Append-only segment log writer.
+
+    Records are written to file buffers on :meth:`append` and fsync-ed in
+    batch from a background thread, every ``fsync_interval`` seconds or
+    when ``fsync_every`` records pending, whichever comes first. The append
+    lock is only held to write the buffers out, fsync runs outside it, so
+    appends never wait for the disk.
+
+    On open, the torn tail of last segment (if any) is truncated and the
+    log continues from the last valid record.
+
+    :param path: the log directory, will be created if not exists.
+    :param segment_bytes: roll to a new segment when segment exceeds the
+     size.
+    :param index_interval: bytes between sparse index entries.
+    :param fsync_interval: max seconds between fsync.
+    :param fsync_every: max pending records before fsync.
+    """
+    def __init__(self, path, segment_bytes=64 * 1024 * 1024,
+                 index_interval=4096, fsync_interval=0.05, fsync_every=1000):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.fsync_interval = fsync_interval
+        self.fsync_every = fsync_every
+        self.logger = logging.getLogger("meepo.sub.segment_sub")
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._wakeup = threading.Event()
+
+        segments = _segments(path)
+        self._open(segments[-1] if segments else 0)
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _open(self, base):
+        """Open segment for append, recover the torn tail if needed."""
+        log_path = _segment_path(self.path, base)
+        idx_path = _segment_path(self.path, base, "idx")
+        data = b""
+        if os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                data = f.read()
+
+        # drop index entries pointing to the torn tail
+        offsets, positions = _read_index(self.path, base)
+        valid = bisect.bisect_left(positions, len(data))
+        if valid < len(positions):
+            offsets, positions = offsets[:valid], positions[:valid]
+            with open(idx_path, "wb") as f:
+                f.write(b"".join(_INDEX.pack(o, p)
+                                 for o, p in zip(offsets, positions)))
+
+        # scan from the last index entry to find the end of valid records
+        pos = positions[-1] if positions else 0
+        next_offset = offsets[-1] if offsets else base
+        while True:
+            record = _read_record(data, pos, len(data))
+            if record is None:
+                break
+            next_offset, pos = record[0] + 1, record[3]
+        if pos != len(data):
+            self.logger.warning("truncate torn segment %s at %s" % (
+                log_path, pos))
+
+        self._log = open(log_path, "ab")
+        self._log.truncate(pos)
+        self._idx = open(idx_path, "ab")
+        self._base = base
+        self._size = pos
+        self._last_indexed = positions[-1] if positions else 0
+        self.next_offset = next_offset
+
+    def _roll(self):
+        """Roll to a new segment, return the fd to fsync the rolled
+        segment with.
+        """
+        fd = self._sync()
+        self._log.close()
+        self._idx.close()
+        self._open(self.next_offset)
+        return fd
+
+    def append(self, topic, pks):
+        """Append a record of topic and pks.
+
+        :return: offset of the record.
+        """
+        topic_data, body = protocol.encode(topic, pks)
+        fd = None
+        with self._lock:
+            offset = self.next_offset
+            if self._size == 0 or \
+                    self._size - self._last_indexed >= self.index_interval:
+                self._idx.write(_INDEX.pack(offset, self._size))
+                self._last_indexed = self._size
+
+            self._log.write(b"".join((
+                _RECORD.pack(offset, len(topic_data), len(body),
+                             _crc(topic_data, body)),
+                topic_data, body)))
+            self._size += _RECORD.size + len(topic_data) + len(body)
+            self.next_offset += 1
+            self._pending += 1
+
+            if self._size >= self.segment_bytes:
+                fd = self._roll()
+            elif self._pending >= self.fsync_every:
+                self._wakeup.set()
+        if fd is not None:
+            self._fsync(fd)
+        return offset
+
+    def _sync(self):
+        """Write buffers out to the os, must be called with lock held.
+
+        :return: a duplicated fd of the segment to fsync outside the lock,
+         it stays valid even if the segment is rolled and closed meanwhile.
+        """
+        self._log.flush()
+        self._idx.flush()
+        self._pending = 0
+        return os.dup(self._log.fileno())
+
+    def _fsync(self, fd):
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def flush(self):
+        """Flush and fsync all pending records."""
+        with self._lock:
+            if not self._pending or self._log.closed:
+                return
+            fd = self._sync()
+        self._fsync(fd)
+
+    def close(self):
+        with self._lock:
+            fd = self._sync()
+            self._log.close()
+            self._idx.close()
+        self._fsync(fd)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.fsync_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.logger.exception(e)
+
+
+class SegmentReader(object):
+    """Tailing iterator over a segment log.
+
+    Segments are read with mmap, the reader seeks by the sparse index to
+    the start offset then scans forward. When ``name`` is given, the reader
+    starts from the offset committed by :meth:`commit` of the same name.
+
+    Iterate the reader for ``(offset, topic, pks)`` tuples::
+
+        reader = SegmentReader("/data/meepo", name="repl")
+        for offset, topic, pks in reader:
+            process(topic, pks)
+            reader.commit(offset + 1)
+
+    :param path: the log directory.
+    :param offset: start offset, default to the committed offset or 0.
+    :param name: consumer name to store offset.
+    :param follow: wait for new records at the end of log, otherwise stop
+     iteration.
+    :param poll_interval: seconds between polls when following.
+    """
+    def __init__(self, path, offset=None, name=None, follow=True,
+                 poll_interval=0.05):
+        self.path = path
+        self.name = name
+        self.follow = follow
+        self.poll_interval = poll_interval
+
+        if offset is None:
+            offset = self.committed() if name else 0
+        self.offset = offset
+
+        self._mmap = None
+        self._base = None
+        self._pos = 0
+
+    def _offset_path(self):
+        return os.path.join(self.path, "consumers", "%s.offset" % self.name)
+
+    def committed(self):
+        """Return the committed offset of consumer, 0 if not committed."""
+        try:
+            with open(self._offset_path()) as f:
+                return int(f.read().strip() or 0)
+        except IOError:
+            return 0
+
+    def commit(self, offset=None):
+        """Commit offset atomically, default to the next offset to read.
+        """
+        offset_path = self._offset_path()
+        if not os.path.exists(os.path.dirname(offset_path)):
+            os.makedirs(os.path.dirname(offset_path))
+        tmp = "%s.tmp" % offset_path
+        with open(tmp, "w") as f:
+            f.write(str(self.offset if offset is None else offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, offset_path)
+
+    def _map(self):
+        """(Re)map current segment, return the mapped size."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        with open(_segment_path(self.path, self._base), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return size
+
+    def _seek(self):
+        """Locate segment and position of self.offset."""
+        segments = _segments(self.path)
+        if not segments:
+            return False
+        i = bisect.bisect_right(segments, self.offset) - 1
+        self._base = segments[max(i, 0)]
+        offsets, positions = _read_index(self.path, self._base)
+        j = bisect.bisect_right(offsets, self.offset) - 1
+        self._pos = positions[j] if j >= 0 else 0
+        return True
+
+    def _next_segment(self):
+        """Base offset of the segment after current one, or None."""
+        segments = _segments(self.path)
+        i = bisect.bisect_right(segments, self._base)
+        return segments[i] if i < len(segments) else None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __iter__(self):
+        size = 0
+        while True:
+            if self._base is None:
+                if not self._seek():
+                    if not self.follow:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                size = self._map()
+
+            record = None
+            if self._mmap is not None:
+                record = _read_record(self._mmap, self._pos, size)
+
+            if record is None:
+                # end of mapped data, remap if file grown or move to next
+                # segment if there is one. the writer flushes a segment
+                # before creating the next one, so check the next segment
+                # before remap to not miss the tail of current segment.
+                next_base = self._next_segment()
+                new_size = self._map()
+                if new_size > size:
+                    size = new_size
+                elif next_base is not None:
+                    self._base, self._pos = next_base, 0
+                    size = self._map()
+                elif not self.follow:
+                    return
+                else:
+                    time.sleep(self.poll_interval)
+                continue
+
+            offset, topic, body, self._pos = record
+            if offset < self.offset:
+                continue
+
+            msg = protocol.decode([topic, body])
+            self.offset = offset + 1
+            yield offset, msg.topic, msg.pks
+
+
+def segment_sub(path, tables, **kwargs):
+    """Durable segment log sub.
+
+    This sub appends events of tables to local segment files, consumers
+    can read from a stored offset with :class:`SegmentReader`::
+
+        segment_sub("/data/meepo", ["test"])
+
+    :param path: the log directory.
+    :param tables: the events of tables to follow.
+    :param kwargs: kwargs to be passed to :class:`SegmentLog`.
+    :return: the :class:`SegmentLog` instance.
+    """
+    if not isinstance(tables, (list, set)):
+        raise ValueError("tables should be list or set")
+
+    log = SegmentLog(path, **kwargs)
+
+    events = ("%s_%s" % (tb, action) for tb, action in
+              itertools.product(*[tables, ["write", "update", "delete"]]))
+    for event in events:
+        def _sub(pk, event=event):
+            log.append(event, [pk])
+        signal(event).connect(_sub, weak=False)
+
+    return log
@@ -2,47 +2,279 @@
 
 from __future__ import absolute_import
 
+import atexit
+import collections
 import itertools
 import logging
+import threading
+import time
 
+from .. import protocol as _protocol
 from ..signals import signal
+from .batch import Batcher
 
 
-def zmq_sub(bind, tables, forwarder=False, green=False):
+class _Sender(object):
+    """Send messages from a dedicated thread.
+
+    Messages are put into an in-memory deque by the publisher thread and
+    sent by the sender thread, so the publisher thread never waits on
+    network I/O. The sender keeps counters of pks sent, dropped by the
+    socket and dropped due to queue overflow, and logs them every
+    ``stats_interval`` seconds.
+
+    :param send_func: func accepting topic and a list of pks, return the
+     count of dropped pks.
+    :param max_queue: max messages waiting in queue, new messages will be
+     dropped when queue is full.
+    :param stats_interval: seconds between stats logging.
+    """
+    def __init__(self, send_func, max_queue=100000, stats_interval=60):
+        self.send_func = send_func
+        self.max_queue = max_queue
+        self.stats_interval = stats_interval
+        self.stats = collections.Counter()
+        self.logger = logging.getLogger("meepo.sub.zmq_sub.sender")
+
+        self._queue = collections.deque()
+        self._wakeup = threading.Event()
+        self._busy = False
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, topic, pks):
+        if len(self._queue) >= self.max_queue:
+            self.stats["overflow"] += len(pks)
+            return False
+        self._queue.append((topic, pks))
+        self._wakeup.set()
+        return True
+
+    def flush(self, timeout=5):
+        """Wait until all queued messages sent or timeout."""
+        deadline = time.time() + timeout
+        while (self._queue or self._busy) and time.time() < deadline:
+            self._wakeup.set()
+            time.sleep(0.001)
+
+    def _send_all(self):
+        while self._queue:
+            self._busy = True
+            try:
+                topic, pks = self._queue.popleft()
+                dropped = self.send_func(topic, pks) or 0
+                self.stats["dropped"] += dropped
+                self.stats["sent"] += len(pks) - dropped
+            except Exception as e:
+                self.logger.exception(e)
+            finally:
+                self._busy = False
+
+    def _run(self):
+        last_stats = time.time()
+        while True:
+            self._wakeup.wait(self.stats_interval)
+            self._wakeup.clear()
+            self._send_all()
+
+            if time.time() - last_stats >= self.stats_interval:
+                last_stats = time.time()
+                self.logger.info(
+                    "sent %(sent)s, dropped %(dropped)s, overflow "
+                    "%(overflow)s pks, qsize %(qsize)s" % dict(
+                        self.stats, qsize=len(self._queue)))
+
+
+def zmq_sub(bind, tables, forwarder=False, green=False,
+            batch_size=None, batch_interval=0.005, protocol="string",
+            sndhwm=None, noblock=False, max_queue=100000, stats_interval=60,
+            partitioned=False, compression=None, compress_threshold=4096,
+            copy_threshold=65536):
     """0mq fanout sub.
 
     This sub will use zeromq to fanout the events.
 
-    :param bind: the zmq pub socket or zmq device socket.
+    By default every pk is sent as a ``topic pk`` message. Set ``batch_size``
+    to coalesce pks of the same topic into ``topic pk1 pk2 ...`` messages,
+    pks are deduplicated and flushed from a background thread when either
+    ``batch_size`` pks pending or ``batch_interval`` seconds passed::
+
+        zmq_sub(bind, ["test"], batch_size=500, batch_interval=0.005)
+
+    Set ``protocol`` to "binary" to send versioned multipart messages with
+    typed pks, timestamp and the last seen ``mysql_binlog_pos``, refer to
+    :mod:`meepo.protocol` for details. The replicators detect the protocol
+    per message, so both protocols can be consumed by the same replicator.
+
+    Large binary batches can be compressed with zlib or lz4 above
+    ``compress_threshold`` bytes, and messages larger than
+    ``copy_threshold`` bytes are sent with zero-copy::
+
+        zmq_sub(bind, ["test"], batch_size=5000, protocol="binary",
+                compression="zlib")
+
+    Messages are sent from a dedicated sender thread, the signal receivers
+    only put pks into an in-memory queue, so the publisher is never blocked
+    by network I/O. Set ``noblock`` to drop messages instead of waiting
+    when the socket reaches ``sndhwm``, dropped pks are counted and logged
+    with other stats every ``stats_interval`` seconds::
+
+        zmq_sub(bind, ["test"], sndhwm=100000, noblock=True)
+
+    .. note::
+
+        A PUB socket silently drops messages when reaching hwm, so with
+        ``noblock`` set an XPUB socket with ``XPUB_NODROP`` is used to
+        account the dropped messages, if supported by the libzmq version.
+
+    **Partitioned Fanout**
+
+    With a PUB socket every replicator receives every message of its
+    subscribed topics. Set ``partitioned`` and pass a list of endpoints as
+    ``bind`` to open one PUSH socket per endpoint, every pk is routed to a
+    partition by :func:`meepo.protocol.partition`, so messages of the same
+    pk always go to the same partition and keep their order::
+
+        zmq_sub(["tcp://*:5001", "tcp://*:5002", "tcp://*:5003"], ["test"],
+                partitioned=True)
+
+    Each partition should be claimed by exactly one replicator, refer to
+    :class:`meepo.apps.replicator.Replicator` for the consumer side.
+
+    .. note::
+
+        A PUSH socket blocks when no consumer connected, set ``noblock``
+        to drop and count the messages instead.
+
+    :param bind: the zmq pub socket or zmq device socket, or a list of
+     endpoints in partitioned mode.
     :param tables: the events of tables to follow.
     :param forwarder: set to True if zmq pub to a forwarder device.
     :param green: weather to use a greenlet compat zmq
+    :param batch_size: max pks in one batch, leave None to disable batching.
+    :param batch_interval: max seconds a pk waits in batch before sent.
+    :param protocol: wire protocol, "string" or "binary".
+    :param sndhwm: zmq send high water mark, default to zmq default.
+    :param noblock: drop and count messages when socket reaches hwm.
+    :param max_queue: max messages in sender queue, messages exceeding
+     the limit will be dropped and counted as overflow.
+    :param stats_interval: seconds between stats logging.
+    :param partitioned: use one PUSH socket per endpoint in bind and route
+     pks to them by hash.
+    :param compression: "zlib" or "lz4" compression for binary protocol,
+     leave None to disable.
+    :param compress_threshold: only compress pks larger than this size.
+    :param copy_threshold: send messages larger than this size with zero
+     copy.
+    :return: the zmq socket, or list of sockets in partitioned mode.
     """
     logger = logging.getLogger("meepo.sub.zmq_sub")
 
     if not isinstance(tables, (list, set)):
         raise ValueError("tables should be list or set")
+    if protocol not in ("string", "binary"):
+        raise ValueError("protocol should be string or binary")
+    if compression and (protocol != "binary" or
+                        compression not in _protocol.COMPRESSIONS):
+        raise ValueError("compression should be zlib or lz4 and only "
+                         "works with binary protocol")
 
     if not green:
         import zmq
     else:
         import zmq.green as zmq
 
+    if partitioned:
+        if not isinstance(bind, (list, tuple)):
+            raise ValueError("bind should be list in partitioned mode")
+        socket_type, binds = zmq.PUSH, bind
+    elif noblock and hasattr(zmq, "XPUB_NODROP"):
+        socket_type, binds = zmq.XPUB, [bind]
+    else:
+        socket_type, binds = zmq.PUB, [bind]
+
     ctx = zmq.Context()
-    socket = ctx.socket(zmq.PUB)
+    sockets = []
+    for endpoint in binds:
+        socket = ctx.socket(socket_type)
+        if socket_type == zmq.XPUB:
+            socket.setsockopt(zmq.XPUB_NODROP, 1)
+        if sndhwm is not None:
+            socket.setsockopt(zmq.SNDHWM, sndhwm)
 
-    if forwarder:
-        socket.connect(bind)
+        if forwarder:
+            socket.connect(endpoint)
+        else:
+            socket.bind(endpoint)
+        sockets.append(socket)
+    send_flags = zmq.NOBLOCK if noblock else 0
+
+    if protocol == "binary":
+        binlog_pos = [None]
+
+        def _record_pos(pos):
+            binlog_pos[0] = pos
+        signal("mysql_binlog_pos").connect(_record_pos, weak=False)
+
+        def _encode(event, pks):
+            return _protocol.encode(
+                event, pks, pos=binlog_pos[0], compression=compression,
+                compress_threshold=compress_threshold)
     else:
-        socket.bind(bind)
+        def _encode(event, pks):
+            msg = "%s %s" % (event, " ".join(str(pk) for pk in pks))
+            return [msg.encode("utf-8")]
+
+    def _send_to(socket, event, pks):
+        frames = _encode(event, pks)
+        copy = len(frames[-1]) < copy_threshold
+        try:
+            socket.send_multipart(frames, send_flags, copy=copy)
+        except zmq.Again:
+            logger.debug("drop msg: %s -> %s" % (event, pks))
+            return len(pks)
+        logger.debug("pub msg: %s -> %s" % (event, pks))
+        return 0
+
+    if partitioned:
+        def _send(event, pks):
+            parts = collections.defaultdict(list)
+            for pk in pks:
+                parts[_protocol.partition(pk, len(sockets))].append(pk)
+            return sum(_send_to(sockets[i], event, part_pks)
+                       for i, part_pks in parts.items())
+    else:
+        def _send(event, pks):
+            return _send_to(sockets[0], event, pks)
+
+    sender = _Sender(_send, max_queue=max_queue,
+                     stats_interval=stats_interval)
+
+    if batch_size:
+        def _put_all(items):
+            for topic, pks in items:
+                sender.put(topic, pks)
+        batcher = Batcher(_put_all, max_size=batch_size,
+                          interval=batch_interval,
+                          logger_name="meepo.sub.zmq_sub.batcher")
+
+    def _flush():
+        if batch_size:
+            batcher.flush()
+        sender.flush()
+    atexit.register(_flush)
 
     events = ("%s_%s" % (tb, action) for tb, action in
               itertools.product(*[tables, ["write", "update", "delete"]]))
     for event in events:
-        def _sub(pk, event=event):
-            msg = "%s %s" % (event, pk)
-            socket.send_string(msg)
-            logger.debug("pub msg: %s" % msg)
+        if batch_size:
+            def _sub(pk, event=event):
+                batcher.add(event, pk)
+        else:
+            def _sub(pk, event=event):
+                sender.put(event, [pk])
         signal(event).connect(_sub, weak=False)
 
-    return socket
+    return sockets if partitioned else sockets[0]
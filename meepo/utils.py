@@ -72,3 +72,19 @@ def cast_datetime(ts, fmt=None):
         return dt.strftime(fmt)
     return dt
 d = cast_datetime
+
+
+def row_pk(values, columns="id"):
+    """Get pk from values of a raw binlog row.
+
+    :param values: row values dict.
+    :param columns: pk column name, or tuple of column names for composite
+     pk.
+    :return: the pk, or None if any pk column is missing in values.
+    """
+    try:
+        if isinstance(columns, tuple):
+            return tuple(values[c] for c in columns)
+        return values[columns]
+    except KeyError:
+        return None
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from meepo.signals import signal
+from meepo.sub.aggregate import Aggregate, Aggregator, aggregate_sub
+
+
+def _aggregates():
+    return [
+        Aggregate("agg_city", "agg", group_by="city", sums=["amount"]),
+        Aggregate("agg_total", "agg", where=lambda v: (v["amount"] or 0) > 10),
+    ]
+
+
+def test_aggregate_sub(tmpdir):
+    snapshot_path = str(tmpdir.join("aggregates.pickle"))
+    aggregator = aggregate_sub(_aggregates(), snapshot_path=snapshot_path,
+                               snapshot_interval=0)
+    aggregator.load_rows("agg", [{"id": 1, "city": "sh", "amount": 5}])
+
+    signal("agg_write_raw").send(
+        {"values": {"id": 2, "city": "sh", "amount": 20}})
+    signal("agg_write_raw").send(
+        {"values": {"id": 3, "city": "bj", "amount": None}})
+    signal("mysql_binlog_pos").send("mysql-bin.1:100")
+
+    assert aggregator.groups("agg_city") == {
+        "sh": {"count": 2, "amount": 25}, "bj": {"count": 1, "amount": 0}}
+    assert aggregator.get("agg_total") == {"count": 1}
+
+    # move row 2 to bj, then delete row 3
+    signal("agg_update_raw").send({
+        "before_values": {"id": 2, "city": "sh", "amount": 20},
+        "after_values": {"id": 2, "city": "bj", "amount": 8}})
+    signal("agg_delete_raw").send(
+        {"values": {"id": 3, "city": "bj", "amount": None}})
+
+    assert aggregator.groups("agg_city") == {
+        "sh": {"count": 1, "amount": 5}, "bj": {"count": 1, "amount": 8}}
+    assert aggregator.get("agg_total") == {"count": 0}
+    assert aggregator.get("agg_city", "gz") == {"count": 0, "amount": 0}
+
+    # snapshot taken at the last binlog pos
+    restored = Aggregator(_aggregates(), snapshot_path=snapshot_path)
+    assert restored.pos == "mysql-bin.1:100"
+    assert restored.groups("agg_city") == {
+        "sh": {"count": 2, "amount": 25}, "bj": {"count": 1, "amount": 0}}
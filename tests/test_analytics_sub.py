@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from meepo.signals import signal
+from meepo.sub.analytics import OTHER, Analytics, RingCounter, analytics_sub
+
+
+def test_ring_counter():
+    counter = RingCounter(10)
+    counter.add(100)
+    counter.add(100, 2)
+    counter.add(105)
+    assert counter.sum(1, 100) == 3
+    assert counter.sum(10, 105) == 4
+    assert counter.sum(5, 105) == 1
+
+    # bucket of second 100 reused by second 110
+    counter.add(110)
+    assert counter.sum(10, 110) == 2
+    assert counter.sum(100, 110) == 2
+
+
+def test_analytics():
+    analytics = Analytics(size=300, max_groups=2)
+    for ts in range(1000, 1060):
+        analytics.add("test", "write", ts=ts)
+    analytics.add("test", "write", n=60, ts=1000 - 100)
+
+    assert analytics.sum("test", "write", 60, now=1059) == 60
+    assert analytics.rate("test", "write", 60, now=1059) == 1
+    assert analytics.rate("test", "write", 300, now=1059) == 0.4
+    assert analytics.sum("test", "update", 60, now=1059) == 0
+    assert analytics.stats(now=1059) == {
+        "test_write": {"1m": 1, "5m": 0.4}}
+
+    for city, n in (("sh", 3), ("bj", 2), ("hz", 1), ("sz", 1)):
+        analytics.add_group("test", "write", city, n=n, ts=1000)
+    assert analytics.top("test", "write", n=3, now=1000) == [
+        ("sh", 3), ("bj", 2), (OTHER, 2)]
+
+
+def test_analytics_sub():
+    analytics = analytics_sub(["analytics"], group_by={"analytics": "city"})
+    for i in range(3):
+        signal("analytics_write").send(i)
+        signal("analytics_write_raw").send({"values": {
+            "id": i, "city": "sh" if i else "bj"}})
+
+    assert analytics.sum("analytics", "write") == 3
+    assert analytics.sum("analytics", "write", group="sh") == 2
+    assert analytics.top("analytics", "write", n=1) == [("sh", 2)]
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import gzip
+import json
+import os
+
+import pytest
+
+from meepo.signals import signal
+from meepo.sub.audit import AuditLog, audit_sub, read_audit
+from meepo.sub.dummy import print_sub
+
+
+@pytest.mark.parametrize("format,compression", [
+    ("json", None), ("json", "gzip"), ("msgpack", None), ("msgpack", "gzip"),
+])
+def test_audit_log(tmpdir, format, compression):
+    path = str(tmpdir)
+    log = AuditLog(path, format=format, compression=compression,
+                   max_bytes=1, flush_interval=60)
+    for i in range(3):
+        log.append("test_update", i, ts=100 + i, pos="mysql-bin.1:%s" % i)
+        log.flush()
+    log.close()
+
+    # every block rotated into its own file
+    assert len(os.listdir(path)) == 4
+    records = list(read_audit(path))
+    assert [r["pk"] for r in records] == [0, 1, 2]
+    assert records[0] == {"event": "test_update", "pk": 0, "ts": 100,
+                          "pos": "mysql-bin.1:0"}
+
+    assert [r["pk"] for r in read_audit(path, 101, 101)] == [1]
+    assert [r["pk"] for r in read_audit(path, start_ts=101)] == [1, 2]
+    assert list(read_audit(path, events=["test_write"])) == []
+
+
+def test_audit_log_gzip_blocks(tmpdir):
+    log = AuditLog(str(tmpdir), compression="gzip", flush_interval=60)
+    log.append("test_write", 1)
+    log.flush()
+    log.append("test_write", 2)
+    log.close()
+
+    name, = [n for n in os.listdir(str(tmpdir)) if n.endswith(".gz")]
+    with gzip.open(str(tmpdir.join(name))) as f:
+        assert [json.loads(line.decode("utf-8"))["pk"]
+                for line in f] == [1, 2]
+
+
+def test_audit_sub(tmpdir):
+    path = str(tmpdir)
+    log = audit_sub(path, ["audit"], flush_interval=60)
+    signal("mysql_binlog_pos").send("mysql-bin.1:4")
+    signal("audit_write").send(1)
+    signal("audit_delete").send(1)
+    log.close()
+
+    assert [(r["event"], r["pk"], r["pos"]) for r in read_audit(path)] == [
+        ("audit_write", 1, "mysql-bin.1:4"),
+        ("audit_delete", 1, "mysql-bin.1:4")]
+
+
+def test_audit_sub_diff(tmpdir):
+    path = str(tmpdir)
+    log = audit_sub(path, ["audit_diff"], diff=True, flush_interval=60)
+    signal("audit_diff_write_raw").send({"values": {"id": 1, "data": "a"}})
+    signal("audit_diff_update_raw").send({
+        "before_values": {"id": 1, "data": "a"},
+        "after_values": {"id": 1, "data": "b"}})
+    log.close()
+
+    assert [(r["pk"], r["diff"]) for r in read_audit(path)] == [
+        (1, {"id": [None, 1], "data": [None, "a"]}),
+        (1, {"data": ["a", "b"]})]
+
+
+def test_audit_sub_diff_missing_pk_column(tmpdir):
+    path = str(tmpdir)
+    log = audit_sub(path, ["audit_nopk"], diff=True, flush_interval=60)
+    signal("audit_nopk_write_raw").send({"values": {"uid": 1}})
+    log.close()
+
+    assert [(r["pk"], r["diff"]) for r in read_audit(path)] == [
+        (None, {"uid": [None, 1]})]
+
+
+def test_print_sub(caplog):
+    print_sub(["print"])
+    signal("print_update").send(1)
+    assert "print_update -> 1" in caplog.text
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+
+from meepo.signals import signal
+from meepo.sub.batch import Batcher, Debouncer, debounce
+
+
+def test_batcher():
+    result = []
+    batcher = Batcher(result.extend, max_size=100, interval=60)
+    for pk in (1, 2, 1):
+        batcher.add("test_update", pk)
+    batcher.add("test_delete", 1)
+    batcher.flush()
+
+    assert result == [("test_update", [1, 2]), ("test_delete", [1])]
+
+
+def test_debounce():
+    result = []
+    debouncer = debounce(
+        ["debounce_update"], lambda pk, **kw: result.append((pk, kw)),
+        quiet=0.1, max_delay=10)
+
+    for i in range(10):
+        signal("debounce_update").send(1, data=i)
+    signal("debounce_update").send(2)
+    assert result == []
+
+    time.sleep(0.3)
+    assert sorted(result) == [(1, {"data": 9}), (2, {})]
+    assert not debouncer._pending
+
+
+def test_debounce_max_delay():
+    result = []
+    debouncer = Debouncer(result.append, quiet=0.2, max_delay=0.3)
+
+    # keep updating a hot key, it will be emitted by max delay
+    for i in range(10):
+        debouncer.add("hot", i)
+        time.sleep(0.05)
+    assert result and result[0] < 9
+
+
+def test_debounce_max_pending():
+    result = []
+    debouncer = Debouncer(result.append, quiet=60, max_pending=2)
+    for i in range(3):
+        debouncer.add(i, i)
+    assert result == [0]
+
+    debouncer.flush()
+    assert result == [0, 1, 2]
+
+
+def test_batcher_values():
+    result = []
+    batcher = Batcher(result.extend, max_size=100, interval=60, values=True)
+    batcher.add("test", 1, "a")
+    batcher.add("test", 2, "b")
+    batcher.add("test", 1, None)
+    batcher.flush()
+
+    assert result == [("test", [(1, None), (2, "b")])]
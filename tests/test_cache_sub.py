@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from meepo.signals import signal
+from meepo.sub.cache import invalidate_sub
+
+
+class MockMemcache(object):
+    def __init__(self):
+        self.calls = []
+
+    def delete_multi(self, keys):
+        self.calls.append(sorted(keys))
+
+
+def test_invalidate_sub_memcache():
+    mc = MockMemcache()
+    invalidator = invalidate_sub(mc, {
+        "inv": ["inv:{pk}", "inv_profile:{pk}"],
+        "inv_item": ["inv_item:{pk[0]}:{pk[1]}"],
+    }, window=60)
+
+    for _ in range(100):
+        signal("inv_update").send(1)
+    signal("inv_delete").send(2)
+    signal("inv_item_write").send((1, 2))
+    invalidator.flush()
+
+    assert mc.calls == [["inv:1", "inv:2", "inv_item:1:2",
+                         "inv_profile:1", "inv_profile:2"]]
+    assert invalidator.stats == {"keys": 5, "batches": 1}
+
+
+def test_invalidate_sub_redis(redis_dsn):
+    import redis
+    r = redis.StrictRedis.from_url(redis_dsn)
+    r.mset({"inv_redis:1": 1, "inv_redis:2": 2, "inv_redis:3": 3})
+
+    invalidator = invalidate_sub(redis_dsn, {"inv_redis": ["inv_redis:{pk}"]},
+                                 window=60)
+    signal("inv_redis_update").send(1)
+    signal("inv_redis_delete").send(2)
+    invalidator.flush()
+
+    assert r.exists("inv_redis:1") == r.exists("inv_redis:2") == 0
+    assert r.exists("inv_redis:3") == 1
+    assert invalidator.stats["batches"] == 1
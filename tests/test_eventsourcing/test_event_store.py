@@ -8,8 +8,37 @@ import time
 logging.basicConfig(level=logging.DEBUG)
 
 import pytest
+import redis
 
-from meepo.apps.eventsourcing.event_store import RedisEventStore
+from meepo.apps.eventsourcing.codec import (
+    IntCodec,
+    TupleCodec,
+    short_namespace,
+)
+from meepo.apps.eventsourcing.event_store import (
+    BufferedEventStore,
+    EventStore,
+    InMemoryEventStore,
+    RedisEventStore,
+    RollingRedisEventStore,
+    SQLiteEventStore,
+)
+
+
+@pytest.fixture(scope="function")
+def sharded_event_store(request, redis_dsn):
+    base, _, db = redis_dsn.rpartition("/")
+    dsns = [redis_dsn] + ["%s/%s" % (base, int(db or 0) + i)
+                          for i in (1, 2)]
+    event_store = RedisEventStore(dsns)
+
+    def fin():
+        for r in event_store.shards.nodes:
+            r.flushdb()
+        event_store.close()
+
+    request.addfinalizer(fin)
+    return event_store
 
 
 @pytest.fixture(scope="function")
@@ -81,3 +110,419 @@ def test_redis_event_store_query(redis_event_store):
     # test replay by ts
     assert redis_event_store.query("test_write", pks[0]) == times[0]
     assert redis_event_store.query("test_write", pks[3]) == times[3]
+
+
+def test_redis_event_store_add_ttl(redis_event_store):
+    redis_event_store.add("test_write", 1)
+    key = redis_event_store._keygen("test_write")
+    assert 0 < redis_event_store.r.ttl(key) <= redis_event_store.ttl
+
+    redis_event_store.add("test_write", 2, ttl=10)
+    assert 0 < redis_event_store.r.ttl(key) <= 10
+
+    # older event won't refresh the score nor the expiration
+    now = int(time.time())
+    redis_event_store.add("test_write", 3, ts=now, ttl=100)
+    redis_event_store.add("test_write", 3, ts=now - 10, ttl=1000)
+    assert redis_event_store.query("test_write", 3) == now
+    assert redis_event_store.r.ttl(key) <= 100
+
+
+def test_redis_event_store_add_many(redis_event_store):
+    now = int(time.time())
+    redis_event_store.add("test_write", 1, ts=now)
+    assert redis_event_store.add_many([
+        ("test_write", 1, now - 10),
+        ("test_write", 2, now - 1),
+        ("test_write", 3, None),
+        ("test_update", 4, now),
+    ], chunk_size=1)
+
+    assert redis_event_store.replay("test_write", with_ts=True)[:2] == [
+        ('2', now - 1), ('1', now)]
+    assert redis_event_store.query("test_write", 3) >= now
+    assert redis_event_store.replay("test_update") == ['4']
+    assert redis_event_store.r.ttl(redis_event_store._keygen("test_update"))
+    assert redis_event_store.add_many([])
+
+
+def test_redis_event_store_add_many_evalsha(redis_event_store,
+                                            monkeypatch):
+    def load_scripts(self):
+        raise AssertionError("SCRIPT EXISTS sent")
+    monkeypatch.setattr(redis.client.Pipeline, "load_scripts", load_scripts)
+
+    now = int(time.time())
+    # script not loaded yet, loaded and retried
+    redis_event_store.r.script_flush()
+    assert redis_event_store.add_many([("test_write", 1, now)])
+    assert redis_event_store.add_many([("test_write", 2, now + 1)])
+    assert redis_event_store.replay("test_write") == ['1', '2']
+
+
+def test_redis_event_store_replay_iter(redis_dsn):
+    event_store = RedisEventStore(
+        redis_dsn, namespace=lambda ts: "test_iter:%s" % (int(ts) // 10))
+
+    # 3 events per namespace across 4 namespaces, some share timestamps
+    events = [(pk, 100 + pk // 2 * 3) for pk in range(12)]
+    for pk, ts in reversed(events):
+        event_store.add("test_write", pk, ts=ts)
+
+    replayed = list(event_store.replay_iter(
+        "test_write", 100, 200, with_ts=True, page_size=2, step=10))
+    assert sorted(replayed, key=lambda e: (e[1], int(e[0]))) == [
+        (str(pk), ts) for pk, ts in events]
+    assert [ts for _, ts in replayed] == sorted(ts for _, ts in events)
+
+    # range across 2 namespaces
+    assert list(event_store.replay_iter(
+        "test_write", 109, 111, step=10)) == ['6', '7']
+    event_store.r.flushdb()
+
+
+@pytest.mark.parametrize("zmscore", [None, False])
+def test_redis_event_store_query_many(redis_event_store, zmscore):
+    # False forces the pipelined ZSCORE fallback
+    redis_event_store._zmscore = zmscore
+    now = int(time.time())
+    redis_event_store.add_many([("test_write", pk, now + pk)
+                                for pk in (1, 2, 3)])
+
+    assert redis_event_store.query_many(
+        "test_write", [3, 4, 1, 2], chunk_size=3) == [
+            now + 3, None, now + 1, now + 2]
+    assert redis_event_store.query_many("test_update", [1]) == [None]
+
+
+def test_redis_event_store_replay_many(redis_event_store):
+    now = int(time.time())
+    redis_event_store.add_many([("test_write", 1, now),
+                                ("test_update", 2, now + 1)])
+
+    assert redis_event_store.replay_many(
+        ["test_write", "test_update", "test_delete"]) == {
+            "test_write": ['1'], "test_update": ['2'], "test_delete": []}
+    assert redis_event_store.replay_many(
+        ["test_update"], ts=now, with_ts=True) == {
+            "test_update": [('2', now + 1)]}
+
+
+def test_buffered_event_store(redis_event_store):
+    now = int(time.time())
+    event_store = BufferedEventStore(redis_event_store, interval=60)
+    event_store.add("test_write", 1, ts=now)
+    event_store.add("test_write", 1, ts=now - 1)
+    event_store.add("test_write", 2, ts=now)
+    event_store.add("test_write", 2)
+    assert event_store.replay("test_write") == []
+
+    assert event_store.flush()
+    assert event_store.query("test_write", 1) == now
+    assert event_store.query("test_write", 2) >= now
+    assert event_store.stats == {"added": 4, "flushed": 2}
+
+
+def test_buffered_event_store_failure():
+    class FlakyStore(EventStore):
+        def __init__(self):
+            self.events, self.fail = [], True
+
+        def add_many(self, events):
+            if self.fail:
+                self.fail = False
+                raise ValueError("failed")
+            self.events.extend(events)
+            return True
+
+    store = FlakyStore()
+    event_store = BufferedEventStore(store, interval=60, max_pending=2)
+    event_store.add("test_write", 1, ts=1)
+    event_store.add("test_write", 2, ts=1)
+    # full, the new event is dropped without flushing in the caller
+    assert not event_store.add("test_write", 3, ts=1)
+    assert event_store.stats["overflow"] == 1
+    assert event_store.stats["dropped"] == 1
+
+    # the failed events are put back
+    assert not event_store.flush()
+    assert event_store.stats["failures"] == 1
+    assert store.events == []
+
+    assert event_store.flush()
+    assert sorted(store.events) == [("test_write", 1, 1),
+                                    ("test_write", 2, 1)]
+    assert event_store.add("test_write", 3, ts=1)
+
+
+class DownStore(EventStore):
+    def __init__(self):
+        self.calls, self.down = 0, True
+
+    def add_many(self, events):
+        self.calls += 1
+        if self.down:
+            raise ValueError("down")
+        return True
+
+
+def test_buffered_event_store_down():
+    store = DownStore()
+    event_store = BufferedEventStore(store, interval=60, max_pending=2)
+    results = [event_store.add("test_write", pk, ts=1) for pk in range(5)]
+    assert results == [True, True, False, False, False]
+    assert not event_store.add_many([("test_write", pk, 1)
+                                     for pk in range(5, 15)])
+    assert event_store.stats["dropped"] == 13
+    assert event_store.stats["overflow"] == 4
+    # the callers never write to the store
+    assert store.calls == 0
+
+
+def test_buffered_event_store_backoff():
+    store = DownStore()
+    event_store = BufferedEventStore(store, max_size=1, interval=0.05,
+                                     max_backoff=0.2)
+    event_store.add("test_write", 1, ts=1)
+    time.sleep(1)
+    # 0.05, 0.1, 0.2, 0.2... between retries instead of a busy loop
+    assert 2 <= store.calls <= 10
+    assert event_store.stats["failures"] == store.calls
+
+    store.down = False
+    time.sleep(0.5)
+    assert event_store.stats["flushed"] == 1
+
+
+def test_in_memory_event_store():
+    event_store = InMemoryEventStore()
+    now = int(time.time())
+
+    for i, pk in enumerate((5, 3, 1, 4)):
+        event_store.add("test_write", pk, ts=now + i % 2)
+    # older or same ts won't update
+    event_store.add("test_write", 3, ts=now - 10)
+    event_store.add("test_write", 1, ts=now + 2)
+
+    # ordered by ts, then pk
+    assert event_store.replay("test_write") == ['5', '3', '4', '1']
+    assert event_store.replay("test_write", with_ts=True) == [
+        ('5', now), ('3', now + 1), ('4', now + 1), ('1', now + 2)]
+    assert event_store.replay("test_write", ts=now + 1, end_ts=now + 1) == [
+        '3', '4']
+    assert event_store.query("test_write", 1) == now + 2
+    assert event_store.query("test_write", 2) is None
+
+    assert event_store.clear("test_write") == 1
+    assert event_store.replay("test_write") == []
+
+
+def test_in_memory_event_store_ttl():
+    event_store = InMemoryEventStore(namespace="test", ttl=0.1)
+    event_store.add("test_write", 1)
+    assert event_store.query("test_write", 1)
+
+    time.sleep(0.2)
+    event_store.sweep()
+    assert event_store.replay("test_write") == []
+    assert not event_store._keys
+
+
+def test_in_memory_event_store_tuple_pk():
+    event_store = InMemoryEventStore(namespace="test")
+    event_store.add("test_write", (1, 2), ts=100)
+
+    assert event_store.replay("test_write") == ["(1, 2)"]
+    assert event_store.query("test_write", (1, 2)) == 100
+
+
+def test_sqlite_event_store(tmpdir):
+    event_store = SQLiteEventStore(str(tmpdir.join("events.db")))
+    now = int(time.time())
+
+    assert event_store.add_many([
+        ("test_write", 5, now), ("test_write", 3, now + 1),
+        ("test_write", 4, now + 1), ("test_write", 1, now + 1),
+        # the newer ts in batch wins
+        ("test_write", 1, now + 2), ("test_write", 1, now)])
+    # older ts won't update
+    event_store.add("test_write", 3, ts=now - 10)
+
+    assert event_store.replay("test_write") == ['5', '3', '4', '1']
+    assert event_store.replay("test_write", with_ts=True) == [
+        ('5', now), ('3', now + 1), ('4', now + 1), ('1', now + 2)]
+    assert event_store.replay("test_write", ts=now + 1, end_ts=now + 1) == [
+        '3', '4']
+    assert list(event_store.replay_iter(
+        "test_write", now + 1, end_ts=now + 2)) == [
+        '3', '4', '1']
+    assert event_store.query("test_write", 1) == now + 2
+    assert event_store.query("test_write", 2) is None
+
+    assert event_store.clear("test_write") == 1
+    assert event_store.replay("test_write") == []
+
+
+def test_sqlite_event_store_replay_plan(tmpdir):
+    event_store = SQLiteEventStore(str(tmpdir.join("events.db")))
+    conn = event_store._conn()
+    sqls = []
+    conn.set_trace_callback(sqls.append)
+    event_store.replay("test_write", 0, 100)
+    conn.set_trace_callback(None)
+
+    # served in index order, without sorting in a temp b-tree
+    sql, = sqls
+    plan = " ".join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN " + sql))
+    assert "events_replay" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_sqlite_event_store_tuple_pk(tmpdir):
+    event_store = SQLiteEventStore(str(tmpdir.join("events.db")),
+                                   namespace="test")
+    assert event_store.add_many([("test_write", (1, 2), 100)])
+    event_store.add("test_write", (3, 4), ts=101)
+
+    assert event_store.replay("test_write") == ["(1, 2)", "(3, 4)"]
+    assert event_store.query("test_write", (1, 2)) == 100
+
+
+def test_sqlite_event_store_sweep(tmpdir):
+    event_store = SQLiteEventStore(str(tmpdir.join("events.db")),
+                                   namespace="test", ttl=60)
+    now = int(time.time())
+    event_store.add("test_write", 1, ts=now - 120)
+    event_store.add("test_write", 2, ts=now)
+
+    assert event_store.sweep() == 1
+    assert event_store.replay("test_write") == ['2']
+
+    # deleted in chunks
+    assert event_store.add_many([("test_write", pk, now - 120)
+                                 for pk in range(10, 15)])
+    assert event_store.sweep(chunk_size=2) == 5
+    assert event_store.replay("test_write") == ['2']
+
+
+def test_sharded_event_store(sharded_event_store):
+    now = int(time.time())
+    events = ["test%s_write" % i for i in range(30)]
+
+    assert sharded_event_store.add_many(
+        [(event, pk, now + pk) for event in events for pk in (2, 1)])
+    sharded_event_store.add(events[0], 3, ts=now)
+
+    # every key is intact on exactly one node
+    nodes = sharded_event_store.shards.nodes
+    for event in events:
+        key = sharded_event_store._keygen(event, now)
+        assert [r.exists(key) for r in nodes].count(1) == 1
+    # and keys are spread over nodes
+    assert all(r.dbsize() for r in nodes)
+
+    assert sharded_event_store.replay(events[0]) == ['3', '1', '2']
+    assert sharded_event_store.query(events[1], 2) == now + 2
+    assert sharded_event_store.replay_many(events[:2], with_ts=True) == {
+        events[0]: [('3', now), ('1', now + 1), ('2', now + 2)],
+        events[1]: [('1', now + 1), ('2', now + 2)],
+    }
+    assert sharded_event_store.clear(events[0]) == 1
+    assert sharded_event_store.replay(events[0]) == []
+
+
+def test_sharded_event_store_close(sharded_event_store):
+    events = [("test%s_write" % i, 1, None) for i in range(30)]
+    assert sharded_event_store.add_many(events)
+    pool = sharded_event_store.shards._pool
+    assert pool is not None
+
+    sharded_event_store.close()
+    assert sharded_event_store.shards._pool is None
+    assert not any(w.is_alive() for w in pool._pool)
+
+    # the pool is recreated on demand
+    assert sharded_event_store.add_many(events)
+    sharded_event_store.close()
+
+
+def test_redis_event_store_single_node_no_pool(redis_event_store):
+    events = [("test%s_write" % i, 1, None) for i in range(30)]
+    assert redis_event_store.add_many(events)
+    assert redis_event_store.shards._pool is None
+
+
+def test_redis_event_store_int_codec(redis_dsn):
+    event_store = RedisEventStore(redis_dsn, codec=IntCodec(width=4),
+                                  namespace=short_namespace())
+    try:
+        now = int(time.time())
+        event_store.add_many([("test_write", pk, now) for pk in (1, "2")])
+        event_store.add("test_write", 256, ts=now + 1)
+
+        key = event_store._keygen("test_write")
+        assert event_store.r.zscore(key, b"\x00\x00\x01\x00") == now + 1
+        assert event_store.replay("test_write") == [1, 2, 256]
+        assert event_store.query("test_write", 256) == now + 1
+        assert event_store.query_many("test_write", [1, 3]) == [now, None]
+        assert list(event_store.replay_iter(
+            "test_write", now, end_ts=now + 1)) == [1, 2, 256]
+    finally:
+        event_store.r.flushdb()
+
+
+def test_redis_event_store_tuple_codec(redis_dsn):
+    event_store = RedisEventStore(redis_dsn, codec=TupleCodec("IH"))
+    try:
+        event_store.add("test_write", (1, 2))
+        assert event_store.replay("test_write") == [(1, 2)]
+        assert event_store.query("test_write", (1, 2))
+    finally:
+        event_store.r.flushdb()
+
+
+def test_short_namespace():
+    namespace = short_namespace()
+    assert namespace(0) == "es:0"
+    assert namespace(3600 * 24 * 36) == "es:10"
+    assert short_namespace("o", 3600)(3600 * 35) == "o:z"
+
+
+def test_rolling_redis_event_store(redis_dsn):
+    event_store = RollingRedisEventStore(
+        redis_dsn, ttl=3600, trim_interval=0, chunk_size=2, max_rate=0)
+    try:
+        now = int(time.time())
+        event_store.add_many([("test_write", pk, now - 7200 + pk)
+                              for pk in range(5)])
+        event_store.add("test_write", 5, ts=now)
+        event_store.add("test_update", 1, ts=now - 7200)
+
+        # one key for all timestamps
+        assert event_store.replay("test_write", ts=now - 7200) == [
+            '0', '1', '2', '3', '4', '5']
+        assert event_store.query("test_update", 1, ts=now) == now - 7200
+
+        assert event_store.trim("test_write") == 5
+        assert event_store.replay("test_write") == ['5']
+        assert event_store.trim() == 1
+        assert event_store.replay("test_update") == []
+    finally:
+        event_store.r.flushdb()
+
+
+def test_redis_event_store_namespace_keys(redis_dsn):
+    event_store = RedisEventStore(
+        redis_dsn, namespace=lambda ts: "test:%s" % (int(ts) // 86400),
+        ttl=86400 * 3)
+    end_ts = 86400 * 10000
+
+    # namespaces older than ttl are not probed
+    assert event_store._namespace_keys("test_write", 0, end_ts, 3600) == [
+        "test:9997:test_write", "test:9998:test_write",
+        "test:9999:test_write", "test:10000:test_write"]
+
+    event_store.ttl = None
+    assert len(event_store._namespace_keys(
+        "test_write", 0, end_ts, 3600)) == 10001
@@ -33,8 +33,11 @@ def test_redis_es_sub_commit(mock_session, es_sub):
     assert prepare_commit.phase(mock_session) == "commit"
     assert prepare_commit.prepare_info() == set()
 
-    signal("test_write").send(1)
-    assert event_store.replay("test_write") == ['1']
+    signal("session_batch").send(mock_session, event={
+        "test_write": {1, 2}, "test_update": {3}, "other_write": {4}})
+    assert sorted(event_store.replay("test_write")) == ['1', '2']
+    assert event_store.replay("test_update") == ['3']
+    assert event_store.replay("other_write") == []
 
 
 def test_redis_es_sub_rollback(mock_session, es_sub):
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from meepo.signals import signal
+from meepo.sub.hot import CountMinSketch, TopK, hot_sub
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=64, depth=4)
+    for i in range(1000):
+        sketch.add(("test", i % 100))
+    assert sketch.add(("test", 1), 90) >= 100
+    # never under estimated
+    assert all(sketch.count(("test", i)) >= 10 for i in range(100))
+    assert len(sketch.table) == 64 * 4
+
+
+def test_top_k():
+    top = TopK(2)
+    for key, count in (("a", 1), ("b", 2), ("c", 3), ("a", 2), ("a", 5),
+                       ("d", 4)):
+        top.update(key, count)
+    assert top.items() == [("a", 5), ("d", 4)]
+
+    # the stale heap entry of "a" is re-validated instead of evicted
+    top = TopK(2)
+    for key, count in (("a", 1), ("b", 2), ("a", 5), ("c", 3)):
+        top.update(key, count)
+    assert top.items() == [("a", 5), ("c", 3)]
+
+
+def test_hot_sub():
+    result = []
+
+    def _hot(rows):
+        result.extend(rows)
+    signal("hot_rows").connect(_hot)
+
+    hot = hot_sub(["hot"], threshold=100, window=60, k=3)
+    for i in range(1000):
+        signal("hot_update").send(1)
+        signal("hot_update").send(i + 10)
+    signal("hot_write").send(2)
+
+    assert hot.rotate() == [("hot", 1, 1000)]
+    assert result == [("hot", 1, 1000)]
+    assert hot.is_hot("hot", 1)
+    assert not hot.is_hot("hot", 2)
+
+    # new window
+    assert hot.rotate() == []
+    assert not hot.is_hot("hot", 1)
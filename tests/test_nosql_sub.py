@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import datetime
+
+import redis
+
+from meepo.signals import signal
+from meepo.sub.nosql import (
+    DictTarget,
+    RedisHashTarget,
+    SQLiteTarget,
+    nosql_sub,
+)
+
+
+def _send(table):
+    signal("%s_write_raw" % table).send({"values": {"id": 1, "data": "a"}})
+    signal("%s_write_raw" % table).send({"values": {"id": 2, "data": "b"}})
+    signal("%s_update_raw" % table).send({
+        "before_values": {"id": 1, "data": "a"},
+        "after_values": {"id": 1, "data": "c"}})
+    signal("%s_delete_raw" % table).send({"values": {"id": 2, "data": "b"}})
+    # pk changed
+    signal("%s_update_raw" % table).send({
+        "before_values": {"id": 1, "data": "c"},
+        "after_values": {"id": 3, "data": "c"}})
+
+
+def test_nosql_sub_dict():
+    target = DictTarget()
+    repl = nosql_sub(target, ["nosql_dict"], interval=60)
+    _send("nosql_dict")
+    repl.flush()
+    assert target.data == {"nosql_dict": {3: {"id": 3, "data": "c"}}}
+
+
+def test_nosql_sub_missing_pk_column():
+    target = DictTarget()
+    repl = nosql_sub(target, ["nosql_nopk"], interval=60)
+    # pk column is not "id" and not configured, the row is skipped
+    signal("nosql_nopk_write_raw").send({"values": {"uid": 1}})
+    signal("nosql_nopk_update_raw").send({
+        "before_values": {"uid": 1}, "after_values": {"uid": 2}})
+    signal("nosql_nopk_delete_raw").send({"values": {"uid": 1}})
+    signal("nosql_nopk_write_raw").send({"values": {"id": 2}})
+    repl.flush()
+    assert target.data == {"nosql_nopk": {2: {"id": 2}}}
+
+
+def test_nosql_sub_sqlite():
+    target = SQLiteTarget(":memory:")
+    repl = nosql_sub(target, ["nosql_sqlite"], interval=60)
+    _send("nosql_sqlite")
+    signal("nosql_sqlite_write_raw").send({"values": {
+        "id": 4, "data": "d", "ts": datetime.datetime(2015, 1, 1)}})
+    repl.flush()
+
+    assert target.get("nosql_sqlite", 1) is None
+    assert target.get("nosql_sqlite", 2) is None
+    assert target.get("nosql_sqlite", 3) == {"id": 3, "data": "c"}
+    assert target.get("nosql_sqlite", 4)["ts"] == "2015-01-01T00:00:00"
+
+
+def test_nosql_sub_redis(redis_dsn):
+    target = RedisHashTarget(redis_dsn, key="nosql:{table}:{pk}")
+    repl = nosql_sub(target, ["nosql_redis"],
+                     pk_columns={"nosql_redis": ("id", "data")},
+                     interval=60)
+    signal("nosql_redis_write_raw").send({"values": {
+        "id": 1, "data": "a", "ts": datetime.datetime(2015, 1, 1),
+        "note": None}})
+    repl.flush()
+
+    r = redis.StrictRedis.from_url(redis_dsn)
+    assert r.hgetall("nosql:nosql_redis:1:a") == {
+        b"id": b"1", b"data": b"a", b"ts": b"2015-01-01T00:00:00"}
+
+    signal("nosql_redis_delete_raw").send({"values": {"id": 1, "data": "a"}})
+    repl.flush()
+    assert not r.exists("nosql:nosql_redis:1:a")
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import pytest
+
+from meepo import protocol
+
+
+def test_protocol_int_pks():
+    frames = protocol.encode("test_update", [1, 2, 3], ts=1024,
+                             pos="mysql-bin.000001:120")
+    assert frames[0] == b"test_update"
+
+    msg = protocol.decode(frames)
+    assert msg.topic == "test_update"
+    assert msg.action == "update"
+    assert msg.ts == 1024
+    assert msg.pos == "mysql-bin.000001:120"
+    assert msg.pks == [1, 2, 3]
+
+
+def test_protocol_typed_pks():
+    pks = [1, u"a b", b"\x00\xff", (1, u"x"), 2 ** 70]
+    msg = protocol.decode(protocol.encode("test_write", pks))
+    assert msg.pks == pks
+    assert msg.action == "write"
+    assert msg.pos is None
+
+
+def test_protocol_corrupt():
+    topic, body = protocol.encode("test_delete", [(1, 2)])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode([topic, body[:-1]])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode([topic, b"\x02" + body[1:]])
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode([topic])
+
+
+def test_protocol_decode_string():
+    assert protocol.decode_string(b"test_write 1 2") == ("test_write",
+                                                         ["1", "2"])
+    assert protocol.decode_string("test_write") == ("test_write", [])
+
+
+def test_protocol_compression():
+    pks = list(range(1000)) + ["a"]
+    topic, body = protocol.encode("test_update", pks, compression="zlib")
+    assert len(body) < 1000 * 9 // 2
+    assert protocol.decode([topic, memoryview(body)]).pks == pks
+
+    # small body won't be compressed
+    topic, small = protocol.encode("test_update", [1], compression="zlib")
+    assert protocol.decode([topic, small]).pks == [1]
+
+
+@pytest.mark.parametrize("pks, flag", [
+    ([u"a", u"中", u""], protocol.FLAG_SEP_ARRAY),
+    ([b"a", b"\xff"], protocol.FLAG_SEP_ARRAY),
+    ([u"a\x00b", u"c"], protocol.FLAG_LEN_ARRAY),
+    ([b"\x00\x01", b"", b"\x02"], protocol.FLAG_LEN_ARRAY),
+    ([1, 2 ** 63], 0),
+])
+def test_protocol_array_pks(pks, flag):
+    topic, body = protocol.encode("test_write", pks)
+    assert body[1] & flag == flag
+    assert protocol.decode([topic, body]).pks == pks
+
+    # truncated array is detected
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode([topic, body[:-1]])
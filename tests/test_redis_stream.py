@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+
+import pytest
+import redis
+
+from meepo._compat import Empty
+from meepo.apps.replicator import RedisStreamReplicator
+from meepo.apps.replicator.worker import Worker
+from meepo.signals import signal
+from meepo.sub.redis_stream import redis_stream_sub, stream_key
+
+
+@pytest.fixture(scope="function")
+def r(request, redis_dsn):
+    r = redis.StrictRedis.from_url(redis_dsn)
+
+    def fin():
+        r.flushdb()
+    request.addfinalizer(fin)
+    return r
+
+
+def test_redis_stream_sub(r, redis_dsn):
+    repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1")
+    repl.subscribe("rs_update")
+    repl.connect()
+
+    batcher = redis_stream_sub(redis_dsn, ["rs"])
+    for pk in (1, 2, 1, (3, "a")):
+        signal("rs_update").send(pk)
+    batcher.flush()
+
+    assert repl.recv() == ("rs_update", [1, 2, (3, "a")])
+
+    # not acked entry will be re-delivered after restart
+    repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1")
+    repl.subscribe("rs_update")
+    repl.connect()
+    assert repl.recv() == ("rs_update", [1, 2, (3, "a")])
+
+    # acked on next recv
+    assert repl.recv() == (None, [])
+    repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1")
+    repl.subscribe("rs_update")
+    repl.connect()
+    assert repl.recv() == (None, [])
+
+
+def test_redis_stream_sub_partitioned(r, redis_dsn):
+    repls = []
+    for i in range(2):
+        repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1",
+                                     partitions=[i])
+        repl.connect()
+        repls.append(repl)
+
+    batcher = redis_stream_sub(redis_dsn, ["rsp"], partitions=2)
+    for pk in range(10):
+        signal("rsp_write").send(pk)
+    batcher.flush()
+
+    pks = []
+    for repl in repls:
+        topic, part_pks = repl.recv()
+        assert topic == "rsp_write"
+        pks.extend(part_pks)
+    assert sorted(pks) == list(range(10))
+
+
+def test_redis_stream_ack_after_callback(r, redis_dsn):
+    repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1")
+    repl.event("rsa_update")(lambda pk: True)
+    repl.connect()
+
+    batcher = redis_stream_sub(redis_dsn, ["rsa"])
+    for pk in (1, 2):
+        signal("rsa_update").send(pk)
+    batcher.flush()
+
+    def pending():
+        resp = r.execute_command(
+            "XPENDING", stream_key(repl.prefix, "rsa_update"), "test")
+        return resp["pending"] if isinstance(resp, dict) else resp[0]
+
+    topic, pks = repl.recv()
+    repl.dispatch(topic, pks)
+    queue, = repl.workers["rsa_update"]._queues
+    tasks = [queue.get(timeout=1) for _ in pks]
+    worker = Worker(queue, "test", None, ack_queue=repl.ack_queue)
+
+    # not acked while pks are only in the worker queues
+    assert repl.recv() == (None, [])
+    assert pending() == 1
+
+    worker.on_success(tasks[0][0], [tasks[0][1]])
+    assert repl.recv() == (None, [])
+    assert pending() == 1
+
+    # acked after callbacks on all pks are done
+    worker.on_fail(tasks[1][0], [tasks[1][1]])
+    assert queue.get(timeout=1) == tasks[1]
+    worker.on_success(tasks[1][0], [tasks[1][1]])
+    time.sleep(0.1)
+    assert repl.recv() == (None, [])
+    assert pending() == 0
+
+
+def test_redis_stream_recover_pending(r, redis_dsn):
+    def replicator(**kwargs):
+        repl = RedisStreamReplicator(redis_dsn, "test", consumer="c1",
+                                     **kwargs)
+        repl.event("rsr_update")(lambda pk: True)
+        repl.connect()
+        return repl
+
+    repl = replicator()
+    batcher = redis_stream_sub(redis_dsn, ["rsr"])
+    for pks in ((3, 4), (5,)):
+        for pk in pks:
+            signal("rsr_update").send(pk)
+        batcher.flush()
+    for pks in ([3, 4], [5]):
+        assert repl.recv() == ("rsr_update", pks)
+        repl.dispatch("rsr_update", pks)
+
+    # restarted with 2 pending entries, paged one by one and not
+    # re-delivered while the workers haven't acked them
+    repl = replicator(count=1)
+    for pks in ([3, 4], [5]):
+        assert repl.recv() == ("rsr_update", pks)
+        repl.dispatch("rsr_update", pks)
+    for _ in range(4):
+        assert repl.recv() == (None, [])
+    assert not repl._recovering
+
+    queue, = repl.workers["rsr_update"]._queues
+    tasks = []
+    while True:
+        try:
+            tasks.append(queue.get(timeout=0.5))
+        except Empty:
+            break
+    assert sorted(pk for pk, _ in tasks) == [3, 4, 5]
@@ -80,6 +80,30 @@ def test_worker_retry():
     assert result[0] == result[1] == result[2] == 4
 
 
+def test_worker_ack_queue():
+    ack_queue = Queue()
+
+    def func():
+        queue = Queue()
+        for i in range(3):
+            queue.put((i % 2, "entry-%s" % i))
+
+        worker = Worker(queue, "test", lambda pks: [True for _ in pks],
+                        multi=True, ack_queue=ack_queue)
+        worker.run()
+
+    p = Process(target=func)
+    try:
+        p.start()
+        tokens = []
+        while len(tokens) < 3:
+            tokens.extend(ack_queue.get(timeout=10))
+    finally:
+        p.terminate()
+
+    assert sorted(tokens) == ["entry-0", "entry-1", "entry-2"]
+
+
 def test_worker_pool():
     queues = [Queue() for i in range(3)]
     result = Manager().dict()
@@ -227,3 +251,51 @@ def test_rq_replicator():
 
     consumer.terminate()
     assert set(int(i) for i in result) == set(range(50))
+
+
+def test_rq_replicator_partitioned():
+    result = Manager().list()
+    endpoints = ["tcp://127.0.0.1:7001", "tcp://127.0.0.1:7002"]
+
+    def repl_process():
+        rq_repl = RqReplicator(endpoints, partitions=[1])
+
+        @rq_repl.event("restaurant_update")
+        def job(pks):
+            result.extend(pks)
+
+        rq_repl.run()
+
+    consumer = Process(target=repl_process)
+    consumer.start()
+
+    time.sleep(1)
+
+    ctx = zmq.Context()
+
+    def send_string():
+        socks = []
+        for endpoint in endpoints:
+            sock = ctx.socket(zmq.PUSH)
+            sock.bind(endpoint)
+            socks.append(sock)
+        time.sleep(0.5)
+        for i in range(10):
+            # partition 0 is not claimed, the send fails with EAGAIN
+            try:
+                socks[i % 2].send_string(
+                    "restaurant_update {}".format(i), zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+    producer = Process(target=send_string)
+    producer.start()
+    producer.join()
+
+    for i in range(200):
+        time.sleep(0.3)
+        if len(result) == 5:
+            break
+
+    consumer.terminate()
+    assert set(int(i) for i in result) == set(range(1, 10, 2))
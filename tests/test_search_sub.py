@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import sqlalchemy as sa
+
+from meepo.signals import signal
+from meepo.sub.search import SQLiteFTSSink, search_sub
+
+
+def test_search_sub(tmpdir):
+    engine = sa.create_engine("sqlite:///%s" % tmpdir.join("source.db"))
+    with engine.begin() as conn:
+        conn.execute(sa.text(
+            "CREATE TABLE search (id INTEGER PRIMARY KEY, data TEXT)"))
+        conn.execute(sa.text(
+            "INSERT INTO search VALUES (1, 'hello world'), (2, 'foo bar')"))
+
+    sink = SQLiteFTSSink(":memory:", {"search": ["data"]})
+    indexer = search_sub(engine, ["search"], sink, interval=60,
+                         mapper=lambda table, row: {"data": row["data"]})
+
+    signal("search_write").send(1)
+    signal("search_write").send(2)
+    indexer.flush()
+    assert sink.search("search", "hello") == ["1"]
+    assert sink.search("search", "foo") == ["2"]
+
+    with engine.begin() as conn:
+        conn.execute(sa.text("UPDATE search SET data = 'hello' WHERE id = 2"))
+        conn.execute(sa.text("DELETE FROM search WHERE id = 1"))
+    signal("search_update").send(2)
+    signal("search_delete").send(1)
+    indexer.flush()
+    assert sink.search("search", "hello") == ["2"]
+    assert sink.search("search", "foo") == []
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import itertools
+import os
+import threading
+import time
+
+from meepo.signals import signal
+from meepo.sub.segment import SegmentLog, SegmentReader, segment_sub
+
+
+def test_segment_sub(tmpdir):
+    path = str(tmpdir)
+    log = segment_sub(path, ["seg"])
+    signal("seg_write").send(1)
+    signal("seg_update").send((1, "a"))
+    log.flush()
+
+    reader = SegmentReader(path, follow=False)
+    assert list(reader) == [(0, "seg_write", [1]),
+                            (1, "seg_update", [(1, "a")])]
+
+
+def test_segment_log_roll_and_seek(tmpdir):
+    path = str(tmpdir)
+    log = SegmentLog(path, segment_bytes=1024, index_interval=128)
+    for i in range(100):
+        assert log.append("test_write", [i]) == i
+    log.flush()
+    assert len(os.listdir(path)) > 4
+
+    reader = SegmentReader(path, offset=42, follow=False)
+    assert [pks[0] for _, _, pks in reader] == list(range(42, 100))
+
+
+def test_segment_reader_commit(tmpdir):
+    path = str(tmpdir)
+    log = SegmentLog(path)
+    for i in range(10):
+        log.append("test_write", [i])
+    log.flush()
+
+    reader = SegmentReader(path, name="repl", follow=False)
+    for offset, _, _ in itertools.islice(reader, 4):
+        pass
+    reader.commit()
+
+    reader = SegmentReader(path, name="repl", follow=False)
+    assert reader.committed() == 4
+    assert [pks[0] for _, _, pks in reader] == list(range(4, 10))
+
+
+def test_segment_reader_follow(tmpdir):
+    path = str(tmpdir)
+    log = SegmentLog(path, segment_bytes=512, fsync_interval=0.01)
+    result = []
+
+    def consume():
+        reader = SegmentReader(path, poll_interval=0.01)
+        for _, _, pks in reader:
+            result.extend(pks)
+            if len(result) == 50:
+                break
+
+    t = threading.Thread(target=consume)
+    t.start()
+    for i in range(50):
+        log.append("test_write", [i])
+    t.join(5)
+
+    assert result == list(range(50))
+
+
+def test_segment_log_recover(tmpdir):
+    path = str(tmpdir)
+    log = SegmentLog(path)
+    for i in range(3):
+        log.append("test_write", [i])
+    log.close()
+
+    # simulate a torn write
+    with open(os.path.join(path, "%020d.log" % 0), "ab") as f:
+        f.write(b"\x00\x00\x00")
+
+    log = SegmentLog(path)
+    assert log.append("test_write", [3]) == 3
+    log.flush()
+    reader = SegmentReader(path, follow=False)
+    assert [pks[0] for _, _, pks in reader] == [0, 1, 2, 3]
+
+
+def test_segment_log_append_during_fsync(tmpdir, monkeypatch):
+    log = SegmentLog(str(tmpdir), fsync_interval=60)
+    log.append("test_write", [1])
+
+    syncing, release = threading.Event(), threading.Event()
+
+    def slow_fsync(fd):
+        syncing.set()
+        release.wait(5)
+    monkeypatch.setattr("meepo.sub.segment.os.fsync", slow_fsync)
+
+    t = threading.Thread(target=log.flush)
+    t.start()
+    assert syncing.wait(5)
+    # the append lock isn't held while fsync
+    start = time.time()
+    assert log.append("test_write", [2]) == 1
+    assert time.time() - start < 1
+    release.set()
+    t.join()
@@ -13,13 +13,14 @@ from sqlalchemy.ext.declarative import declarative_base
 from meepo.pub import sqlalchemy_pub
 from meepo.signals import signal
 
-(t_writes, t_updates, t_deletes) = ([] for _ in range(3))
+(t_writes, t_updates, t_deletes, s_batches) = ([] for _ in range(4))
 
 
 def _clear():
     del t_writes[:]
     del t_updates[:]
     del t_deletes[:]
+    del s_batches[:]
 
 
 def setup_module(module):
@@ -31,6 +32,11 @@ def setup_module(module):
     signal("test_update").connect(test_sg(t_updates), weak=False)
     signal("test_delete").connect(test_sg(t_deletes), weak=False)
 
+    # connect session batch signal
+    def test_session_batch(session, event):
+        s_batches.append(event)
+    signal("session_batch").connect(test_session_batch, weak=False)
+
 
 def teardown_module(module):
     pass
@@ -71,7 +77,7 @@ def test_sa_empty_commit(session):
     """
     session.commit()
 
-    assert [t_writes, t_updates, t_deletes] == [[]] * 3
+    assert [t_writes, t_updates, t_deletes, s_batches] == [[]] * 4
 
 
 def test_sa_single_write(session, model_cls):
@@ -107,6 +113,7 @@ def test_sa_multi_writes(session, model_cls):
 
     assert set(t_writes) == {t_c.id, t_d.id}
     assert [t_updates, t_deletes] == [[]] * 2
+    assert s_batches == [{"test_write": {t_c.id, t_d.id}}]
 
 
 def test_sa_single_update(session, model_cls):
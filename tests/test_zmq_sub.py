@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+import time
+
+import zmq
+
+from meepo.protocol import decode, partition
+from meepo.signals import signal
+from meepo.sub.zmq import zmq_sub, _Sender
+
+
+def _sub_socket(dsn, topic=""):
+    sock = zmq.Context.instance().socket(zmq.SUB)
+    sock.setsockopt(zmq.SUBSCRIBE, topic.encode("utf-8"))
+    sock.setsockopt(zmq.RCVTIMEO, 3000)
+    sock.connect(dsn)
+    # wait for the slow joiner
+    time.sleep(0.3)
+    return sock
+
+
+def test_zmq_sub():
+    dsn = "tcp://127.0.0.1:6101"
+    zmq_sub(dsn, ["zmq_plain"])
+    sock = _sub_socket(dsn)
+
+    for pk in (1, 2):
+        signal("zmq_plain_write").send(pk)
+
+    assert sock.recv_string() == "zmq_plain_write 1"
+    assert sock.recv_string() == "zmq_plain_write 2"
+    sock.close()
+
+
+def test_zmq_sub_batch():
+    dsn = "tcp://127.0.0.1:6102"
+    zmq_sub(dsn, ["zmq_batch"], batch_size=500, batch_interval=0.05)
+    sock = _sub_socket(dsn)
+
+    for pk in (1, 2, 1, 3, 2):
+        signal("zmq_batch_update").send(pk)
+    signal("zmq_batch_delete").send(4)
+
+    msgs = {sock.recv_string() for _ in range(2)}
+    assert msgs == {"zmq_batch_update 1 2 3", "zmq_batch_delete 4"}
+    sock.close()
+
+
+def test_zmq_sub_batch_size():
+    dsn = "tcp://127.0.0.1:6103"
+    zmq_sub(dsn, ["zmq_batch_size"], batch_size=3, batch_interval=60)
+    sock = _sub_socket(dsn)
+
+    for pk in range(3):
+        signal("zmq_batch_size_write").send(pk)
+
+    # flushed by size without waiting for the interval
+    assert sock.recv_string() == "zmq_batch_size_write 0 1 2"
+    sock.close()
+
+
+def test_zmq_sub_binary():
+    dsn = "tcp://127.0.0.1:6104"
+    zmq_sub(dsn, ["zmq_binary"], protocol="binary")
+    sock = _sub_socket(dsn)
+
+    signal("mysql_binlog_pos").send("mysql-bin.000001:4")
+    signal("zmq_binary_write").send((1, "a"))
+
+    msg = decode(sock.recv_multipart())
+    assert msg.topic == "zmq_binary_write"
+    assert msg.pks == [(1, "a")]
+    assert msg.pos == "mysql-bin.000001:4"
+    sock.close()
+
+
+def test_zmq_sub_noblock():
+    dsn = "tcp://127.0.0.1:6105"
+    zmq_sub(dsn, ["zmq_noblock"], sndhwm=1000, noblock=True)
+    sock = _sub_socket(dsn)
+
+    signal("zmq_noblock_write").send(1)
+    assert sock.recv_string() == "zmq_noblock_write 1"
+    sock.close()
+
+
+def test_sender_stats():
+    sent = []
+
+    def send(topic, pks):
+        if topic == "drop":
+            return len(pks)
+        sent.append((topic, pks))
+
+    sender = _Sender(send, max_queue=2)
+    # fill the queue before the sender thread wakes up
+    sender._queue.extend([("a", [0]), ("a", [0])])
+    assert sender.put("a", [1, 2]) is False
+
+    sender._queue.clear()
+    sender.put("a", [1])
+    sender.put("drop", [2, 3])
+    sender.flush()
+
+    assert sent == [("a", [1])]
+    assert sender.stats == {"sent": 1, "dropped": 2, "overflow": 2}
+
+
+def test_partition():
+    assert partition(1, 3) == partition(1, 3)
+    assert partition((1, "a"), 3) == partition((1, "a"), 3)
+    assert {partition(pk, 3) for pk in range(100)} == {0, 1, 2}
+
+
+def test_zmq_sub_partitioned():
+    dsns = ["tcp://127.0.0.1:6106", "tcp://127.0.0.1:6107"]
+    zmq_sub(dsns, ["zmq_partitioned"], partitioned=True,
+            batch_size=100, batch_interval=0.05)
+
+    socks = []
+    for dsn in dsns:
+        sock = zmq.Context.instance().socket(zmq.PULL)
+        sock.setsockopt(zmq.RCVTIMEO, 3000)
+        sock.connect(dsn)
+        socks.append(sock)
+
+    for pk in range(10):
+        signal("zmq_partitioned_update").send(pk)
+
+    for i, sock in enumerate(socks):
+        topic, pks = sock.recv_string().split(" ", 1)
+        pks = [int(pk) for pk in pks.split()]
+        assert topic == "zmq_partitioned_update"
+        assert pks == [pk for pk in range(10) if partition(pk, 2) == i]
+        sock.close()
+
+
+def test_zmq_sub_compression():
+    dsn = "tcp://127.0.0.1:6108"
+    zmq_sub(dsn, ["zmq_compress"], protocol="binary", batch_size=2000,
+            compression="zlib", compress_threshold=1024, copy_threshold=1024)
+    sock = _sub_socket(dsn)
+
+    for pk in range(2000):
+        signal("zmq_compress_write").send(pk)
+
+    frames = sock.recv_multipart(copy=False)
+    assert len(frames[1].bytes) < 2000 * 8
+    assert decode([f.buffer for f in frames]).pks == list(range(2000))
+    sock.close()